@@ -14,10 +14,118 @@ The selected regions can be saved to a CSV file, and the number of stars in each
 The CMDFiducialSelector class allows the user to interactively select fiducial lines in a CMD plot by clicking on the plot.
 The selected fiducial line points can be saved to a CSV file for further analysis.
 
+The regions are counted with a vectorized classifier: a regions file is read only once, the stars are
+prefiltered with the bounding boxes of the polygons and tested against all the polygons together with
+a NumPy ray-casting test (see CMDRegionSelector.classify_stars).
+
+Both classes can be created with interactive=False to skip the figure and the widgets (e.g. to count the
+stars in saved regions on a machine without a display). matplotlib is imported only when a plot is drawn,
+and the region and fiducial line logic is also available as plain functions (count_regions, save_regions,
+save_fiducial_line) that can be used in scripts and worker processes.
+
+With density=True the stars are drawn once as a 2D histogram image (Hess diagram) instead of one marker
+per star, and the selected fiducial points are drawn with blitting, so a click only redraws the line.
+
+
 '''
 
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+# Regions files already read, keyed by path and modification time
+_regions_cache = {}
+
+
+def save_regions(regions, output_file):
+    """
+    Save regions to a CSV file with columns Region_ID, X, Y.
+
+    Parameters:
+        regions (list): List of regions, each one a list of (x, y) vertices.
+        output_file (str): Path to the CSV file.
+    """
+    with open(output_file, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Region_ID", "X", "Y"])  # Header
+        for i, region in enumerate(regions):
+            for x, y in region:
+                writer.writerow([i, x, y])
+
+
+def count_regions(colors, mags, regions_file):
+    """
+    Count the stars in the regions saved in a CSV file, without any plot.
+
+    Parameters:
+        colors (array-like): Color of the stars (x axis of the CMD).
+        mags (array-like): Magnitude of the stars (y axis of the CMD).
+        regions_file (str): Path to the CSV file with saved regions.
+
+    Returns:
+        pd.DataFrame: Number of stars in each region, with columns Region_ID and Stars.
+    """
+    _, region_count = CMDRegionSelector.classify_stars(colors, mags, regions_file)
+    return region_count
+
+
+def hess_image(colors, mags, bins=400, scale='log'):
+    """
+    2D histogram of the CMD, scaled to be drawn as an image.
+
+    Parameters:
+        colors (array-like): Color of the stars (x axis of the CMD).
+        mags (array-like): Magnitude of the stars (y axis of the CMD).
+        bins (int or tuple): Number of bins in color and magnitude.
+        scale (str): 'linear', 'log' or 'eq_hist' (histogram equalization, so that the crowded
+            main sequence and the sparse branches are visible together).
+
+    Returns:
+        tuple: (image, extent) to be used as ax.imshow(image, extent=extent, origin='lower').
+    """
+    colors = np.asarray(colors, dtype=float)
+    mags = np.asarray(mags, dtype=float)
+    finite = np.isfinite(colors) & np.isfinite(mags)
+    counts, color_edges, mag_edges = np.histogram2d(colors[finite], mags[finite], bins=bins)
+    counts = counts.T
+
+    if scale == 'log':
+        image = np.log10(1 + counts)
+    elif scale == 'eq_hist':
+        # Rank of the count of each bin among the non-empty bins
+        levels = np.unique(counts[counts > 0])
+        image = np.searchsorted(levels, counts, side='right') / max(len(levels), 1)
+    elif scale == 'linear':
+        image = counts
+    else:
+        raise ValueError(f"Unknown scale '{scale}', use 'linear', 'log' or 'eq_hist'.")
+
+    image = np.ma.masked_equal(image, 0)
+    extent = (color_edges[0], color_edges[-1], mag_edges[0], mag_edges[-1])
+    return image, extent
+
+
+def draw_cmd(ax, colors, mags, density=False, bins=400, scale='log', s=0.5, alpha=0.4):
+    """Draw the stars of a CMD as points or, with density=True, as a Hess diagram image."""
+    if density:
+        image, extent = hess_image(colors, mags, bins=bins, scale=scale)
+        return ax.imshow(image, extent=extent, origin='lower', aspect='auto', cmap='Greys',
+                         interpolation='nearest', zorder=1)
+    return ax.scatter(colors, mags, s=s, c='black', alpha=alpha, zorder=1)
+
+
+def save_fiducial_line(fiducial_points, output_file):
+    """Save fiducial line points to a CSV file with columns X, Y."""
+    with open(output_file, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['X', 'Y'])
+        writer.writerows(fiducial_points)
+
+
 class CMDRegionSelector:
-    def __init__(self, data, color, magnitude, color_bound_bin_high=None, magnitude_bound_bin_high=None, color_bound_bin_low=None, magnitude_bound_bin_low=None, x_label=None, y_label=None, output_file="selected_regions.csv"):
+    def __init__(self, data, color, magnitude, color_bound_bin_high=None, magnitude_bound_bin_high=None, color_bound_bin_low=None, magnitude_bound_bin_low=None, x_label=None, y_label=None, output_file="selected_regions.csv", interactive=True, density=False, bins=400):
         self.data = data
         self.color = color
         self.magnitude = magnitude
@@ -28,11 +136,14 @@ class CMDRegionSelector:
         self.x_label = x_label
         self.y_label = y_label
         self.output_file = output_file
+        self.density = density
+        self.bins = bins
         self.current_region = None
         self.saved_regions = []
         self.save_button = None
         self.selector = None
-        self.init_plot()
+        if interactive:
+            self.init_plot()
 
     def save_region(self, event):
         """Save the current region when the button is clicked."""
@@ -45,13 +156,8 @@ class CMDRegionSelector:
 
     def save_to_file(self):
         """Save selected regions to a CSV file."""
-        with open(self.output_file, "w", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["Region_ID", "X", "Y"])  # Header
-            for i, region in enumerate(self.saved_regions):
-                for x, y in region:
-                    writer.writerow([i, x, y])
-            print(f"Regions saved to '{self.output_file}'.")
+        save_regions(self.saved_regions, self.output_file)
+        print(f"Regions saved to '{self.output_file}'.")
 
     def on_select(self, verts):
         """Callback function for PolygonSelector."""
@@ -60,8 +166,11 @@ class CMDRegionSelector:
 
     def init_plot(self):
         """Initialize the CMD plot with interactive selection."""
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import PolygonSelector
+
         self.fig, self.ax = plt.subplots(figsize=(8, 8))
-        self.ax.scatter(self.color, self.magnitude, s=0.5, c='black', alpha=0.4, zorder=1)
+        draw_cmd(self.ax, self.color, self.magnitude, density=self.density, bins=self.bins, s=0.5)
         self.ax.scatter(self.color_bound_bin, self.magnitude_bound_bin, s=15, c='red', label='boundary', marker='o', zorder=4)
         self.ax.scatter(self.color_bound_bin_low, self.magnitude_bound_bin_low, s=15, c='red', marker='o', zorder=4)
         self.ax.invert_yaxis()
@@ -78,6 +187,9 @@ class CMDRegionSelector:
 
     def create_save_button(self):
         """Create a button to save the selected region."""
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Button
+
         button_ax = self.fig.add_axes([0.7, 0.01, 0.1, 0.05])  # Centered button
         self.save_button = Button(button_ax, 'Save')
         self.save_button.on_clicked(self.save_region)
@@ -100,24 +212,103 @@ class CMDRegionSelector:
             print(f"File '{file_name}' not found.")
         return regions
     
+    @staticmethod
+    def load_regions_cached(file_name):
+        """
+        Load saved regions from a CSV file as arrays of vertices, reading each file only once.
+
+        Returns:
+            dict: Region_ID -> (n, 2) array with the vertices of the polygon.
+        """
+        key = (os.path.abspath(file_name), os.path.getmtime(file_name))
+        if key not in _regions_cache:
+            regions = pd.read_csv(file_name)
+            _regions_cache[key] = {region_id: np.column_stack((region["X"], region["Y"])).astype(float)
+                                   for region_id, region in regions.groupby("Region_ID", sort=False)}
+        return _regions_cache[key]
+
+    @staticmethod
+    def regions_membership(regions, colors, mags, chunk_size=65536):
+        """
+        Test all the stars against all the regions in one pass.
+
+        Parameters:
+            regions (dict): Region_ID -> (n, 2) vertices of the polygon.
+            colors (array-like): Color of the stars (x axis of the CMD).
+            mags (array-like): Magnitude of the stars (y axis of the CMD).
+            chunk_size (int): Number of stars tested together, to bound the memory.
+
+        Returns:
+            np.ndarray: Boolean array with shape (n_stars, n_regions), True if the star is inside the region.
+        """
+        colors = np.asarray(colors, dtype=float)
+        mags = np.asarray(mags, dtype=float)
+        polygons = [np.asarray(vertices, dtype=float) for vertices in regions.values()]
+        inside = np.zeros((len(colors), len(polygons)), dtype=bool)
+        if not polygons:
+            return inside
+
+        # Edges of all the polygons (closed) and index of the first edge of each polygon
+        start = np.concatenate(polygons)
+        end = np.concatenate([np.roll(polygon, -1, axis=0) for polygon in polygons])
+        first_edge = np.cumsum([0] + [len(polygon) for polygon in polygons[:-1]])
+        low = np.array([polygon.min(axis=0) for polygon in polygons])
+        high = np.array([polygon.max(axis=0) for polygon in polygons])
+
+        # Only the stars inside the bounding box of at least one polygon need the full test
+        candidates = np.flatnonzero((colors >= low[:, 0].min()) & (colors <= high[:, 0].max()) &
+                                    (mags >= low[:, 1].min()) & (mags <= high[:, 1].max()))
+
+        for i in range(0, len(candidates), chunk_size):
+            stars = candidates[i:i + chunk_size]
+            x = colors[stars, None]
+            y = mags[stars, None]
+
+            # Ray casting: count the edges crossed by a horizontal ray going right from each star
+            crosses = (start[:, 1] > y) != (end[:, 1] > y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = start[:, 0] + (y - start[:, 1]) * (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+            hits = np.add.reduceat(crosses & (x < x_cross), first_edge, axis=1, dtype=np.int32)
+
+            in_box = (x >= low[:, 0]) & (x <= high[:, 0]) & (y >= low[:, 1]) & (y <= high[:, 1])
+            inside[stars] = (hits % 2 == 1) & in_box
+
+        return inside
+
+    @staticmethod
+    def classify_stars(colors, mags, regions_file):
+        """
+        Assign each star to the region it falls in.
+
+        Parameters:
+            colors (array-like): Color of the stars (x axis of the CMD).
+            mags (array-like): Magnitude of the stars (y axis of the CMD).
+            regions_file (str): Path to the CSV file with saved regions.
+
+        Returns:
+            tuple: (labels, region_count) where labels holds the Region_ID of each star (-1 outside all the
+            regions, the first region in the file if regions overlap) and region_count is a DataFrame with
+            the number of stars in each region.
+        """
+        regions = CMDRegionSelector.load_regions_cached(regions_file)
+        region_ids = np.array(list(regions), dtype=int)
+        inside = CMDRegionSelector.regions_membership(regions, colors, mags)
+
+        labels = np.full(len(inside), -1, dtype=int)
+        found = inside.any(axis=1)
+        labels[found] = region_ids[inside[found].argmax(axis=1)]
+
+        region_count = pd.DataFrame({'Region_ID': region_ids, 'Stars': inside.sum(axis=0)})
+        return labels, region_count
+
     @staticmethod
     def count_stars_in_region(region, colors, mags):
         """Count stars in a region defined by a polygon."""
-        path = Path(region)
-        points = np.column_stack((colors, mags))
-        return np.sum(path.contains_points(points))
+        return np.sum(CMDRegionSelector.regions_membership({0: region}, colors, mags)[:, 0])
     
     def analyze_regions(self, regions_file):
         """Count stars in the loaded regions."""
-        regions = self.load_regions(regions_file)
-        regions_stars_dict = {'Region_ID': [], 'Stars': []}
-        
-        for region_id, region in regions.items():
-            count = self.count_stars_in_region(region, self.color, self.magnitude)
-            regions_stars_dict['Region_ID'].append(region_id)
-            regions_stars_dict['Stars'].append(count)
-        
-        region_count = pd.DataFrame(regions_stars_dict)
+        region_count = count_regions(self.color, self.magnitude, regions_file)
         print(region_count)
         return region_count
 
@@ -136,25 +327,15 @@ class CMDRegionSelector:
         Returns:
         - pd.DataFrame: DataFrame containing only the stars inside the selected region.
         """
-        # Load saved regions
-        regions = pd.read_csv(regions_file)
-
-        # Extract the selected region
-        selected_region = regions[regions["Region_ID"] == region_id]
+        # Load saved regions (the file is read only the first time)
+        regions = CMDRegionSelector.load_regions_cached(regions_file)
 
-        if selected_region.empty:
+        if region_id not in regions:
             print(f"Region {region_id} not found.")
             return None
 
-        # Convert region coordinates into a polygon
-        polygon_vertices = np.column_stack((selected_region["X"], selected_region["Y"]))
-        region_path = Path(polygon_vertices)
-
-        # Get star positions
-        star_positions = np.column_stack((color, magnitude))
-
         # Create a mask for stars inside the region
-        inside_mask = region_path.contains_points(star_positions)
+        inside_mask = CMDRegionSelector.regions_membership({region_id: regions[region_id]}, color, magnitude)[:, 0]
 
         # Return a DataFrame of stars inside the region
         return data[inside_mask]
@@ -184,10 +365,20 @@ And to count the number of stars in the selected regions:
 
 region_vis_count = cmd_select_vis.analyze_regions('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_F606W_F814W.csv')
 
+With many stars, draw the CMD as a density image:
+
+cmd_select_vis = CMDRegionSelector(data=data, color=data['F606W'] - data['F814W'], magnitude=data['F814W'],
+                                   x_label='F606W-F814W', y_label='F814W', density=True, bins=500)
+
+Without the plot (e.g. in a script or in a worker process):
+
+region_vis_count = count_regions(data['F606W'] - data['F814W'], data['F814W'],
+                                 '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_F606W_F814W.csv')
+
 '''
 
 class CMDFiducialSelector:
-    def __init__(self, data, color, magnitude, x_label=None, y_label=None, output_file='fiducial_lines.csv', xlim=None, ylim=None, invert_yaxis=True):
+    def __init__(self, data, color, magnitude, x_label=None, y_label=None, output_file='fiducial_lines.csv', xlim=None, ylim=None, invert_yaxis=True, interactive=True, density=False, bins=400):
         self.data = data
         self.color = color
         self.magnitude = magnitude
@@ -197,14 +388,24 @@ class CMDFiducialSelector:
         self.xlim = xlim
         self.ylim = ylim
         self.invert_yaxis = invert_yaxis
+        self.density = density
+        self.bins = bins
         self.fiducial_points = []
-        self.fig, self.ax = plt.subplots(figsize=(6, 6))
+        self.fig, self.ax = None, None
         self.cid = None  # Event connection ID
-        self.init_plot()
+        self.line = None  # Selected points, drawn with blitting
+        self.background = None
+        if interactive:
+            self.init_plot()
 
     def init_plot(self):
         """Initialize the CMD plot with interactive selection."""
-        self.ax.scatter(self.color, self.magnitude, s=1, c='black', alpha=0.4, zorder=1)
+        import matplotlib.pyplot as plt
+
+        self.fig, self.ax = plt.subplots(figsize=(6, 6))
+        draw_cmd(self.ax, self.color, self.magnitude, density=self.density, bins=self.bins, s=1)
+        self.line, = self.ax.plot([], [], c='red', marker='o', markersize=4.5, linestyle='-', linewidth=1,
+                                  zorder=2, animated=True)
         
         if self.xlim:
             self.ax.set_xlim(self.xlim)
@@ -217,6 +418,7 @@ class CMDFiducialSelector:
         self.ax.set_xlabel(self.x_label)
         self.ax.set_ylabel(self.y_label)
         self.cid = self.fig.canvas.mpl_connect('button_press_event', self.on_click)
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
         self.create_save_button()
         plt.show(block=True)
 
@@ -224,25 +426,37 @@ class CMDFiducialSelector:
         """Capture clicks to select fiducial line points."""
         if event.inaxes == self.ax:
             self.fiducial_points.append((event.xdata, event.ydata))
-            self.ax.scatter(event.xdata, event.ydata, c='red', s=20, zorder=2)
-            if len(self.fiducial_points) > 1:
-                x_vals, y_vals = zip(*self.fiducial_points)
-                self.ax.plot(x_vals, y_vals, c='red', linestyle='-', linewidth=1, zorder=2)
-            self.fig.canvas.draw()
+            x_vals, y_vals = zip(*self.fiducial_points)
+            self.line.set_data(x_vals, y_vals)
+            self.blit_line()
             print(f'Selected point: ({event.xdata:.3f}, {event.ydata:.3f})')
 
+    def on_draw(self, event):
+        """Save the background after a full redraw (e.g. zoom or resize) and draw the line on top."""
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def blit_line(self):
+        """Redraw only the selected points over the saved background."""
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self.background)
+        self.ax.draw_artist(self.line)
+        canvas.blit(self.ax.bbox)
+
     def create_save_button(self):
         """Create a button to save the selected fiducial line."""
+        from matplotlib.widgets import Button
+
         button_ax = self.fig.add_axes([0.7, 0.01, 0.1, 0.05])
         self.save_button = Button(button_ax, 'Save')
         self.save_button.on_clicked(self.save_fiducial_line)
 
     def save_fiducial_line(self, event):
         """Save the selected fiducial line points to a CSV file."""
-        with open(self.output_file, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['X', 'Y'])
-            writer.writerows(self.fiducial_points)
+        save_fiducial_line(self.fiducial_points, self.output_file)
         print(f'Fiducial line saved to {self.output_file}')
 
     @staticmethod
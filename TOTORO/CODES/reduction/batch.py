@@ -0,0 +1,97 @@
+'''''
+Shared driver to run the reduction scripts on many exposures at once.
+
+Every script processes one file with a function (filter_data, plot_qfit_vs_magnitude,
+plot_residuals, ...). run_batch calls that function for each input file, in a pool
+of processes when more than one job is requested, and prints what every file
+printed together with a summary of the timings and of the errors. run_batch returns
+the number of files that failed, so the scripts can exit with a non-zero status.
+The output is always printed in the order of the input files, so it does not
+depend on which exposure finishes first.
+'''''
+
+import contextlib
+import io
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+def add_jobs_argument(parser):
+    """Add the -j/--jobs option to the argument parser of a script."""
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of files processed in parallel (0 uses all the available CPUs)")
+    return parser
+
+
+def _run_one(function, input_file, args):
+    """Run function on one file, capturing its output, its timing and the error (if any)."""
+    buffer = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        try:
+            function(input_file, *args)
+        except Exception:
+            error = traceback.format_exc()
+    return {'file': input_file, 'time': time.perf_counter() - start, 'output': buffer.getvalue(), 'error': error}
+
+
+def run_batch(function, input_files, jobs=1, args=()):
+    """
+    Run function(input_file, *args) for every input file.
+
+    Parameters:
+        function (callable): Function processing a single file. It must be defined at module level
+            so that it can be sent to the worker processes.
+        input_files (list[str]): Files to process.
+        jobs (int): Number of worker processes. 1 runs the files one after the other in this process,
+            0 uses all the available CPUs.
+        args (tuple): Extra positional arguments passed to function after the file name.
+
+    Returns:
+        int: Number of files that failed (their errors are printed in the summary).
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(input_files)))
+
+    results = []
+    if jobs == 1:
+        for input_file in input_files:
+            print(f"Processing file: {input_file}")
+            result = _run_one(function, input_file, args)
+            print(result['output'], end='')
+            results.append(result)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_run_one, function, input_file, args) for input_file in input_files]
+            # Wait for the files in input order, so the printed output is deterministic
+            for input_file, future in zip(input_files, futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    # A worker killed while running (e.g. out of memory) breaks the whole pool: every file
+                    # still pending is recorded as failed instead of losing the summary
+                    result = {'file': input_file, 'time': 0.0, 'output': '', 'error': traceback.format_exc()}
+                print(f"Processing file: {input_file}")
+                print(result['output'], end='')
+                results.append(result)
+
+    print_summary(results)
+    return sum(result['error'] is not None for result in results)
+
+
+def print_summary(results):
+    """Print the time spent on every file and the errors."""
+    failed = [result for result in results if result['error'] is not None]
+
+    print(f"\nProcessed {len(results)} files ({len(failed)} failed)")
+    for result in results:
+        status = 'FAILED' if result['error'] is not None else 'ok'
+        print(f"  {result['time']:8.2f} s  {status:6}  {result['file']}")
+
+    for result in failed:
+        print(f"\nError in {result['file']}:")
+        print(result['error'], end='')
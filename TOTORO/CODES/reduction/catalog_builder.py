@@ -0,0 +1,434 @@
+'''''
+Build the multi-band catalogue (catalog.xym) from the .lnk files of the single filters.
+
+catalog_creation.ipynb puts the .lnk tables side by side on their index, which only
+works if all the files have the same stars in the same order. Here every band is
+cross-matched on the (x, y) position instead: the stars of a band are matched to the
+closest star of the catalogue within the match radius with a KD-tree, each catalogue
+star getting at most one star per band (the closest one).
+The .lnk files are read in parallel and only the columns of the notebook are kept
+(dx, dy, x, y, F814W and the magnitude of the band), with the same dr < 0.5 cut.
+
+The catalogue is saved as a folder with one .npy file per column (see xym_io.write_columnar)
+and optionally also as the tab separated catalog.xym. The 'match' column is a bit mask
+of the bands in which every star was found (bit i for the i-th band), missing
+magnitudes are NaN.
+
+The folder also keeps the provenance of every band (path, size, modification time,
+SHA-1 of the content and number of rows after the dr cut). rebuild_catalog compares
+it with the .lnk files and, when only some bands changed, reads and cross-matches
+only those bands, rewriting their columns and the match flags. Every column has a
+version (a hash of the inputs it depends on), and the derived tables saved in the
+catalogue folder (colors, region labels, ...) remember the versions of the columns
+they were computed from: after a rebuild only the ones using a changed column are
+removed, e.g.
+
+    catalog, changed = rebuild_catalog(files, 'Catalogs/catalog', text_file='Catalogs/catalog.xym')
+    color = derived('Catalogs/catalog', 'F275W-F336W', ['F275W', 'F336W'],
+                    lambda catalog: catalog['F275W'] - catalog['F336W'])
+'''''
+
+import os
+import argparse
+import hashlib
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from batch import add_jobs_argument
+from xym_io import read_columnar, read_metadata, read_xym, update_columnar, write_columnar
+
+
+def read_band(input_file, band, max_dr=0.5):
+    """
+    Read the stars of one band from a .lnk file.
+
+    Parameters:
+        input_file (str): Path of the .lnk file.
+        band (str): Name of the filter (name of the magnitude column).
+        max_dr (float): Keep only the stars with sqrt(dx**2 + dy**2) < max_dr.
+
+    Returns:
+        pd.DataFrame: Columns x, y, F814W and band.
+    """
+    data = read_xym(input_file, usecols=[2, 3, 4, 5, 6, 15], names=['dx', 'dy', 'x', 'y', 'F814W', band])
+    keep = np.hypot(data['dx'].to_numpy(), data['dy'].to_numpy()) < max_dr
+    return data.loc[keep, ['x', 'y', 'F814W', band]].reset_index(drop=True)
+
+
+def band_name(input_file):
+    """Name of the band of a .lnk file (e.g. F225W for /path/F225W.lnk)."""
+    return os.path.splitext(os.path.basename(input_file))[0]
+
+
+def cross_match(x1, y1, x2, y2, radius=0.5):
+    """
+    One-to-one match of the points 2 to the points 1 within radius.
+
+    Every point 2 is matched to the closest point 1; when more points 2 have the same
+    closest point 1, only the closest of them is kept.
+
+    Returns:
+        tuple: (indices, distances) with one value per point 1: the index of the matched
+        point 2 (-1 if none) and the distance (NaN if none).
+    """
+    indices = np.full(len(x1), -1, dtype=np.int64)
+    distances = np.full(len(x1), np.nan)
+    if len(x1) == 0 or len(x2) == 0:
+        return indices, distances
+
+    tree = cKDTree(np.column_stack((x1, y1)), balanced_tree=False, compact_nodes=False)
+    distance, nearest = tree.query(np.column_stack((x2, y2)), distance_upper_bound=radius)
+    candidates = np.flatnonzero(np.isfinite(distance))
+
+    # Closest point 2 first, then keep the first one of every point 1
+    candidates = candidates[np.argsort(distance[candidates], kind='stable')]
+    _, first = np.unique(nearest[candidates], return_index=True)
+    matched = candidates[first]
+    indices[nearest[matched]] = matched
+    distances[nearest[matched]] = distance[matched]
+    return indices, distances
+
+
+def build_catalog(input_files, bands=None, reference=None, radius=0.5, max_dr=0.5, union=False, jobs=1):
+    """
+    Cross-match the .lnk files of many bands in one catalogue.
+
+    Parameters:
+        input_files (list[str]): .lnk files, one per band.
+        bands (list[str]): Names of the bands, default the names of the files (F225W.lnk -> F225W).
+        reference (str): Band whose stars (and positions) make the catalogue, default the last one
+            (F555W in catalog_creation.ipynb).
+        radius (float): Match radius in pixels.
+        max_dr (float): dr cut applied to every .lnk file.
+        union (bool): If True, the stars of the other bands without a match are added to the catalogue,
+            otherwise the catalogue has only the stars of the reference band.
+        jobs (int): Number of files read in parallel, 0 uses all the available CPUs.
+
+    Returns:
+        pd.DataFrame: Columns x, y, F814W, one column per band (in the order of the files) and match.
+    """
+    bands = [band_name(input_file) for input_file in input_files] if bands is None else list(bands)
+    reference = bands[-1] if reference is None else reference
+    if reference not in bands:
+        raise ValueError(f"Reference band {reference} is not one of the bands {bands}.")
+    if len(bands) > 63:
+        raise ValueError("At most 63 bands fit in the match flags.")
+
+    tables = read_bands(input_files, bands, max_dr=max_dr, jobs=jobs)
+    return assemble_catalog(tables, bands, reference=reference, radius=radius, union=union)
+
+
+def read_bands(input_files, bands, max_dr=0.5, jobs=1):
+    """Read the .lnk files of many bands in parallel, returning a dict band -> table (see read_band)."""
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(input_files)))
+    if jobs == 1:
+        tables = [read_band(input_file, band, max_dr) for input_file, band in zip(input_files, bands)]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            tables = list(executor.map(read_band, input_files, bands, [max_dr] * len(bands)))
+    return dict(zip(bands, tables))
+
+
+def match_band(x, y, table, band, radius=0.5):
+    """Magnitudes of a band for the catalogue stars at (x, y), NaN where there is no match, and the match mask."""
+    indices, _ = cross_match(x, y, table['x'].to_numpy(), table['y'].to_numpy(), radius)
+    found = indices >= 0
+    values = np.full(len(x), np.nan)
+    values[found] = table[band].to_numpy()[indices[found]]
+    return values, found, indices
+
+
+def assemble_catalog(tables, bands, reference=None, radius=0.5, union=False):
+    """Cross-match the tables of read_bands in one catalogue, see build_catalog."""
+    reference = bands[-1] if reference is None else reference
+    first = tables[reference]
+    columns = {'x': first['x'].to_numpy(), 'y': first['y'].to_numpy(), 'F814W': first['F814W'].to_numpy()}
+    magnitudes = {reference: first[reference].to_numpy()}
+    match = np.full(len(first), 1 << bands.index(reference), dtype=np.int64)
+
+    for bit, band in enumerate(bands):
+        if band == reference:
+            continue
+        table = tables[band]
+        values, found, indices = match_band(columns['x'], columns['y'], table, band, radius)
+        match[found] |= 1 << bit
+
+        if union:
+            # Stars found only in this band become new rows of the catalogue
+            extra = np.ones(len(table), dtype=bool)
+            extra[indices[found]] = False
+            n_extra = np.count_nonzero(extra)
+            for name in columns:
+                columns[name] = np.concatenate((columns[name], table[name].to_numpy()[extra]))
+            for name in magnitudes:
+                magnitudes[name] = np.concatenate((magnitudes[name], np.full(n_extra, np.nan)))
+            values = np.concatenate((values, table[band].to_numpy()[extra]))
+            match = np.concatenate((match, np.full(n_extra, 1 << bit, dtype=np.int64)))
+        magnitudes[band] = values
+
+    catalog = pd.DataFrame(columns)
+    for band in bands:
+        catalog[band] = magnitudes[band]
+    catalog['match'] = match
+    return catalog
+
+
+def band_mask(catalog, bands, all_bands):
+    """
+    Stars found in all the requested bands.
+
+    Parameters:
+        catalog (pd.DataFrame): Catalogue of build_catalog.
+        bands (list[str]): Bands that must be present.
+        all_bands (list[str]): Bands of the catalogue, in the order of the match bits.
+
+    Returns:
+        np.ndarray: Boolean mask.
+    """
+    bits = 0
+    for band in bands:
+        bits |= 1 << all_bands.index(band)
+    return (catalog['match'].to_numpy() & bits) == bits
+
+
+def column_dtypes(bands):
+    """Types of the columns of the columnar catalogue: positions in double precision, magnitudes in single."""
+    return dict({'x': 'float64', 'y': 'float64', 'F814W': 'float32', 'match': 'int64'},
+                **{band: 'float32' for band in bands})
+
+
+def save_catalog(catalog, output_dir, bands, text_file=None, **metadata):
+    """
+    Save the catalogue as columnar folder and optionally as tab separated text (catalog.xym).
+
+    The bands (order of the match bits) and the other keyword arguments are saved with the columns.
+    """
+    write_columnar(output_dir, catalog, metadata=dict(metadata, bands=list(bands)), dtypes=column_dtypes(bands))
+    if text_file is not None:
+        catalog.to_csv(text_file, sep='\t', index=False)
+
+
+def load_catalog(input_dir, columns=None, filters=None):
+    """Read a catalogue saved by save_catalog, returning (catalog, bands). See xym_io.read_columnar for the filters."""
+    return read_columnar(input_dir, columns=columns, filters=filters), read_metadata(input_dir)['bands']
+
+
+def file_provenance(input_file, previous=None):
+    """
+    Path, size, modification time and SHA-1 of a file.
+
+    If previous (the provenance saved in the catalogue) has the same size and modification
+    time, the file is not read again and its hash is reused.
+    """
+    stat = os.stat(input_file)
+    if previous is not None and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return dict(previous, file=os.path.abspath(input_file))
+
+    sha1 = hashlib.sha1()
+    with open(input_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            sha1.update(block)
+    return {'file': os.path.abspath(input_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha1': sha1.hexdigest()}
+
+
+def _combine(*tokens):
+    return hashlib.sha1(':'.join(tokens).encode()).hexdigest()
+
+
+def column_versions(bands, inputs, reference, union=False):
+    """
+    Version of every column of the catalogue, from the hashes of the inputs it depends on.
+
+    The positions and F814W depend on the reference band (on all the bands with union), each band
+    column on itself and on the positions, the match flags on everything.
+    """
+    everything = _combine(*[inputs[band]['sha1'] for band in bands])
+    positions = everything if union else inputs[reference]['sha1']
+    versions = {name: positions for name in ('x', 'y', 'F814W')}
+    for band in bands:
+        versions[band] = everything if union else _combine(positions, inputs[band]['sha1'])
+    versions['match'] = everything
+    return versions
+
+
+def rebuild_catalog(input_files, output_dir, bands=None, reference=None, radius=0.5, max_dr=0.5, union=False,
+                    jobs=1, text_file=None, full=False):
+    """
+    Build the catalogue, or update it reading only the bands whose .lnk file changed.
+
+    The catalogue is built from scratch when it does not exist, when the bands or the parameters
+    are not the same as in the saved one, when the reference band changed, with union (the rows
+    depend on all the bands) or when full is True. The parameters are the same as build_catalog.
+
+    Parameters:
+        output_dir (str): Folder of the columnar catalogue.
+        text_file (str): If given, also save the catalogue as tab separated text (only when something changed).
+        full (bool): If True, always rebuild everything.
+
+    Returns:
+        tuple: (catalog, changed) where changed is the list of the columns that were rewritten
+        (empty if the catalogue was up to date).
+    """
+    bands = [band_name(input_file) for input_file in input_files] if bands is None else list(bands)
+    reference = bands[-1] if reference is None else reference
+    parameters = {'reference': reference, 'radius': radius, 'max_dr': max_dr, 'union': union}
+
+    try:
+        saved = read_metadata(output_dir)
+    except (OSError, ValueError, KeyError):
+        saved = {}
+    previous = saved.get('inputs', {})
+    inputs = {band: file_provenance(input_file, previous.get(band)) for input_file, band in zip(input_files, bands)}
+    changed_bands = [band for band in bands
+                     if band not in previous or previous[band]['sha1'] != inputs[band]['sha1']]
+
+    full = (full or saved.get('bands') != bands or saved.get('parameters') != parameters or union
+            or reference in changed_bands)
+    if not changed_bands and not full:
+        return read_columnar(output_dir), []
+
+    if full:
+        tables = read_bands(input_files, bands, max_dr=max_dr, jobs=jobs)
+        catalog = assemble_catalog(tables, bands, reference=reference, radius=radius, union=union)
+        changed = list(catalog.columns)
+    else:
+        files = dict(zip(bands, input_files))
+        tables = read_bands([files[band] for band in changed_bands], changed_bands, max_dr=max_dr, jobs=jobs)
+        catalog = read_columnar(output_dir)
+        x, y = catalog['x'].to_numpy(), catalog['y'].to_numpy()
+        match = catalog['match'].to_numpy().copy()
+        updates = {}
+        for band in changed_bands:
+            bit = 1 << bands.index(band)
+            values, found, _ = match_band(x, y, tables[band], band, radius)
+            match = np.where(found, match | bit, match & ~bit)
+            updates[band] = values
+        updates['match'] = match
+        changed = list(updates)
+
+    for band in bands:
+        inputs[band]['rows'] = len(tables[band]) if band in tables else previous[band]['rows']
+    metadata = {'bands': bands, 'parameters': parameters, 'inputs': inputs,
+                'versions': column_versions(bands, inputs, reference, union)}
+
+    if full:
+        write_columnar(output_dir, catalog, metadata=metadata, dtypes=column_dtypes(bands))
+    else:
+        update_columnar(output_dir, updates, metadata=metadata)
+        for name, values in updates.items():
+            catalog[name] = values
+    invalidate_derived(output_dir)
+
+    if text_file is not None:
+        catalog.to_csv(text_file, sep='\t', index=False)
+    return catalog, changed
+
+
+def _derived_dir(catalog_dir, name):
+    return os.path.join(catalog_dir, 'derived', name)
+
+
+def save_derived(catalog_dir, name, table, depends):
+    """
+    Save a table computed from some columns of the catalogue (e.g. colors or region labels).
+
+    Parameters:
+        catalog_dir (str): Folder of the catalogue.
+        name (str): Name of the derived table.
+        table (pd.DataFrame or dict): Its columns, one value per star of the catalogue.
+        depends (list[str]): Columns of the catalogue used to compute it.
+    """
+    versions = read_metadata(catalog_dir)['versions']
+    write_columnar(_derived_dir(catalog_dir, name), table,
+                   metadata={'depends': {column: versions[column] for column in depends}})
+
+
+def load_derived(catalog_dir, name, columns=None):
+    """Read a derived table, None if it does not exist or if one of the columns it depends on has changed."""
+    try:
+        depends = read_metadata(_derived_dir(catalog_dir, name))['depends']
+    except (OSError, ValueError, KeyError):
+        return None
+    versions = read_metadata(catalog_dir)['versions']
+    if any(versions.get(column) != version for column, version in depends.items()):
+        return None
+    return read_columnar(_derived_dir(catalog_dir, name), columns=columns)
+
+
+def derived(catalog_dir, name, depends, function):
+    """
+    Derived table from the cache of the catalogue folder, computed and saved if missing or out of date.
+
+    Parameters:
+        catalog_dir (str): Folder of the catalogue.
+        name (str): Name of the derived table.
+        depends (list[str]): Columns of the catalogue passed to function.
+        function (callable): function(catalog) -> DataFrame, Series or array with one value per star.
+
+    Returns:
+        pd.DataFrame: The derived table (a Series or an array becomes a column called name).
+    """
+    table = load_derived(catalog_dir, name)
+    if table is None:
+        table = function(read_columnar(catalog_dir, columns=depends))
+        if not isinstance(table, pd.DataFrame):
+            table = pd.DataFrame({name: np.asarray(table)})
+        save_derived(catalog_dir, name, table, depends)
+    return table
+
+
+def invalidate_derived(catalog_dir):
+    """Remove the derived tables that depend on a column that has changed, returning their names."""
+    folder = os.path.join(catalog_dir, 'derived')
+    if not os.path.isdir(folder):
+        return []
+    versions = read_metadata(catalog_dir)['versions']
+    removed = []
+    for name in sorted(os.listdir(folder)):
+        try:
+            depends = read_metadata(_derived_dir(catalog_dir, name))['depends']
+            stale = any(versions.get(column) != version for column, version in depends.items())
+        except (OSError, ValueError, KeyError):
+            stale = True
+        if stale:
+            shutil.rmtree(_derived_dir(catalog_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description="Cross-match the .lnk files of many bands in one catalogue.")
+    parser.add_argument("input_files", nargs='+', help=".lnk files, one per band (F225W.lnk, F275W.lnk, ...)")
+    parser.add_argument("-o", "--output", default="catalog", help="Folder of the columnar catalogue")
+    parser.add_argument("-t", "--text", default=None, help="Also save the catalogue as tab separated text (catalog.xym)")
+    parser.add_argument("-r", "--radius", type=float, default=0.5, help="Match radius in pixels")
+    parser.add_argument("--max-dr", type=float, default=0.5, help="dr cut of the .lnk files")
+    parser.add_argument("--reference", default=None, help="Band whose stars make the catalogue (default the last one)")
+    parser.add_argument("--union", action='store_true', help="Add the stars found only in the other bands")
+    parser.add_argument("--full", action='store_true', help="Rebuild everything, even the bands that did not change")
+    add_jobs_argument(parser)
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    bands = [band_name(input_file) for input_file in args.input_files]
+    catalog, changed = rebuild_catalog(args.input_files, args.output, bands=bands, reference=args.reference,
+                                       radius=args.radius, max_dr=args.max_dr, union=args.union, jobs=args.jobs,
+                                       text_file=args.text, full=args.full)
+    if not changed:
+        return print(f"Catalogue {args.output} is up to date")
+
+    print(f"Catalogue with {len(catalog)} stars saved in {args.output} (updated columns: {', '.join(changed)})")
+    for bit, band in enumerate(bands):
+        print(f"  {band}: {np.count_nonzero(catalog['match'].to_numpy() & (1 << bit))} stars")
+
+if __name__ == "__main__":
+    main()
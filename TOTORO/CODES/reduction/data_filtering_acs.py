@@ -10,123 +10,80 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
+import sys
 import argparse
 
+from batch import add_jobs_argument, run_batch
+from qfit_filter import qfit_selection, stream_qfit_selection
+from xym_io import add_format_argument, columnar_path, iter_xym, output_paths, read_xym, save_table
+
 # Suppress all warnings
 import warnings
 warnings.filterwarnings("ignore")
 
-def filter_data(input_file):
-    # Load the data
-    data = pd.read_csv(input_file, comment='#', delim_whitespace=True, header=None, names=['x', 'y', 'magnitude', 'qfit'])
-    data['qfit'] = data['qfit'].astype(str)
-    valid_data = data[data['qfit'] != "*********"]
-    valid_data['qfit'] = pd.to_numeric(valid_data['qfit'], errors='coerce')
-    # Filter rows where 'qfit' is positive
-    qfit_range_data = valid_data[(valid_data['qfit'] >= 0)]
-
-    saturation_limit  = - 13.7
-    faint_limit = - 6.5
-
-    # Define the range we are working with 
-    qfit_range_data_crit = qfit_range_data[(qfit_range_data['magnitude'] >= saturation_limit)  \
-                                       & (qfit_range_data['magnitude'] <= faint_limit)]
-
-    # Define magnitude range and number of zones
-    magnitude_min = saturation_limit  # start of the range
-    magnitude_max = faint_limit   # end of the range (faint star limit)
-    n_zones = 15  # number of zones
-
-    # Define qfit upper limit range
-    qfit_min = 0.1  # starting upper limit for qfit
-    qfit_max = 0.9  # ending upper limit for qfit
-
-    # Calculate magnitude boundaries and qfit upper limits for each zone
-    magnitude_limits = np.geomspace(magnitude_min, magnitude_max, n_zones + 1)
-    qfit_limits = np.geomspace(qfit_min, qfit_max, n_zones)
-
-    # Initialize list to store data for each zone
-    zone_data = []
-
-    # Iterate over the zones and filter the data
-    for i in range(n_zones):
-        lower_mag_limit = magnitude_limits[i]
-        upper_mag_limit = magnitude_limits[i + 1]
-        qfit_limit = qfit_limits[i]
-
-        # Select data for the current zone
-        zone = qfit_range_data_crit[(qfit_range_data_crit['magnitude'] > lower_mag_limit) & 
-                             (qfit_range_data_crit['magnitude'] <= upper_mag_limit) & 
-                             (qfit_range_data_crit['qfit'] <= qfit_limit)]
-
-        # Append the filtered zone data to the list
-        zone_data.append(zone)
-
-    # Concatenate the data for all zones
-    filtered_data = pd.concat(zone_data)
-
-    # Define the number of bins
-    n_bins = 100
-
-    # Create the bins
-    bins = np.linspace(saturation_limit, faint_limit, n_bins)
-
-    # Calculate the median and standard deviation of the qfit values for each bin
-    medians = []
-    stds = []
-    for i in range(len(bins) - 1):
-        bin_data = filtered_data[(filtered_data['magnitude'] >= bins[i]) & (filtered_data['magnitude'] < bins[i + 1])]
-        median = bin_data['qfit'].median()
-        std = bin_data['qfit'].std()
-        if median >= 0.5:
-            bin_data_outlier = bin_data[bin_data['qfit'] < 0.5]
-            median = bin_data_outlier['qfit'].median()
-            std = bin_data_outlier['qfit'].std()
-        medians.append(median)
-        stds.append(std)  
-
-    # Remove the points that are outside the range median +- 3*std
-    good_data = pd.DataFrame()
-    for i in range(len(bins) - 1):
-        bin_data = filtered_data[(filtered_data['magnitude'] >= bins[i]) \
-                                 & (filtered_data['magnitude'] < bins[i + 1])]
-        good_data = pd.concat([good_data, bin_data[(bin_data['qfit'] >= medians[i] - 2 * stds[i]) \
-                                                   & (bin_data['qfit'] <= medians[i] + 2 *stds[i])]])
-
-    # Concatenate the selected data with the ones outside the range
-    final_data = pd.concat([good_data, qfit_range_data[(qfit_range_data['magnitude'] < saturation_limit)\
-                                                        | (qfit_range_data['magnitude'] > faint_limit)]])
-    
+def round_data(data):
     # Round the values to the desired number of decimals
     decimals = {'x' : 3, 'y' : 3, 'magnitude' : 4, 'qfit' : 5}
-    final_data = final_data.round(decimals)
+    return data.round(decimals)
 
-    # Save the filtered data to a new file
-    original_file_path = input_file
+# Types of the columns of the columnar output
+DTYPES = {'x': 'float64', 'y': 'float64', 'magnitude': 'float32', 'qfit': 'float32'}
 
+def filter_data(input_file, chunksize=None, output_format='text'):
     # Extract the base name without extension
-    base_name = os.path.splitext(os.path.basename(original_file_path))[0]
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
 
     # Create the new file name with 's' before '.xym'
     new_file_name = f"{base_name}_s.xym"
 
-    # Save the DataFrame with the new name
-    final_data.to_csv(new_file_name, sep=' ', index=False, header=False)
+    if chunksize:
+        # Streaming mode: read the file twice, chunksize rows at a time, computing the qfit
+        # statistics of the bins in the first pass and writing the selected data in the second
+        names = ['x', 'y', 'magnitude', 'qfit']
+        # The columnar folder keeps the values as they are, without rounding, as without chunks
+        stream_qfit_selection(lambda: iter_xym(input_file, names=names, chunksize=chunksize),
+                              new_file_name if output_format in ('text', 'both') else None,
+                              format_data=round_data, outlier_median=0.5, outlier_qfit=0.5,
+                              columnar_dir=columnar_path(new_file_name) if output_format != 'text' else None,
+                              dtypes=DTYPES)
+        return print(f"File saved as: {', '.join(output_paths(new_file_name, output_format))}")
+
+    # Load the data (the ********* qfit values are read as NaN)
+    data = read_xym(input_file, names=['x', 'y', 'magnitude', 'qfit'])
+    # Filter rows where 'qfit' is positive
+    qfit_range_data = data[(data['qfit'] >= 0)]
+
+    # Select the good data with a single pass over the catalogue: each star is assigned to its
+    # zone and magnitude bin at once and the median and std of qfit are computed for all the bins
+    # together (see qfit_filter.py)
+    keep = qfit_selection(qfit_range_data['magnitude'].to_numpy(), qfit_range_data['qfit'].to_numpy(),
+                          outlier_median=0.5, outlier_qfit=0.5)
+    final_data = round_data(qfit_range_data.iloc[keep])
+
+    # Save the DataFrame with the new name (the columnar folder keeps the values as they are, without rounding)
+    if output_format in ('text', 'both'):
+        save_table(final_data, new_file_name, sep=' ', header=False)
+    if output_format in ('columnar', 'both'):
+        save_table(qfit_range_data.iloc[keep], new_file_name, output_format='columnar', dtypes=DTYPES)
 
-    return print(f"File saved as: {new_file_name}")
+    return print(f"File saved as: {', '.join(output_paths(new_file_name, output_format))}")
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Filter data based on qfit and magnitude values.")
     parser.add_argument("input_files", nargs='+', help="List of input files to process")  # Accept multiple files
+    parser.add_argument("-c", "--chunksize", type=int, default=None,
+                        help="Read the files in chunks of this many rows, for catalogues larger than the memory")
+    add_jobs_argument(parser)
+    add_format_argument(parser)
 
     # Parse command-line arguments
     args = parser.parse_args()
 
-    # Loop through each input file and generate the plot
-    for input_file in args.input_files:
-        print(f"Processing file: {input_file}")
-        filter_data(input_file)
+    # Process the input files, in parallel if more than one job is requested
+    failed = run_batch(filter_data, args.input_files, jobs=args.jobs, args=(args.chunksize, args.format))
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
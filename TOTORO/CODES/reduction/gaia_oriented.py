@@ -1,42 +1,131 @@
+import contextlib
+import itertools
+import numpy as np
 import pandas as pd
 import os
+import sys
 import argparse
 
+from batch import add_jobs_argument, run_batch
+from xym_io import ColumnarWriter, add_format_argument, columnar_path, iter_tokens, iter_xym, output_paths
+
 # Suppress all warnings
 import warnings
 warnings.filterwarnings("ignore")
 
-def filter_data(input_file):
-    # Load the data
-    data = pd.read_csv(input_file, header=None, delim_whitespace=True, \
-                    usecols=[2, 3, 4, 5, 6, 15], names=['dx', 'dy', 'x', 'y', 'F814W', 'F225W'])
-    data['dx'] = pd.to_numeric(data['dx'], errors='coerce')
-    data['dy'] = pd.to_numeric(data['dy'], errors='coerce')
+def default_output(input_file):
+    # Output of a file when many files are filtered together: F225W.lnk -> F225W_master.xym
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return f"{base_name}_master.xym"
+
+class NotNumbers(Exception):
+    # Some values of x, y or of the magnitudes are not numbers, so their tokens are needed
+    pass
 
-    # Drop rows with NaN values
-    data = data.dropna()
+def matched_rows(input_file, names, usecols, max_dr, chunksize, tokens=False):
+    # Stars that are matched, chunksize rows at a time, as (number of rows read, values, tokens). Without
+    # tokens, NotNumbers is raised at the first NaN value of x, y or of the magnitudes of a matched star
+    chunks = iter_xym(input_file, usecols=usecols, names=names, chunksize=chunksize)
+    pairs = iter_tokens(chunks, input_file, usecols, chunksize) if tokens else ((chunk, None) for chunk in chunks)
+    for chunk, text in pairs:
+        values = chunk.to_numpy()
+        # dr = sqrt(dx**2 + dy**2) less than max_dr (False where dx or dy are not numbers)
+        matched = (values[:, 0]**2 + values[:, 1]**2)**0.5 < max_dr
+        if text is None:
+            if np.isnan(values[matched, 2:]).any():
+                raise NotNumbers
+            yield len(values), values[matched], None
+        else:
+            # Drop the rows with missing values as dropna did, keeping the tokens that are not numbers
+            matched &= text.iloc[:, 2:].notna().all(axis=1).to_numpy()
+            yield len(values), values[matched], text[matched]
 
-    # Add a column with dr to identify the stars that are mismatched
-    data['dr'] = (data['dx']**2 + data['dy']**2)**0.5
-    # Filter rows where 'dr' is less than 0.5
-    valid_data = data[(data['dr'] < 0.5)]
+def text_columns(input_file, names, usecols, chunksize):
+    # As with pd.read_csv, x, y and the magnitude are numbers only if all their values are numbers, otherwise
+    # (e.g. with a ***** sentinel) they are written as they are in the input file
+    columns = set()
+    chunks = iter_xym(input_file, usecols=usecols, names=names, chunksize=chunksize)
+    for chunk, text in iter_tokens(chunks, input_file, usecols, chunksize):
+        for k in (2, 3, 5):
+            if (chunk.iloc[:, k].isna().to_numpy() & text.iloc[:, k].notna().to_numpy()).any():
+                columns.add(names[k])
+    return columns
 
+def write_matched(rows, output_file, band, output_format, text=()):
+    # Write x y and the magnitude of the stars that are matched
     # Round the values to the desired number of decimals
-    decimals = {'x' : 3, 'y' : 3, 'F225W' : 4}
-    valid_data = valid_data.round(decimals)
+    decimals = {'x' : 3, 'y' : 3, band : 4}
+
+    # The first chunk is read before the output is opened, so a file that cannot be read (e.g. without the
+    # magnitude column) does not leave an empty output
+    rows = iter(rows)
+    first = next(rows, None)
+    rows = itertools.chain([first], rows) if first is not None else []
 
-    # Create a new file with x y and F225W for the stars that are matched
-    valid_data[['x', 'y', 'F225W']].to_csv('FINAL_MASTER.xym', sep=' ', index=False, header=False)  
+    n_rows = n_valid = 0
+    with contextlib.ExitStack() as stack:
+        text_file = stack.enter_context(open(output_file, 'w')) if output_format in ('text', 'both') else None
+        writer = stack.enter_context(ColumnarWriter(columnar_path(output_file), dtypes={band: 'float32'})) \
+            if output_format in ('columnar', 'both') else None
+        for n, values, tokens in rows:
+            valid_data = pd.DataFrame({'x': values[:, 2], 'y': values[:, 3], band: values[:, 5]})
+            if text_file is not None:
+                text_data = valid_data.round(decimals)
+                for k, name in ((2, 'x'), (3, 'y'), (5, band)):
+                    if name in text:
+                        text_data[name] = tokens.iloc[:, k].to_numpy(dtype=object)
+                text_data.to_csv(text_file, sep=' ', index=False, header=False)
+            if writer is not None:
+                writer.write(valid_data)
+            n_rows += n
+            n_valid += len(valid_data)
+    return n_rows, n_valid
 
-    return print('Data filtered and saved as FINAL_MASTER.xym')
+def filter_data(input_file, output_file='FINAL_MASTER.xym', max_dr=0.5, band='F225W', column=15,
+                chunksize=1000000, output_format='text'):
+    # Stream the matched list chunksize rows at a time, so the memory does not depend on the size of the file
+    if output_file is None:
+        output_file = default_output(input_file)
+    names = ['dx', 'dy', 'x', 'y', 'F814W', band]
+    usecols = [2, 3, 4, 5, 6, column]
+
+    try:
+        n_rows, n_valid = write_matched(matched_rows(input_file, names, usecols, max_dr, chunksize), output_file,
+                                        band, output_format)
+    except NotNumbers:
+        # Some values are not numbers (read as NaN): filter the file again with the tokens of the columns
+        text = text_columns(input_file, names, usecols, chunksize)
+        n_rows, n_valid = write_matched(matched_rows(input_file, names, usecols, max_dr, chunksize, tokens=True),
+                                        output_file, band, output_format, text)
+
+    return print(f"Data filtered ({n_valid} of {n_rows} stars with dr < {max_dr}) and saved as "
+                 f"{', '.join(output_paths(output_file, output_format))}")
 
 def main():
     # Set up parser
     parser = argparse.ArgumentParser(description='Filter the data')
-    parser.add_argument('input_file', type=str, help='Input file with the data')
+    parser.add_argument('input_files', nargs='+', help='Input files with the data (.lnk or MAT files)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Output file (default FINAL_MASTER.xym for one input file, <name>_master.xym for more)')
+    parser.add_argument('-r', '--max-dr', type=float, default=0.5, help='Keep the stars with dr less than this')
+    parser.add_argument('-b', '--band', type=str, default='F225W', help='Name of the magnitude column')
+    parser.add_argument('--column', type=int, default=15, help='Index of the magnitude column in the input files')
+    parser.add_argument('-c', '--chunksize', type=int, default=1000000, help='Rows read at a time')
+    add_jobs_argument(parser)
+    add_format_argument(parser)
     args = parser.parse_args()
 
-    filter_data(args.input_file)
+    if len(args.input_files) > 1 and args.output is not None:
+        parser.error('--output can only be used with a single input file')
+    output_file = args.output
+    if output_file is None and len(args.input_files) == 1:
+        output_file = 'FINAL_MASTER.xym'
+
+    # Filter the files, in parallel if more than one job is requested
+    failed = run_batch(filter_data, args.input_files, jobs=args.jobs,
+                       args=(output_file, args.max_dr, args.band, args.column, args.chunksize, args.format))
+    if failed:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
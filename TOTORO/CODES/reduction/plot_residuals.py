@@ -1,12 +1,16 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import sys
 import argparse
 
+from batch import add_jobs_argument, run_batch
+from xym_io import read_xym
+
 def plot_residuals(input_file):
     # Load the data
-    data = pd.read_csv(input_file, comment='#', delim_whitespace=True, header=None, \
-                        names=['0', '1', '2', '3', '4', '5', 'res1', 'res2', 'res3', 'res4', '10', '11', '12', '13', '14'])
+    data = read_xym(input_file, \
+                    names=['0', '1', '2', '3', '4', '5', 'res1', 'res2', 'res3', 'res4', '10', '11', '12', '13', '14'])
     
     # Create the plot
     plt.figure(figsize=(10, 10))
@@ -32,14 +36,15 @@ def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Generate residuals plots from MAT files.")
     parser.add_argument("input_files", nargs='+', help="Input file to process")  # Accept multiple files
+    add_jobs_argument(parser)
 
     # Parse command-line arguments
     args = parser.parse_args()
 
-    # Loop through each input file and generate the plot
-    for input_file in args.input_files:
-        print(f"Processing file: {input_file}")
-        plot_residuals(input_file)
+    # Process the input files, in parallel if more than one job is requested
+    failed = run_batch(plot_residuals, args.input_files, jobs=args.jobs)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -2,27 +2,22 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
 import os
+import sys
+
+from batch import add_jobs_argument, run_batch
+from xym_io import read_xym
 
 def plot_qfit_vs_magnitude(input_file, plot_title):
-    # Load the data
-    data = pd.read_csv(input_file, comment='#', delim_whitespace=True, header=None, names=['x', 'y', 'magnitude', 'qfit', 'nan'])
+    # Load the data (the "*********" qfit values are read as NaN)
+    data = read_xym(input_file, names=['x', 'y', 'magnitude', 'qfit', 'nan'])
 
     # Check if the necessary columns are present
     if 'magnitude' not in data.columns or 'qfit' not in data.columns:
         print(f"The input data in {input_file} must contain 'magnitude' and 'qfit' columns.")
         return
 
-    # Convert 'qfit' column to string to handle non-numeric values like "*********"
-    data['qfit'] = data['qfit'].astype(str)
-
-    # Filter out rows where 'qfit' is "*********"
-    filtered_data = data[data['qfit'] != "*********"]
-
-    # Convert 'qfit' back to numeric values (invalid parsing will be set to NaN)
-    filtered_data['qfit'] = pd.to_numeric(filtered_data['qfit'], errors='coerce')
-
     # Keep only rows where 'qfit' is between 0 and 1 (inclusive)
-    qfit_range_data = filtered_data[(filtered_data['qfit'] >= 0)]
+    qfit_range_data = data[(data['qfit'] >= 0)]
 
     # Create the plot using the filtered subset
     plt.figure(figsize=(10, 6))
@@ -45,14 +40,15 @@ def main():
     parser = argparse.ArgumentParser(description="Generate qfit vs Magnitude plots from multiple input files.")
     parser.add_argument("input_files", nargs='+', help="List of input files to process")  # Accept multiple files
     parser.add_argument("-t", "--title", type=str, default="Custom Plot", help="Title for the plots")
+    add_jobs_argument(parser)
 
     # Parse command-line arguments
     args = parser.parse_args()
 
-    # Loop through each input file and generate the plot
-    for input_file in args.input_files:
-        print(f"Processing file: {input_file}")
-        plot_qfit_vs_magnitude(input_file, args.title)
+    # Process the input files, in parallel if more than one job is requested
+    failed = run_batch(plot_qfit_vs_magnitude, args.input_files, jobs=args.jobs, args=(args.title,))
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,372 @@
+'''''
+Vectorized qfit selection shared by data_filtering_acs.py and data_filtering_wfc3.py.
+
+The selection is the same one described in the filtering scripts: the critical
+region between the saturation limit and the faint limit is divided in zones with
+an increasing qfit upper limit, then in magnitude bins where only the stars within
+median +- 2 std of qfit are kept.
+Instead of scanning the catalogue once per zone and once per bin, every star is
+assigned to its zone and bin with a single searchsorted pass and the median and
+std of each bin are computed with grouped reductions on the sorted values.
+'''''
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from xym_io import ROW_GROUP_SIZE, ColumnarWriter
+
+SATURATION_LIMIT = -13.7
+FAINT_LIMIT = -6.5
+N_ZONES = 15
+QFIT_MIN = 0.1
+QFIT_MAX = 0.9
+N_BINS = 100
+
+
+def zone_limits(saturation_limit=SATURATION_LIMIT, faint_limit=FAINT_LIMIT, n_zones=N_ZONES,
+                qfit_min=QFIT_MIN, qfit_max=QFIT_MAX):
+    """Magnitude boundaries and qfit upper limits of the zones."""
+    magnitude_limits = np.geomspace(saturation_limit, faint_limit, n_zones + 1)
+    qfit_limits = np.geomspace(qfit_min, qfit_max, n_zones)
+    return magnitude_limits, qfit_limits
+
+
+def assign_zones_and_bins(magnitude, qfit, saturation_limit=SATURATION_LIMIT, faint_limit=FAINT_LIMIT,
+                          n_zones=N_ZONES, qfit_min=QFIT_MIN, qfit_max=QFIT_MAX, n_bins=N_BINS):
+    """
+    Assign every star to its zone and magnitude bin in one pass.
+
+    Parameters:
+        magnitude (np.ndarray): Instrumental magnitudes.
+        qfit (np.ndarray): qfit values, NaN where the qfit is not available.
+
+    Returns:
+        tuple: (zone, bin_index, selected) where zone and bin_index are integer arrays and
+        selected is True for the stars that pass the zone cut and fall inside a bin.
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+    qfit = np.asarray(qfit, dtype=float)
+
+    magnitude_limits, qfit_limits = zone_limits(saturation_limit, faint_limit, n_zones, qfit_min, qfit_max)
+    bins = np.linspace(saturation_limit, faint_limit, n_bins)
+
+    # lower < magnitude <= upper for the zones, lower <= magnitude < upper for the bins
+    zone = np.searchsorted(magnitude_limits, magnitude, side='left') - 1
+    bin_index = np.searchsorted(bins, magnitude, side='right') - 1
+
+    in_zone = (zone >= 0) & (zone < n_zones)
+    in_bin = (bin_index >= 0) & (bin_index < n_bins - 1)
+
+    # NaN qfit and NaN magnitudes fail every comparison, as in the original selection
+    selected = (qfit >= 0) & (magnitude >= saturation_limit) & (magnitude <= faint_limit) & in_zone & in_bin
+    selected &= qfit <= qfit_limits[np.clip(zone, 0, n_zones - 1)]
+
+    return zone, bin_index, selected
+
+
+def grouped_median_std(values, groups, n_groups):
+    """
+    Median and standard deviation (ddof=1) of values for every group.
+
+    The values must already be sorted by group, in the order in which the sums have
+    to be accumulated, so that the results match pandas' median() and std().
+    Groups with no values get NaN, groups with one value get a NaN std.
+    """
+    values = np.asarray(values, dtype=float)
+    groups = np.asarray(groups)
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    filled = counts > 0
+
+    medians = np.full(n_groups, np.nan)
+    stds = np.full(n_groups, np.nan)
+    if not filled.any():
+        return medians, stds
+
+    # Median: sort by value inside each group and average the two central values
+    sorted_values = values[np.lexsort((values, groups))]
+    low = starts + (counts - 1) // 2
+    high = starts + counts // 2
+    medians[filled] = (sorted_values[low[filled]] + sorted_values[high[filled]]) / 2
+
+    # Std: two-pass algorithm, same as pandas
+    sums = np.add.reduceat(values, starts[filled])
+    means = np.full(n_groups, np.nan)
+    means[filled] = sums / counts[filled]
+    squares = (means[groups] - values) ** 2
+    square_sums = np.add.reduceat(squares, starts[filled])
+    enough = counts[filled] > 1
+    variances = np.full(filled.sum(), np.nan)
+    variances[enough] = square_sums[enough] / (counts[filled][enough] - 1)
+    stds[filled] = np.sqrt(variances)
+
+    return medians, stds
+
+
+def qfit_selection(magnitude, qfit, outlier_median=0.5, outlier_qfit=0.5, saturation_limit=SATURATION_LIMIT,
+                   faint_limit=FAINT_LIMIT, n_zones=N_ZONES, qfit_min=QFIT_MIN, qfit_max=QFIT_MAX, n_bins=N_BINS):
+    """
+    Select the good stars of a qfit catalogue.
+
+    Parameters:
+        magnitude (np.ndarray): Instrumental magnitudes.
+        qfit (np.ndarray): qfit values, NaN where the qfit is not available.
+        outlier_median (float): If the median qfit of a bin is above this value, the median and the std
+            are computed again without the outliers (0.5 for ACS, 0.3 for WFC3).
+        outlier_qfit (float): Only the stars with qfit below this value are used for the new estimate.
+
+    Returns:
+        np.ndarray: Row positions of the stars to keep, in the order used for the _s.xym files
+        (critical region sorted by bin and zone first, then the stars outside the critical region).
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+    qfit = np.asarray(qfit, dtype=float)
+    n_groups = n_bins - 1
+
+    zone, bin_index, selected = assign_zones_and_bins(magnitude, qfit, saturation_limit, faint_limit,
+                                                      n_zones, qfit_min, qfit_max, n_bins)
+
+    # Stars of the critical region sorted by bin, then by zone, then by position in the file
+    positions = np.flatnonzero(selected)
+    positions = positions[np.lexsort((zone[positions], bin_index[positions]))]
+    groups = bin_index[positions]
+    values = qfit[positions]
+
+    medians, stds = grouped_median_std(values, groups, n_groups)
+
+    # Estimate again median and std for the bins dominated by the outliers
+    outlier_bins = medians >= outlier_median
+    if outlier_bins.any():
+        subset = outlier_bins[groups] & (values < outlier_qfit)
+        outlier_medians, outlier_stds = grouped_median_std(values[subset], groups[subset], n_groups)
+        medians[outlier_bins] = outlier_medians[outlier_bins]
+        stds[outlier_bins] = outlier_stds[outlier_bins]
+
+    # Keep the points inside the range median +- 2*std
+    lower = medians[groups] - 2 * stds[groups]
+    upper = medians[groups] + 2 * stds[groups]
+    good = positions[(values >= lower) & (values <= upper)]
+
+    # Add the stars outside the critical region
+    outside = np.flatnonzero((qfit >= 0) & ((magnitude < saturation_limit) | (magnitude > faint_limit)))
+
+    return np.concatenate((good, outside))
+
+
+'''''
+Streaming mode for catalogues that do not fit in memory.
+
+The file is read twice in chunks. In the first pass the qfit values of every bin
+are accumulated in an exact histogram (qfit is written with 5 decimals, so each
+value is an integer number of 1e-5 steps), from which the median and the std of
+every bin are computed. In the second pass the median +- 2 std cut is applied to
+each chunk and the selected rows are appended to one temporary file per bin and
+zone, which are finally joined in the same order used by qfit_selection.
+'''''
+
+QFIT_RESOLUTION = 1e-5
+
+
+class QfitHistogram:
+    """Exact histogram of the qfit values of every bin, accumulated chunk by chunk."""
+
+    def __init__(self, n_groups, resolution=QFIT_RESOLUTION):
+        self.n_groups = n_groups
+        self.scale = int(round(1 / resolution))
+        # Keys are bin * n_levels + qfit level
+        self.n_levels = 1 << 40
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add(self, groups, values):
+        """Add the values of a chunk, groups being the bin of each value."""
+        levels = np.rint(np.asarray(values) * self.scale)
+        if np.any(np.abs(levels - np.asarray(values) * self.scale) > 1e-6):
+            raise ValueError(f"qfit values have more decimals than the histogram resolution (1/{self.scale}).")
+        keys = np.asarray(groups, dtype=np.int64) * self.n_levels + levels.astype(np.int64)
+
+        # Merge the new counts with the accumulated ones
+        keys, inverse = np.unique(np.concatenate((self.keys, keys)), return_inverse=True)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(counts, inverse[:len(self.counts)], self.counts)
+        counts += np.bincount(inverse[len(self.counts):], minlength=len(keys))
+        self.keys, self.counts = keys, counts
+
+    def median_std(self, max_value=None, groups=None):
+        """
+        Median and standard deviation (ddof=1) of every bin.
+
+        Parameters:
+            max_value (float): If given, only the values below it are used.
+            groups (np.ndarray): Boolean mask of the bins to use, the others get NaN.
+        """
+        group = self.keys // self.n_levels
+        values = (self.keys % self.n_levels) / self.scale
+        counts = self.counts.copy()
+        if max_value is not None:
+            counts[values >= max_value] = 0
+        if groups is not None:
+            counts[~groups[group]] = 0
+
+        n = np.bincount(group, weights=counts, minlength=self.n_groups)
+        medians = np.full(self.n_groups, np.nan)
+        stds = np.full(self.n_groups, np.nan)
+        filled = n > 0
+        if not filled.any():
+            return medians, stds
+
+        # Median: values at the two central ranks of every bin
+        cumulative = np.cumsum(counts)
+        base = np.concatenate(([0], np.cumsum(n)[:-1]))[filled]
+        count = n[filled].astype(np.int64)
+        low = values[np.searchsorted(cumulative, base + (count - 1) // 2, side='right')]
+        high = values[np.searchsorted(cumulative, base + count // 2, side='right')]
+        medians[filled] = (low + high) / 2
+
+        # Std: two-pass algorithm on the histogram
+        means = np.bincount(group, weights=counts * values, minlength=self.n_groups) / np.where(filled, n, 1)
+        squares = np.bincount(group, weights=counts * (means[group] - values) ** 2, minlength=self.n_groups)
+        enough = n > 1
+        stds[enough] = np.sqrt(squares[enough] / (n[enough] - 1))
+
+        return medians, stds
+
+
+def stream_statistics(chunks, outlier_median=0.5, outlier_qfit=0.5, resolution=QFIT_RESOLUTION, **limits):
+    """
+    First pass: median and std of qfit for every bin, reading the catalogue in chunks.
+
+    Parameters:
+        chunks (iterable): DataFrames with 'magnitude' and 'qfit' columns.
+        limits: saturation_limit, faint_limit, n_zones, qfit_min, qfit_max and n_bins, as in qfit_selection.
+
+    Returns:
+        tuple: (medians, stds) arrays with one value per bin.
+    """
+    n_groups = limits.get('n_bins', N_BINS) - 1
+    histogram = QfitHistogram(n_groups, resolution)
+    for chunk in chunks:
+        magnitude = chunk['magnitude'].to_numpy(dtype=float)
+        qfit = chunk['qfit'].to_numpy(dtype=float)
+        _, bin_index, selected = assign_zones_and_bins(magnitude, qfit, **limits)
+        histogram.add(bin_index[selected], qfit[selected])
+
+    medians, stds = histogram.median_std()
+
+    # Estimate again median and std for the bins dominated by the outliers
+    outlier_bins = medians >= outlier_median
+    if outlier_bins.any():
+        outlier_medians, outlier_stds = histogram.median_std(max_value=outlier_qfit, groups=outlier_bins)
+        medians[outlier_bins] = outlier_medians[outlier_bins]
+        stds[outlier_bins] = outlier_stds[outlier_bins]
+
+    return medians, stds
+
+
+def stream_qfit_selection(read_chunks, output_file, format_data=None, outlier_median=0.5, outlier_qfit=0.5,
+                          resolution=QFIT_RESOLUTION, columnar_dir=None, dtypes=None, **limits):
+    """
+    Apply the qfit selection reading the catalogue twice in chunks and write the selected rows.
+
+    Parameters:
+        read_chunks (callable): Function with no arguments returning an iterator over the chunks
+            (DataFrames with 'magnitude' and 'qfit' columns). It is called once per pass.
+        output_file (str): Path of the _s.xym file, None to write only the columnar folder.
+        format_data (callable): Function applied to every selected chunk before writing it (e.g. rounding).
+        columnar_dir (str): Columnar folder (see xym_io.ColumnarWriter) with the selected rows as they are read,
+            without format_data, as the scripts write it without chunks.
+        dtypes (dict): Columns of the columnar folder and their types, e.g. {'x': 'float64', 'qfit': 'float32'}.
+        limits: saturation_limit, faint_limit, n_zones, qfit_min, qfit_max and n_bins, as in qfit_selection.
+
+    Returns:
+        int: Number of rows written.
+    """
+    saturation_limit = limits.get('saturation_limit', SATURATION_LIMIT)
+    faint_limit = limits.get('faint_limit', FAINT_LIMIT)
+    n_zones = limits.get('n_zones', N_ZONES)
+    n_groups = limits.get('n_bins', N_BINS) - 1
+    outside_key = n_groups * n_zones
+
+    medians, stds = stream_statistics(read_chunks(), outlier_median, outlier_qfit, resolution, **limits)
+
+    n_rows = 0
+    columns = list(dtypes) if dtypes else []
+    output_dir = os.path.dirname(os.path.abspath(output_file if output_file is not None else columnar_dir))
+    with tempfile.TemporaryDirectory(dir=output_dir) as spill_dir:
+        # One temporary text file per (bin, zone) and, for the columnar folder, one binary file with the
+        # values of the columns (float64, row after row)
+        spill_files = {}
+        binary_files = {}
+        try:
+            for chunk in read_chunks():
+                magnitude = chunk['magnitude'].to_numpy(dtype=float)
+                qfit = chunk['qfit'].to_numpy(dtype=float)
+                zone, bin_index, selected = assign_zones_and_bins(magnitude, qfit, **limits)
+
+                # Keep the points inside the range median +- 2*std
+                groups = np.clip(bin_index, 0, n_groups - 1)
+                inside = (qfit >= medians[groups] - 2 * stds[groups]) & (qfit <= medians[groups] + 2 * stds[groups])
+                good = selected & inside
+                outside = (qfit >= 0) & ((magnitude < saturation_limit) | (magnitude > faint_limit))
+
+                # One temporary file per (bin, zone), plus one for the stars outside the critical region
+                keys = np.where(good, groups * n_zones + np.clip(zone, 0, n_zones - 1), outside_key)
+                rows = np.flatnonzero(good | outside)
+                if len(rows) == 0:
+                    continue
+                rows = rows[np.argsort(keys[rows], kind='stable')]
+                if format_data is not None:
+                    data = format_data(chunk.iloc[rows])
+                else:
+                    data = chunk.iloc[rows]
+                values = chunk[columns].to_numpy(dtype=np.float64)[rows] if columnar_dir is not None else None
+                row_keys = keys[rows]
+                bounds = np.flatnonzero(np.diff(row_keys)) + 1
+                for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(rows)]))):
+                    key = int(row_keys[start])
+                    if output_file is not None:
+                        if key not in spill_files:
+                            spill_files[key] = open(os.path.join(spill_dir, f"{key}.xym"), 'w')
+                        data.iloc[start:stop].to_csv(spill_files[key], sep=' ', index=False, header=False)
+                    if values is not None:
+                        if key not in binary_files:
+                            binary_files[key] = open(os.path.join(spill_dir, f"{key}.bin"), 'wb')
+                        binary_files[key].write(values[start:stop].tobytes())
+                n_rows += len(rows)
+        finally:
+            for spill_file in list(spill_files.values()) + list(binary_files.values()):
+                spill_file.close()
+
+        # Join the temporary files in the order of qfit_selection
+        if output_file is not None:
+            with open(output_file, 'wb') as output:
+                for key in sorted(spill_files):
+                    with open(os.path.join(spill_dir, f"{key}.xym"), 'rb') as spill_file:
+                        shutil.copyfileobj(spill_file, output)
+        if columnar_dir is not None:
+            # The rows are written in blocks of ROW_GROUP_SIZE rows, so the row groups are the same as without chunks
+            with ColumnarWriter(columnar_dir, dtypes=dtypes) as writer:
+                def write(blocks):
+                    block = np.concatenate(blocks) if blocks else np.empty((0, len(columns)))
+                    writer.write({name: block[:, i] for i, name in enumerate(columns)})
+
+                blocks, n_block = [], 0
+                for key in sorted(binary_files):
+                    values = np.memmap(os.path.join(spill_dir, f"{key}.bin"), dtype=np.float64, mode='r')
+                    values = values.reshape(-1, len(columns))
+                    start = 0
+                    while start < len(values):
+                        stop = min(start + ROW_GROUP_SIZE - n_block, len(values))
+                        blocks.append(values[start:stop])
+                        n_block += stop - start
+                        start = stop
+                        if n_block == ROW_GROUP_SIZE:
+                            write(blocks)
+                            blocks, n_block = [], 0
+                if blocks or not binary_files:
+                    write(blocks)
+
+    return n_rows
@@ -0,0 +1,597 @@
+'''''
+Fast reader for the whitespace separated tables used in the reduction: the .xym
+qfit files, the .lnk and MAT.00x files from xym2mat/xym1mat, MATCHUP.XYMEEE and
+the tab separated catalog.xym.
+
+The text is tokenized with NumPy (np.fromstring when all the tokens are numbers) and the Fortran overflow
+sentinel (*********) is turned into NaN while parsing, so there is no need to
+convert the columns to string and back. Non numeric tokens (e.g. the star names
+of MATCHUP files) become NaN as with pd.to_numeric(errors='coerce').
+
+The parsed table is saved next to the input file as a hidden columnar .npy
+cache (one row per column) with a small .json file holding the size and the
+modification time of the input. If the input has not changed, later reads load
+the cache as a memory map and only touch the requested columns.
+
+write_columnar and read_columnar save and read the tables produced by the
+pipeline (e.g. the multi-band catalogue) in the same columnar form, one .npy
+file per column in a folder, with typed columns (e.g. float32 magnitudes) and the
+minimum and maximum of every column in row groups of ROW_GROUP_SIZE rows.
+read_columnar only maps the requested columns and uses the statistics to skip
+the row groups that cannot pass a filter such as ('magnitude', '<', -5). The
+scripts keep writing text by default, which is what xym2mat and the other
+Fortran tools read, and write the columnar folder (.cols) with --format.
+'''''
+
+import itertools
+import json
+import os
+import operator
+import re
+import struct
+import warnings
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+# Runs of '*' written by Fortran when a number does not fit in its format
+SENTINEL = re.compile(rb'\*+')
+
+# Columnar tables: output formats of the scripts, rows per row group, size of the .npy headers and filters
+OUTPUT_FORMATS = ('text', 'columnar', 'both')
+ROW_GROUP_SIZE = 1000000
+NPY_HEADER_SIZE = 128
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq,
+             '!=': operator.ne}
+
+
+def cache_paths(input_file):
+    """Paths of the .npy cache and of its .json description for an input file."""
+    directory, base_name = os.path.split(os.path.abspath(input_file))
+    stem = os.path.join(directory, f".{base_name}")
+    return f"{stem}.npy", f"{stem}.json"
+
+
+def _file_key(input_file, skiprows, sep, header, comment):
+    stat = os.stat(input_file)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'skiprows': skiprows, 'sep': sep, 'header': header, 'comment': comment}
+
+
+def _to_float(tokens):
+    """Convert a 2D array of byte tokens to float, column by column, setting the tokens that are not numbers to NaN."""
+    values = np.empty(tokens.shape, dtype=np.float64)
+    for i, column in enumerate(tokens.T):
+        try:
+            values[:, i] = column.astype(np.float64)
+        except ValueError:
+            values[:, i] = pd.to_numeric(pd.Series(column.astype(str)), errors='coerce').to_numpy(np.float64)
+    return values
+
+
+def _split_rows(lines):
+    """Split the lines in rows of tokens, padding the short rows with NaN."""
+    rows = [line.split() for line in lines]
+    n_columns = max(len(row) for row in rows)
+    tokens = np.full((len(rows), n_columns), b'nan', dtype=f"S{max(len(t) for row in rows for t in row)}")
+    for i, row in enumerate(rows):
+        tokens[i, :len(row)] = row
+    return tokens
+
+
+def parse_table(input_file, skiprows=0, sep=None, header=False, comment='#'):
+    """
+    Parse a text table with NumPy.
+
+    Parameters:
+        input_file (str): Path of the file.
+        skiprows (int): Number of lines to skip at the beginning of the file.
+        sep (str): Column separator, None for any whitespace.
+        header (bool): If True, the first line after the skipped ones holds the column names.
+        comment (str): Lines starting with this character are ignored.
+
+    Returns:
+        tuple: (values, column_names) where values is a float64 array with shape (n_rows, n_columns)
+        and column_names is None if the file has no header.
+    """
+    with open(input_file, 'rb') as f:
+        for _ in range(skiprows):
+            f.readline()
+        content = f.read()
+
+    return parse_text(content, sep=sep, header=header, comment=comment)
+
+
+def parse_text(content, sep=None, header=False, comment='#'):
+    """Parse the bytes of a text table, see parse_table."""
+    if comment and comment.encode() in content:
+        content = re.sub(rb'(?m)^[ \t]*' + re.escape(comment.encode()) + rb'.*(\r?\n|$)', b'', content)
+    if b'*' in content:
+        content = SENTINEL.sub(b'nan', content)
+
+    column_names = None
+    if header:
+        first_line, _, content = content.lstrip(b'\r\n').partition(b'\n')
+        column_names = [name.decode() for name in first_line.strip(b'\r').split(sep.encode() if sep else None)]
+
+    if sep is not None:
+        # Mark the empty fields and turn the separator into a space
+        separator = sep.encode()
+        content = b'\n' + content.replace(b'\r\n', b'\n') + b'\n'
+        for _ in range(2):
+            content = content.replace(separator + separator, separator + b'nan' + separator)
+        content = content.replace(b'\n' + separator, b'\nnan' + separator)
+        content = content.replace(separator + b'\n', separator + b'nan\n')
+        content = content.replace(separator, b' ')
+
+    n_columns = len(content.lstrip().split(b'\n', 1)[0].split())
+    n_lines = content.strip().count(b'\n') + 1 if n_columns else 0
+
+    # Fast path: all the tokens are numbers and all the rows have the same length
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            values = np.fromstring(content, sep=' ')
+        if values.size == n_lines * n_columns:
+            return values.reshape(n_lines, n_columns), column_names
+    except (ValueError, DeprecationWarning):
+        pass
+
+    tokens = content.split()
+    if len(tokens) != n_lines * n_columns:
+        # Blank lines are not rows
+        n_lines = len(re.findall(rb'(?m)^[ \t]*\S', content))
+    if n_columns and len(tokens) == n_lines * n_columns:
+        tokens = np.array(tokens).reshape(-1, n_columns)
+    else:
+        # Rows with a different number of columns
+        lines = [line for line in content.splitlines() if line.strip()]
+        tokens = _split_rows(lines) if lines else np.empty((0, 0), dtype='S3')
+
+    return _to_float(tokens), column_names
+
+
+def load_columns(input_file, skiprows=0, sep=None, header=False, comment='#', cache=True):
+    """
+    Load the columns of a table, using the binary cache when it is up to date.
+
+    Returns:
+        tuple: (columns, column_names) where columns is a float64 array with shape (n_columns, n_rows),
+        memory mapped when it comes from the cache.
+    """
+    key = _file_key(input_file, skiprows, sep, header, comment)
+    npy_path, json_path = cache_paths(input_file)
+
+    if cache:
+        try:
+            with open(json_path) as f:
+                description = json.load(f)
+            if description['key'] == key:
+                return np.load(npy_path, mmap_mode='r'), description['columns']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    values, column_names = parse_table(input_file, skiprows=skiprows, sep=sep, header=header, comment=comment)
+    columns = np.ascontiguousarray(values.T)
+
+    if cache:
+        # The files are written under a name of this process and then replaced, so another process (a --jobs
+        # worker, a notebook with the cache memory mapped) never reads a half written cache
+        suffix = f".{os.getpid()}.tmp"
+        try:
+            with open(npy_path + suffix, 'wb') as f:
+                np.save(f, columns)
+            os.replace(npy_path + suffix, npy_path)
+            with open(json_path + suffix, 'w') as f:
+                json.dump({'key': key, 'columns': column_names}, f)
+            os.replace(json_path + suffix, json_path)
+        except OSError:
+            # Read-only directory: work without the cache
+            for path in (npy_path + suffix, json_path + suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return columns, column_names
+
+
+def read_xym(input_file, names=None, usecols=None, skiprows=0, sep=None, header=False, comment='#', cache=True):
+    """
+    Read a whitespace separated table (.xym, .lnk, MAT, MATCHUP, catalog.xym) into a DataFrame.
+
+    Parameters:
+        input_file (str): Path of the file.
+        names (list[str]): Names of the columns (of the selected ones if usecols is given).
+        usecols (list[int]): Indices of the columns to read.
+        skiprows (int): Number of lines to skip at the beginning of the file.
+        sep (str): Column separator, None for any whitespace ('\\t' for catalog.xym).
+        header (bool): If True, take the column names from the first line.
+        comment (str): Lines starting with this character are ignored.
+        cache (bool): If True, use and update the binary cache next to the file.
+
+    Returns:
+        pd.DataFrame: Table with float64 columns, NaN where the value was missing, not a number
+        or a ********* sentinel.
+    """
+    columns, column_names = load_columns(input_file, skiprows=skiprows, sep=sep, header=header,
+                                         comment=comment, cache=cache)
+    return _frame(columns, column_names, names, usecols, input_file)
+
+
+def _frame(columns, column_names, names, usecols, input_file):
+    """Build the DataFrame with the selected columns from an array with shape (n_columns, n_rows)."""
+    n_columns, n_rows = columns.shape
+
+    if usecols is None:
+        usecols = range(n_columns)
+    usecols = list(usecols)
+
+    # As pd.read_csv, fail if a requested column is not in the file (e.g. column 15 of a MAT file)
+    missing = [i for i in usecols if i >= n_columns]
+    if missing:
+        raise ValueError(f"Columns {missing} requested from {input_file}, which has only {n_columns} columns.")
+
+    if names is None:
+        names = [column_names[i] for i in usecols] if column_names is not None else usecols
+    names = list(names)[:len(usecols)]
+
+    return pd.DataFrame({name: np.array(columns[i]) for name, i in zip(names, usecols)})
+
+
+def iter_xym(input_file, names=None, usecols=None, chunksize=1000000, skiprows=0, sep=None, header=False,
+             comment='#'):
+    """
+    Read a table in chunks of rows, keeping only one chunk in memory.
+
+    The chunks come from the binary cache if it is up to date, otherwise the text is parsed
+    chunksize lines at a time (the cache is not written). The parameters are the same as read_xym.
+
+    Yields:
+        pd.DataFrame: The next chunksize rows of the table.
+    """
+    key = _file_key(input_file, skiprows, sep, header, comment)
+    npy_path, json_path = cache_paths(input_file)
+    columns = None
+    try:
+        with open(json_path) as f:
+            description = json.load(f)
+        if description['key'] == key:
+            columns = np.load(npy_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        pass
+    if columns is not None:
+        for start in range(0, columns.shape[1], chunksize):
+            yield _frame(columns[:, start:start + chunksize], description['columns'], names, usecols, input_file)
+        return
+
+    with open(input_file, 'rb') as f:
+        for _ in range(skiprows):
+            f.readline()
+
+        column_names = None
+        if header:
+            line = f.readline()
+            while line and (not line.strip() or (comment and line.lstrip().startswith(comment.encode()))):
+                line = f.readline()
+            column_names = [name.decode() for name in line.strip(b'\r\n').split(sep.encode() if sep else None)]
+
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            values, _ = parse_text(b''.join(lines), sep=sep, comment=comment)
+            if len(values):
+                yield _frame(np.ascontiguousarray(values.T), column_names, names, usecols, input_file)
+
+
+def iter_tokens(chunks, input_file, usecols, chunksize=1000000, comment='#'):
+    """
+    Pair the chunks of iter_xym with the tokens of some of their columns as text, as pd.read_csv reads them.
+
+    The scripts that write the values that are not numbers (e.g. a ********** sentinel) as they are in the input
+    file need the tokens, which iter_xym reads as NaN. The tokens are read chunksize rows at a time and buffered,
+    as the two readers do not split the file at the same rows (iter_xym counts the comment lines).
+
+    Parameters:
+        chunks (iterable): Chunks of iter_xym of input_file.
+        input_file (str): Path to the whitespace separated file.
+        usecols (list[int]): Indices of the columns of the tokens.
+        chunksize (int): Rows of tokens read at a time.
+        comment (str): Lines starting with this character are ignored.
+
+    Yields:
+        tuple: (chunk, tokens), tokens a pd.DataFrame of str with the columns usecols and the rows of chunk,
+        NaN where the value is missing.
+    """
+    usecols = list(usecols)
+    reader = pd.read_csv(input_file, comment=comment, sep=r'\s+', header=None, usecols=usecols, dtype=str,
+                         chunksize=chunksize)
+    buffer = None
+    for chunk in chunks:
+        while buffer is None or len(buffer) < len(chunk):
+            tokens = next(reader)[usecols]
+            buffer = tokens if buffer is None else pd.concat((buffer, tokens))
+        yield chunk, buffer.iloc[:len(chunk)].reset_index(drop=True)
+        buffer = buffer.iloc[len(chunk):]
+
+
+def add_format_argument(parser):
+    """Add the -f/--format option (text, columnar or both) to the argument parser of a script."""
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default='text',
+                        help="Output as text (for xym2mat and the other Fortran tools), as columnar folder or both")
+    return parser
+
+
+def _npy_header(dtype, n_rows):
+    """Header of a 1D .npy file, always NPY_HEADER_SIZE bytes long so that it can be rewritten with the final size."""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), n_rows)
+    header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def _statistics(values):
+    """Minimum and maximum of the finite values of a column (None if there are none)."""
+    if values.dtype.kind == 'f':
+        values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None, None
+    return values.min().item(), values.max().item()
+
+
+class ColumnarWriter:
+    def __init__(self, output_dir, dtypes=None, metadata=None, row_group_size=ROW_GROUP_SIZE):
+        """
+        Write a table as a folder with one .npy file per column, a chunk of rows at a time.
+
+        The rows are divided in row groups of row_group_size rows, and the minimum and maximum of every
+        column in every row group are saved in columns.json, so that read_columnar can skip the row groups
+        that cannot pass a filter. The files replace the old ones only when the writer is closed.
+
+        Parameters:
+            output_dir (str): Folder of the table, created if needed.
+            dtypes (dict): Type of the columns (e.g. {'magnitude': 'float32'}), the others keep their type.
+            metadata (dict): Extra information saved in columns.json (e.g. the bands of a catalogue).
+            row_group_size (int): Number of rows of the row groups.
+        """
+        self.output_dir = output_dir
+        self.dtypes = dict(dtypes or {})
+        self.metadata = metadata or {}
+        self.row_group_size = row_group_size
+        self.columns = None
+        self.files = {}
+        self.n_rows = 0
+        self.row_groups = []
+
+    def _open(self, table):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.columns = list(table.keys())
+        for name in self.columns:
+            dtype = np.dtype(self.dtypes.get(name, np.asarray(table[name]).dtype))
+            if dtype.hasobject:
+                raise ValueError(f"Column {name} is not numeric.")
+            self.dtypes[name] = dtype
+            self.files[name] = open(os.path.join(self.output_dir, f"{name}.npy.tmp"), 'wb')
+            self.files[name].write(_npy_header(dtype, 0))
+
+    def write(self, table):
+        """Append the rows of a table (DataFrame or dict of columns, always with the same columns)."""
+        if self.columns is None:
+            self._open(table)
+        elif list(table.keys()) != self.columns:
+            raise ValueError(f"The columns {list(table.keys())} are not the columns of the table {self.columns}.")
+
+        columns = {name: np.asarray(table[name]).astype(self.dtypes[name], copy=False) for name in self.columns}
+        n_rows = len(columns[self.columns[0]]) if self.columns else 0
+        for start in range(0, n_rows, self.row_group_size):
+            stop = min(start + self.row_group_size, n_rows)
+            group = {'start': self.n_rows + start, 'stop': self.n_rows + stop, 'min': {}, 'max': {}}
+            for name, values in columns.items():
+                values = values[start:stop]
+                self.files[name].write(values.tobytes())
+                group['min'][name], group['max'][name] = _statistics(values)
+            self.row_groups.append(group)
+        self.n_rows += n_rows
+
+    def close(self):
+        """Write the final headers and columns.json and replace the old files."""
+        if self.columns is None:
+            self._open({})
+        for name, f in self.files.items():
+            f.seek(0)
+            f.write(_npy_header(self.dtypes[name], self.n_rows))
+            f.close()
+            path = os.path.join(self.output_dir, f"{name}.npy")
+            os.replace(path + '.tmp', path)
+        description = {'n_rows': self.n_rows, 'columns': self.columns, 'dtypes': {name: self.dtypes[name].str
+                       for name in self.columns}, 'row_groups': self.row_groups, 'metadata': self.metadata}
+        with open(os.path.join(self.output_dir, 'columns.json'), 'w') as f:
+            json.dump(description, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the old table as it was
+            for name, f in self.files.items():
+                f.close()
+                os.remove(os.path.join(self.output_dir, f"{name}.npy.tmp"))
+
+
+def write_columnar(output_dir, table, metadata=None, dtypes=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Save a table as a folder with one .npy file per column and a columns.json description (see ColumnarWriter).
+
+    Parameters:
+        output_dir (str): Folder of the table, created if needed.
+        table (pd.DataFrame or dict): Columns to save.
+        metadata (dict): Extra information saved in columns.json (e.g. the bands of a catalogue).
+        dtypes (dict): Type of the columns, e.g. {'F814W': 'float32'}.
+        row_group_size (int): Number of rows of the row groups.
+    """
+    with ColumnarWriter(output_dir, dtypes=dtypes, metadata=metadata, row_group_size=row_group_size) as writer:
+        writer.write(table)
+
+
+def convert_to_columnar(input_file, output_dir, names=None, usecols=None, dtypes=None, chunksize=1000000, **options):
+    """
+    Convert a text table (.xym, .lnk, MAT, catalog.xym, ...) to a columnar folder, chunksize rows at a time.
+
+    The other keyword arguments (skiprows, sep, header, comment) are the ones of read_xym.
+
+    Returns:
+        int: Number of rows written.
+    """
+    with ColumnarWriter(output_dir, dtypes=dtypes) as writer:
+        for chunk in iter_xym(input_file, names=names, usecols=usecols, chunksize=chunksize, **options):
+            chunk.columns = [str(name) for name in chunk.columns]
+            writer.write(chunk)
+    return writer.n_rows
+
+
+def _description(input_dir):
+    with open(os.path.join(input_dir, 'columns.json')) as f:
+        return json.load(f)
+
+
+def _save_column(output_dir, name, values):
+    """Save one column, replacing the old file only when the new one is complete (it may be memory mapped)."""
+    path = os.path.join(output_dir, f"{name}.npy")
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, values)
+    os.replace(path + '.tmp', path)
+
+
+def update_columnar(output_dir, table, metadata=None):
+    """
+    Replace (or add) some columns of a table saved by write_columnar, leaving the others untouched.
+
+    The replaced columns keep their type and the statistics of the row groups are updated.
+
+    Parameters:
+        output_dir (str): Folder of the table.
+        table (pd.DataFrame or dict): Columns to write, with the same number of rows as the table.
+        metadata (dict): If given, replaces the extra information of the table.
+    """
+    description = _description(output_dir)
+    dtypes = description.setdefault('dtypes', {})
+    row_groups = description.get('row_groups') or [{'start': 0, 'stop': description['n_rows'], 'min': {}, 'max': {}}]
+    for name in table.keys():
+        values = np.asarray(table[name])
+        if len(values) != description['n_rows']:
+            raise ValueError(f"Column {name} has {len(values)} rows instead of {description['n_rows']}.")
+        values = values.astype(dtypes.get(name, values.dtype), copy=False)
+        _save_column(output_dir, name, values)
+        dtypes[name] = values.dtype.str
+        for group in row_groups:
+            group['min'][name], group['max'][name] = _statistics(values[group['start']:group['stop']])
+        if name not in description['columns']:
+            description['columns'].append(name)
+    description['row_groups'] = row_groups
+    if metadata is not None:
+        description['metadata'] = metadata
+    with open(os.path.join(output_dir, 'columns.json'), 'w') as f:
+        json.dump(description, f)
+
+
+def _may_pass(group, name, comparison, value):
+    """False if the statistics of the row group show that no row can pass the filter."""
+    if name not in group['min']:
+        return True
+    low, high = group['min'][name], group['max'][name]
+    if low is None:
+        # Only NaN in the row group
+        return comparison == '!='
+    if comparison == '<':
+        return low < value
+    if comparison == '<=':
+        return low <= value
+    if comparison == '>':
+        return high > value
+    if comparison == '>=':
+        return high >= value
+    if comparison == '==':
+        return low <= value <= high
+    return not low == high == value
+
+
+def read_columnar(input_dir, columns=None, filters=None):
+    """
+    Read a table saved by write_columnar, memory mapping only the requested columns.
+
+    Parameters:
+        input_dir (str): Folder of the table.
+        columns (list[str]): Columns to read, default all.
+        filters (list[tuple]): Conditions (column, comparison, value) that the rows must all pass, with comparison
+            one of '<', '<=', '>', '>=', '==', '!=', e.g. [('magnitude', '<', -5)]. The row groups whose
+            statistics exclude a condition are not read at all.
+
+    Returns:
+        pd.DataFrame: The table.
+    """
+    description = _description(input_dir)
+    columns = description['columns'] if columns is None else list(columns)
+    if not filters:
+        return pd.DataFrame({name: np.load(os.path.join(input_dir, f"{name}.npy"), mmap_mode='r')
+                             for name in columns})
+
+    for _, comparison, _ in filters:
+        if comparison not in OPERATORS:
+            raise ValueError(f"Unknown comparison {comparison}, use one of {list(OPERATORS)}.")
+    names = list(dict.fromkeys(columns + [name for name, _, _ in filters]))
+    arrays = {name: np.load(os.path.join(input_dir, f"{name}.npy"), mmap_mode='r') for name in names}
+    row_groups = description.get('row_groups') or [{'start': 0, 'stop': description['n_rows'], 'min': {}, 'max': {}}]
+
+    rows = []
+    for group in row_groups:
+        if not all(_may_pass(group, *condition) for condition in filters):
+            continue
+        start, stop = group['start'], group['stop']
+        keep = np.ones(stop - start, dtype=bool)
+        for name, comparison, value in filters:
+            keep &= OPERATORS[comparison](arrays[name][start:stop], value)
+        rows.append(np.flatnonzero(keep) + start)
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    return pd.DataFrame({name: arrays[name][rows] for name in columns})
+
+
+def read_metadata(input_dir):
+    """Extra information saved with a table by write_columnar."""
+    return _description(input_dir)['metadata']
+
+
+def save_table(table, output_file, output_format='text', dtypes=None, **text_options):
+    """
+    Save the output table of a script as text, as columnar folder or both.
+
+    Parameters:
+        table (pd.DataFrame): Table to save.
+        output_file (str): Path of the text file; the columnar folder has the same name with the .cols extension.
+        output_format (str): 'text', 'columnar' or 'both'.
+        dtypes (dict): Type of the columns of the columnar folder.
+        **text_options: Options of DataFrame.to_csv for the text file (e.g. sep=' ', header=False).
+
+    Returns:
+        list[str]: The paths written.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}, use one of {OUTPUT_FORMATS}.")
+    if output_format in ('text', 'both'):
+        table.to_csv(output_file, index=False, **text_options)
+    if output_format in ('columnar', 'both'):
+        write_columnar(columnar_path(output_file), table, dtypes=dtypes)
+    return output_paths(output_file, output_format)
+
+
+def columnar_path(output_file):
+    """Columnar folder of a text output file (F814W_s.xym -> F814W_s.cols)."""
+    return f"{os.path.splitext(output_file)[0]}.cols"
+
+
+def output_paths(output_file, output_format='text'):
+    """Paths written by save_table for an output file and format."""
+    paths = {'text': [output_file], 'columnar': [columnar_path(output_file)]}
+    return paths.get(output_format, paths['text'] + paths['columnar'])
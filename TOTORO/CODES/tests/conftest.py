@@ -0,0 +1,9 @@
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# The tools and the reduction scripts import each other as plain modules, as in the notebooks (tools first)
+CODES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('reduction', 'tools'):
+    sys.path.insert(0, os.path.join(CODES, folder))
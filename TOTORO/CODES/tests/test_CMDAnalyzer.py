@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+from matplotlib.path import Path
+
+from CMDAnalyzer import CMDRegionSelector, count_regions
+
+REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'FITS', '47_Tuc',
+                            'regions_RGB_F606W_F814W.csv')
+
+
+def ray_casting(vertices, x, y):
+    """Ray casting over all the edges, without bounding boxes and slabs."""
+    inside = np.zeros(len(x), dtype=bool)
+    for (xa, ya), (xb, yb) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inside ^= ((ya > y) != (yb > y)) & (x < xa + (y - ya) * (xb - xa) / (yb - ya))
+    return inside
+
+
+def test_regions_membership_matches_path():
+    regions = CMDRegionSelector.load_regions_cached(REGIONS_FILE)
+    vertices = np.concatenate(list(regions.values()))
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    rng = np.random.default_rng(2)
+    colors = rng.uniform(2 * low[0] - high[0], 2 * high[0] - low[0], 20000)
+    mags = rng.uniform(2 * low[1] - high[1], 2 * high[1] - low[1], 20000)
+    colors[::500] = np.nan
+
+    inside = CMDRegionSelector.regions_membership(regions, colors, mags, chunk_size=1000)
+    points = np.column_stack((colors, mags))
+    expected = np.column_stack([Path(polygon).contains_points(points) for polygon in regions.values()])
+    assert inside.any(axis=0).all()
+    np.testing.assert_array_equal(inside, expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_regions_membership_on_grid(seed):
+    # Concave polygons with vertices and stars on a grid: repeated magnitudes, horizontal edges and stars on
+    # the edges give the same result as the ray casting over all the edges
+    rng = np.random.default_rng(seed)
+    n = rng.integers(3, 40)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = rng.uniform(0.2, 1, n)
+    polygon = np.round(np.column_stack((radii * np.cos(angles), radii * np.sin(angles))), 1)
+    x = np.round(rng.uniform(-1.1, 1.1, 5000), 2)
+    y = np.round(rng.uniform(-1.1, 1.1, 5000), 1)
+
+    inside = CMDRegionSelector.regions_membership({0: polygon}, x, y, chunk_size=333)[:, 0]
+    np.testing.assert_array_equal(inside, ray_casting(polygon, x, y))
+
+
+def test_missing_regions_file(tmp_path, capsys):
+    file_name = str(tmp_path / 'regions.csv')
+    region_count = count_regions([0.5, 1.0], [18.0, 19.0], file_name)
+    assert f"File '{file_name}' not found." in capsys.readouterr().out
+    assert region_count.empty
+    labels, _ = CMDRegionSelector.classify_stars([0.5, 1.0], [18.0, 19.0], file_name)
+    np.testing.assert_array_equal(labels, [-1, -1])
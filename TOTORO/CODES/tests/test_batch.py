@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from batch import run_batch
+
+REDUCTION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reduction')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_run_batch_returns_the_number_of_failures(tmp_path, jobs):
+    existing = tmp_path / 'F814W.xym'
+    existing.write_text('1 2 3\n')
+    files = [str(existing), str(tmp_path / 'missing_1.xym'), str(tmp_path / 'missing_2.xym')]
+    assert run_batch(os.stat, files, jobs=jobs) == 2
+    assert run_batch(os.stat, files[:1], jobs=jobs) == 0
+
+
+def crash(input_file):
+    if 'crash' in input_file:
+        os._exit(1)
+
+
+def test_run_batch_survives_a_killed_worker(tmp_path, capsys):
+    files = [str(tmp_path / name) for name in ('F606W.xym', 'crash.xym', 'F814W.xym')]
+    failed = run_batch(crash, files, jobs=2)
+    output = capsys.readouterr().out
+    assert failed >= 1
+    assert f'Processed 3 files ({failed} failed)' in output
+    assert 'BrokenProcessPool' in output
+
+
+@pytest.mark.parametrize('script', ['plt_qfitmag.py', 'plot_residuals.py', 'data_filtering_acs.py'])
+def test_scripts_exit_with_error_when_a_file_fails(tmp_path, script):
+    process = subprocess.run([sys.executable, os.path.join(REDUCTION, script), str(tmp_path / 'missing.xym')],
+                             cwd=tmp_path, capture_output=True, text=True, env=dict(os.environ, MPLBACKEND='Agg'))
+    assert process.returncode == 1
+    assert '1 failed' in process.stdout
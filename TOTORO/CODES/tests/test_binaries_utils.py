@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from binaries_utils import BinaryStarUtils
+
+
+@pytest.fixture
+def stars():
+    rng = np.random.default_rng(1)
+    n = 200
+    stars = pd.DataFrame({'F606W': rng.uniform(14, 20, n), 'F814W': rng.uniform(13, 19, n),
+                          'mass': rng.uniform(0.3, 0.9, n)}, index=np.arange(n) * 3 + 5)
+    stars.loc[stars.index[::37], 'mass'] = np.nan
+    return stars
+
+
+def brute_force(stars, primaries, q_min=None, q_max=None):
+    """All the pairs of binary_system with q, then the mass ratio cut."""
+    grid = BinaryStarUtils.binary_system(stars, primaries, ['F606W', 'F814W'])
+    grid['q'] = stars.loc[grid['secondary'], 'mass'].to_numpy() / stars.loc[grid['primary'], 'mass'].to_numpy()
+    keep = np.ones(len(grid), dtype=bool)
+    if q_min is not None:
+        keep &= grid['q'] >= q_min
+    if q_max is not None:
+        keep &= grid['q'] <= q_max
+    return grid[keep].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 200, 100000])
+@pytest.mark.parametrize('q_min, q_max', [(None, None), (0.5, None), (None, 0.8), (0.4, 0.9)])
+def test_iter_binary_system_matches_full_grid(stars, chunk_size, q_min, q_max):
+    primaries = list(stars.index[::5])
+    blocks = list(BinaryStarUtils.iter_binary_system(stars, primaries, ['F606W', 'F814W'], chunk_size=chunk_size,
+                                                     mass_column='mass', q_min=q_min, q_max=q_max))
+    assert max(len(block) for block in blocks) <= chunk_size
+    result = pd.concat(blocks, ignore_index=True)
+    expected = brute_force(stars, primaries, q_min, q_max)[result.columns]
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_binary_system_columnar_round_trip(stars, tmp_path):
+    primaries = list(stars.index[::5])
+    output_dir = str(tmp_path / 'binaries')
+    n_rows = BinaryStarUtils.write_binary_system(output_dir, stars, primaries, ['F606W', 'F814W'], chunk_size=500,
+                                                 mass_column='mass', q_min=0.5)
+    expected = brute_force(stars, primaries, q_min=0.5)
+    result = BinaryStarUtils.read_binary_system(output_dir)
+    assert n_rows == len(expected)
+    pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False)
+
+    selected = BinaryStarUtils.read_binary_system(output_dir, columns=['q'], filters=[('q', '>=', 0.9)])
+    assert np.array_equal(selected['q'], expected.loc[expected['q'] >= 0.9, 'q'])
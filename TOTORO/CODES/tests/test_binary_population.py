@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from binary_population import binary_fraction
+
+
+def counts(stars):
+    return pd.DataFrame({'Region_ID': list(stars), 'Stars': list(stars.values())})
+
+
+def test_binary_fraction():
+    assert binary_fraction(counts({0: 800, 1: 14}), counts({0: 1000, 1: 100}), binary_region=1,
+                           total_region=0) == 14 / (800 * 100 / 1000)
+
+
+def test_binary_fraction_of_empty_regions():
+    assert np.isnan(binary_fraction(counts({0: 0, 1: 0}), counts({0: 1000, 1: 100}), 1, 0))
+    assert np.isnan(binary_fraction(counts({0: 800, 1: 14}), counts({0: 1000, 1: 0}), 1, 0))
+    assert np.isnan(binary_fraction(counts({0: 800, 1: 14}), counts({1: 100}), 1, 0))
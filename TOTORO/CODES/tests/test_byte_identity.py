@@ -0,0 +1,76 @@
+"""
+The _s.xym files of the filtering scripts and the FINAL_MASTER.xym of gaia_oriented.py must not change: the
+expected files in data/ were written by the scripts before they used xym_io (pd.read_csv, astype(str) and
+DataFrame.round).
+"""
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import data_filtering_acs
+import data_filtering_wfc3
+import gaia_oriented
+from xym_io import read_columnar
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def run(module, name, tmp_path, monkeypatch, input_file=None, expected=None, **options):
+    input_file = input_file or f"{name}.xym"
+    expected = expected or f"{name}_s.xym"
+    if not (tmp_path / input_file).exists():
+        shutil.copy(os.path.join(DATA, input_file), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    module.filter_data(input_file, **options)
+    with open(tmp_path / options.get('output_file', expected), 'rb') as f:
+        result = f.read()
+    with open(os.path.join(DATA, expected), 'rb') as f:
+        assert result == f.read()
+
+
+@pytest.mark.parametrize('chunksize', [None, 400])
+@pytest.mark.parametrize('name', ['wfc3_sentinel', 'wfc3_numeric', 'wfc3_other_tokens'])
+def test_wfc3_output_unchanged(tmp_path, monkeypatch, name, chunksize):
+    run(data_filtering_wfc3, name, tmp_path, monkeypatch, chunksize=chunksize)
+
+
+@pytest.mark.parametrize('chunksize', [None, 400])
+def test_acs_output_unchanged(tmp_path, monkeypatch, chunksize):
+    run(data_filtering_acs, 'acs', tmp_path, monkeypatch, chunksize=chunksize)
+
+
+def test_wfc3_output_unchanged_from_cache(tmp_path, monkeypatch):
+    # The second run reads the binary cache written by the first one
+    run(data_filtering_wfc3, 'wfc3_sentinel', tmp_path, monkeypatch)
+    assert (tmp_path / '.wfc3_sentinel.xym.npy').exists()
+    run(data_filtering_wfc3, 'wfc3_sentinel', tmp_path, monkeypatch, chunksize=400)
+
+
+@pytest.mark.parametrize('chunksize', [1000000, 400])
+@pytest.mark.parametrize('name', ['gaia_numeric', 'gaia_sentinel'])
+def test_gaia_output_unchanged(tmp_path, monkeypatch, name, chunksize):
+    # gaia_sentinel has ***** sentinels in x and in the magnitude (written as they are), nan magnitudes (dropped)
+    # and dx that are not numbers
+    run(gaia_oriented, name, tmp_path, monkeypatch, input_file=f"{name}.lnk", expected=f"{name}_master.xym",
+        output_file='FINAL_MASTER.xym', chunksize=chunksize)
+
+
+@pytest.mark.parametrize('output_format', ['columnar', 'both'])
+@pytest.mark.parametrize('module, name', [(data_filtering_acs, 'acs'), (data_filtering_wfc3, 'wfc3_sentinel')])
+def test_columnar_output_does_not_depend_on_chunks(tmp_path, monkeypatch, module, name, output_format):
+    # The .cols folder holds the selected values as they are read (not the rounded text), with or without chunks
+    tables = []
+    for chunksize in (None, 400):
+        folder = tmp_path / str(chunksize)
+        folder.mkdir()
+        shutil.copy(os.path.join(DATA, f"{name}.xym"), folder)
+        monkeypatch.chdir(folder)
+        module.filter_data(f"{name}.xym", chunksize=chunksize, output_format=output_format)
+        assert (folder / f"{name}_s.xym").exists() == (output_format == 'both')
+        with open(folder / f"{name}_s.cols" / 'columns.json') as f:
+            tables.append((read_columnar(str(folder / f"{name}_s.cols")), json.load(f)))
+    pd.testing.assert_frame_equal(tables[0][0], tables[1][0])
+    assert tables[0][1] == tables[1][1]
@@ -0,0 +1,51 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from decontamination import FieldSubtraction, cmd_name
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(7)
+    n = 4000
+    data = pd.DataFrame({'x': rng.uniform(0, 1000, n), 'y': rng.uniform(0, 1000, n),
+                         'F336W': np.round(rng.uniform(16, 24, n), 2), 'F555W': np.round(rng.uniform(15, 23, n), 2),
+                         'F814W': np.round(rng.uniform(14, 22, n), 2)})
+    data.loc[data.index[::29], 'F336W'] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('bins', [(0.1, 0.2), (0.25, 0.5), (1.0, 2.0)])
+def test_hess_diagrams_and_weights(data, bins):
+    subtraction = FieldSubtraction(data, cluster=((300, 300), 200), reference=((700, 700), 250))
+    weights = subtraction.weights(color_bin=bins[0], mag_bin=bins[1])
+    assert len(weights) == subtraction.cluster.sum()
+
+    for cmd in [('F336W', 'F555W', 'F555W'), ('F336W', 'F814W', 'F814W'), ('F555W', 'F814W', 'F814W')]:
+        cluster, field, _, _ = subtraction.hess(cmd)
+        stars = data[subtraction.cluster]
+        reference = data[subtraction.reference]
+        # Every star with the filters of the CMD is in one cell
+        assert cluster.sum() == stars[list(cmd)].notna().all(axis=1).sum()
+        assert field.sum() == pytest.approx(reference[list(cmd)].notna().all(axis=1).sum() * subtraction.scale)
+
+        # The weights of the stars of a cell add up to the cluster stars minus the expected field stars
+        column = weights[cmd_name(cmd)]
+        assert column.notna().sum() == cluster.sum()
+        assert column.sum() == pytest.approx((cluster - np.minimum(field, cluster)).sum())
+        assert ((column.dropna() >= 0) & (column.dropna() <= 1)).all()
+    assert (weights['weight'] == weights.drop(columns='weight').min(axis=1)).all()
+
+
+def test_cmd_without_stars(data):
+    # No star has F336W: its CMDs have NaN weights and no warning is raised
+    data['F336W'] = np.nan
+    subtraction = FieldSubtraction(data, cluster=((300, 300), 200), reference=((700, 700), 250))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        weights = subtraction.weights()
+    assert weights[cmd_name(('F336W', 'F814W', 'F814W'))].isna().all()
+    assert weights[cmd_name(('F555W', 'F814W', 'F814W'))].notna().all()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hess_diagram import HessDiagram
+
+CMD = ('F606W', 'F814W', 'F814W')
+
+
+def catalog(seed, n=500):
+    # Magnitudes with two decimals, as in the catalogues, many of them on the edges of the cells
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'F606W': np.round(rng.uniform(15, 24, n), 2), 'F814W': np.round(rng.uniform(14, 25, n), 2)})
+    data.loc[data.index[::41], 'F606W'] = np.nan
+    return data
+
+
+def assert_all_levels(hess, n_valid):
+    for level in range(hess.levels):
+        counts, color_edges, mag_edges = hess.histogram(CMD, level)
+        assert counts.sum() == n_valid
+        assert counts.shape == (len(color_edges) - 1, len(mag_edges) - 1)
+
+
+def test_stars_on_the_last_cell_are_counted():
+    data = pd.DataFrame({'F606W': [15.32, 23.07], 'F814W': [22.87, 24.15]})
+    assert_all_levels(HessDiagram(data), 2)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_histograms_count_all_the_stars(seed):
+    data = catalog(seed)
+    hess = HessDiagram(data, levels=3)
+    n_valid = int(data.notna().all(axis=1).sum())
+    assert_all_levels(hess, n_valid)
+    assert hess.count_box(CMD, (-100, 100), (-100, 100)) == n_valid
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_add_and_remove_inside_the_grid(seed):
+    data = catalog(seed)
+    hess = HessDiagram(data, levels=3)
+    counts = hess.histogram(CMD)[0].copy()
+
+    # The stars inside the grid update the cached histogram
+    stars = catalog(seed + 100, 50).clip(lower=18, upper=20)
+    labels = hess.add(stars)
+    assert CMD in hess.cache
+    expected = HessDiagram(pd.concat([data, stars], ignore_index=True), levels=3)
+    for level in range(3):
+        np.testing.assert_array_equal(hess.histogram(CMD, level)[0], expected.histogram(CMD, level)[0])
+    hess.remove(labels)
+    np.testing.assert_array_equal(hess.histogram(CMD)[0], counts)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_add_and_remove_outside_the_grid(seed):
+    data = catalog(seed)
+    hess = HessDiagram(data, levels=3)
+    hess.histogram(CMD)
+    n_valid = int(data.notna().all(axis=1).sum())
+
+    # The stars outside the grid drop the cached histogram, which is built again with them
+    stars = catalog(seed + 100, 50) + 5
+    labels = hess.add(stars)
+    assert CMD not in hess.cache
+    assert_all_levels(hess, n_valid + int(stars.notna().all(axis=1).sum()))
+    hess.remove(labels)
+    assert_all_levels(hess, n_valid)
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from photometric_errors import ErrorModel
+
+
+@pytest.mark.parametrize('mag_range', [None, (-12, -6)])
+def test_from_matchup_reads_like_pandas(tmp_path, mag_range):
+    # MATCHUP.XYMEEE rows: 14 columns with the star name in the 12th and ********* overflows
+    rng = np.random.default_rng(6)
+    n = 2000
+    mags = rng.uniform(-14, -4, n)
+    lines = []
+    for i, mag in enumerate(mags):
+        res_mag = '*********' if i % 97 == 0 else f"{0.01 * np.exp(mag + 14) / 1000:.4f}"
+        lines.append(f"{rng.uniform(0, 4000):10.4f} {rng.uniform(0, 4000):10.4f} {mag:10.4f} 0.0448 0.0904 "
+                     f"{res_mag} 9.9990 4 3 4 3 N{i + 1:06d} 4577 1882")
+    file_name = tmp_path / 'MATCHUP.XYMEEE'
+    file_name.write_text('\n'.join(lines) + '\n')
+
+    data = pd.read_csv(file_name, sep=r'\s+', header=None, usecols=[2, 5], names=['mag', 'res_mag'])
+    data = data.apply(pd.to_numeric, errors='coerce')
+    if mag_range is not None:
+        data = data[(data['mag'] >= mag_range[0]) & (data['mag'] <= mag_range[1])]
+    expected = ErrorModel(data['mag'], data['res_mag']).table
+    pd.testing.assert_frame_equal(ErrorModel.from_matchup(str(file_name), mag_range=mag_range).table, expected)
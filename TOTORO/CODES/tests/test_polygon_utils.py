@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from polygon_utils import edge_distance, points_in_polygon, points_in_polygons
+from spatial_index import SpatialIndex
+
+SQUARE = [(0, 0), (2, 0), (2, 2), (0, 2)]
+TRIANGLE = [(1, 1), (3, 1), (1, 3)]
+
+
+def test_points_in_polygons_columns():
+    x = np.array([0.5, 1.5, 2.5, 1.2, np.nan, -1.0])
+    y = np.array([0.5, 1.5, 1.2, 1.2, 1.0, 1.0])
+    inside = points_in_polygons(x, y, [SQUARE, TRIANGLE])
+    np.testing.assert_array_equal(inside, [[True, False], [True, True], [False, True], [True, True],
+                                           [False, False], [False, False]])
+    np.testing.assert_array_equal(points_in_polygon(x, y, TRIANGLE), inside[:, 1])
+    assert points_in_polygons(x, y, []).shape == (len(x), 0)
+
+
+def test_edge_distance():
+    x = np.array([1.0, 3.0, 1.0, 0.5])
+    y = np.array([1.0, 1.0, 4.0, 0.2])
+    np.testing.assert_allclose(edge_distance(x, y, [SQUARE]), [1.0, 1.0, 2.0, 0.2])
+    assert np.isinf(edge_distance(x, y, [])).all()
+
+
+def test_spatial_index_polygon_matches_full_test():
+    rng = np.random.default_rng(4)
+    data = pd.DataFrame({'x': rng.uniform(0, 100, 5000), 'y': rng.uniform(0, 100, 5000)})
+    polygon = [(10, 10), (80, 20), (50, 50), (90, 90), (15, 70)]
+    mask = SpatialIndex(data).in_polygon(polygon)
+    np.testing.assert_array_equal(mask, points_in_polygon(data['x'], data['y'], polygon))
+    assert 0 < mask.sum() < len(data)
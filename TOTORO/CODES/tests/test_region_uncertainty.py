@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from CMDAnalyzer import CMDRegionSelector
+from region_uncertainty import RegionCounter, _resample
+
+REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'FITS', '47_Tuc',
+                            'regions_RGB_F606W_F814W.csv')
+
+
+@pytest.fixture
+def stars():
+    # Stars around the regions, with errors large enough to put many of them close to an edge
+    regions = CMDRegionSelector.load_regions_cached(REGIONS_FILE)
+    vertices = np.concatenate(list(regions.values()))
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    rng = np.random.default_rng(3)
+    n = 3000
+    colors = rng.uniform(low[0], high[0], n)
+    mags = rng.uniform(low[1], high[1], n)
+    return colors, mags, np.full(n, 0.01), np.full(n, 0.02)
+
+
+def test_observed_counts_match_classification(stars):
+    colors, mags, color_errors, mag_errors = stars
+    counter = RegionCounter(colors, mags, REGIONS_FILE, color_errors=color_errors, mag_errors=mag_errors)
+    _, region_count = CMDRegionSelector.classify_stars(colors, mags, REGIONS_FILE)
+    np.testing.assert_array_equal(counter.observed, region_count['Stars'])
+    assert 0 < len(counter.near) < len(colors)
+    # The stars far from the edges and the ones close to an edge are all the stars
+    assert counter.pattern_counts.sum() + len(counter.near) == len(colors)
+
+
+@pytest.mark.parametrize('with_errors', [False, True])
+def test_no_resampling_gives_observed_counts(stars, with_errors):
+    colors, mags, color_errors, mag_errors = stars
+    errors = {'color_errors': color_errors, 'mag_errors': mag_errors} if with_errors else {}
+    counter = RegionCounter(colors, mags, REGIONS_FILE, **errors)
+    distributions = counter.resample(7, bootstrap=False, perturb=False, seed=1)
+    assert (distributions.to_numpy() == counter.observed).all()
+
+
+def test_tiny_errors_give_observed_counts(stars):
+    # All the stars are perturbed, by much less than their distance from the edges
+    colors, mags, _, _ = stars
+    counter = RegionCounter(colors, mags, REGIONS_FILE, color_errors=1e-12, mag_errors=1e-12, n_sigma=1e12)
+    assert len(counter.near) == len(colors)
+    distributions = counter.resample(5, bootstrap=False, perturb=True, seed=1)
+    assert (distributions.to_numpy() == counter.observed).all()
+
+
+def test_resamples_do_not_depend_on_jobs(stars):
+    colors, mags, color_errors, mag_errors = stars
+    counter = RegionCounter(colors, mags, REGIONS_FILE, color_errors=color_errors, mag_errors=mag_errors)
+    serial = counter.resample(30, seed=5, jobs=1, batch_size=7)
+    parallel = counter.resample(30, seed=5, jobs=2, batch_size=7)
+    np.testing.assert_array_equal(serial.to_numpy(), parallel.to_numpy())
+    # Every resample draws len(colors) stars, and a star is at most in every region
+    assert (serial.to_numpy().sum(axis=1) <= len(colors) * len(counter.region_ids)).all()
+    assert not (serial.to_numpy() == counter.observed).all()
+
+
+def test_copies_of_a_star_are_perturbed_independently():
+    # A single star on the edge of a square, drawn 1000 times: every copy falls inside half of the times
+    regions = {0: np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]])}
+    star = (np.array([0.0]), np.array([0.5]), np.array([0.01]), np.array([0.01]), np.zeros(1),
+            np.ones((1, 1), dtype=np.int64))
+    counts = _resample(regions, np.empty((0, 1), dtype=np.int64), np.empty(0, dtype=np.int64), *star, 1000,
+                       True, True, 20, 4)
+    assert ((counts > 400) & (counts < 600)).all()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import gaia_oriented
+from xym_io import iter_xym, read_xym
+
+
+@pytest.fixture
+def mat_file(tmp_path):
+    # MAT.00x files have 15 columns, without the magnitude column 15 of the .lnk files
+    rng = np.random.default_rng(8)
+    file_name = tmp_path / 'MAT.002'
+    np.savetxt(file_name, rng.uniform(-1, 1, (50, 15)), fmt='%10.4f')
+    return str(file_name)
+
+
+def test_missing_columns_raise(mat_file):
+    # As pd.read_csv, a column past the end of the rows is an error, from the text and from the cache
+    with pytest.raises(ValueError, match=r'Columns \[15\]'):
+        list(iter_xym(mat_file, usecols=[2, 15], chunksize=20))
+    with pytest.raises(ValueError, match=r'Columns \[15\]'):
+        read_xym(mat_file, usecols=[2, 15])
+    with pytest.raises(ValueError, match=r'Columns \[15\]'):
+        list(iter_xym(mat_file, usecols=[2, 15], chunksize=20))
+    assert read_xym(mat_file, usecols=[2, 14]).shape == (50, 2)
+
+
+def test_gaia_fails_without_the_magnitude_column(mat_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ValueError):
+        gaia_oriented.filter_data(mat_file)
+    assert not (tmp_path / 'FINAL_MASTER.xym').exists()
+
+
+def test_cache_is_replaced_whole(mat_file, tmp_path):
+    first = read_xym(mat_file)
+    # A cache being memory mapped is replaced by a new file, not written over
+    columns = np.load(tmp_path / '.MAT.002.npy', mmap_mode='r')
+    with open(mat_file, 'a') as f:
+        f.write(' '.join(['1.0'] * 15) + '\n')
+    second = read_xym(mat_file)
+    assert len(second) == len(first) + 1
+    np.testing.assert_array_equal(np.asarray(columns).T, first.to_numpy())
+    assert not list(tmp_path.glob('*.tmp')) and not list(tmp_path.glob('.*.tmp'))
@@ -12,12 +12,227 @@ The main functions are:
     - color_index_noncalibrated: Generate color indices for a DataFrame based on the secondary star indices, ensuring HB stars have lighter colors.
     Suited for non-calibrated magnitudes.
     - color_index: Generate color indices for a DataFrame based on the secondary star indices. Suited for calibrated magnitudes.
+    - binary_system: Generate the magnitudes of all the primary/secondary pairs in any number of filters.
+    - binary_magnitudes: Kernel combining arrays of primary and secondary magnitudes.
+    - iter_binary_system: Generate the binary systems in blocks of pairs, optionally keeping only some mass ratios
+    or magnitudes, so that grids larger than the memory can be built.
+    - write_binary_system: Write the blocks directly to a text file (like BS_HB_vis.csv) or to a columnar folder.
+    - read_binary_system: Read a columnar folder, memory mapping the requested columns.
+
+The magnitudes are converted to fluxes once, and the fluxes of all the pairs are summed with NumPy
+broadcasting, so full isochrones can be combined (thousands of primaries x thousands of secondaries).
+The columnar folders are the ones of the reduction scripts (see reduction/xym_io.py: one .npy file per column
+and a columns.json description), so the same reader and row-group filters work on catalogues and binary grids.
+xym_io is imported only when a columnar folder is written or read, so the reduction folder has to be on the path
+(like the tools folder) only for these two functions.
 
 ================================================================================
 '''
 
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
 
 class BinaryStarUtils:
+    @staticmethod
+    def binary_magnitudes(primary_mags, secondary_mags):
+        """
+        Magnitudes of the binary systems formed by every primary with every secondary.
+
+        Parameters:
+            primary_mags (np.ndarray): Magnitudes of the primaries, shape (n_primaries, n_filters).
+            secondary_mags (np.ndarray): Magnitudes of the secondaries, shape (n_secondaries, n_filters).
+
+        Returns:
+            np.ndarray: Magnitudes of the binaries, shape (n_primaries, n_secondaries, n_filters).
+        """
+        primary_flux = 10 ** (-np.asarray(primary_mags, dtype=float) / 2.5)
+        secondary_flux = 10 ** (-np.asarray(secondary_mags, dtype=float) / 2.5)
+        return -2.5 * np.log10(primary_flux[:, None, :] + secondary_flux[None, :, :])
+
+    @staticmethod
+    def binary_system(df, primary_indices, filters):
+        """
+        Generate a DataFrame with magnitudes of binary systems for multiple primary stars and any number of filters.
+
+        Parameters:
+            df (pd.DataFrame): DataFrame containing stars with magnitudes in different filters.
+            primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
+            filters (list[str]): Names of the filter columns.
+
+        Returns:
+            pd.DataFrame: A new DataFrame containing binary system magnitudes, primary and secondary star indices,
+            with all the secondaries of the first primary, then all the secondaries of the second one, and so on.
+            For grids that do not fit in memory use iter_binary_system or write_binary_system.
+        """
+        filters = list(filters)
+        primary_indices = np.asarray(primary_indices)
+        magnitudes = BinaryStarUtils.binary_magnitudes(df.loc[primary_indices, filters].to_numpy(),
+                                                       df[filters].to_numpy())
+
+        result = {
+            "primary": np.repeat(primary_indices, len(df)),  # Primary star index
+            "secondary": np.tile(df.index.to_numpy(), len(primary_indices)),  # Secondary star indices
+        }
+        for i, filter_name in enumerate(filters):
+            result[filter_name] = magnitudes[:, :, i].ravel()
+
+        return pd.DataFrame(result)
+
+    @staticmethod
+    def iter_binary_system(df, primary_indices, filters, chunk_size=1000000, mass_column=None, q_min=None, q_max=None,
+                           mag_limits=None):
+        """
+        Generate the binary systems in blocks of at most chunk_size primary/secondary pairs.
+
+        The blocks come in the same order as the rows of binary_system. With a mass ratio range, the secondaries
+        of every primary are looked up in the sorted masses, so only the pairs in the range are generated and the
+        memory depends on chunk_size, not on the total number of pairs.
+
+        Parameters:
+            df (pd.DataFrame): DataFrame containing stars with magnitudes in different filters.
+            primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
+            filters (list[str]): Names of the filter columns.
+            chunk_size (int): Maximum number of pairs in a block.
+            mass_column (str): Column with the masses, needed to select on the mass ratio.
+            q_min (float): Minimum mass ratio m_secondary / m_primary.
+            q_max (float): Maximum mass ratio m_secondary / m_primary.
+            mag_limits (dict): Filter name -> (min, max) range of the binary magnitude to keep.
+
+        Yields:
+            pd.DataFrame: Block with columns primary, secondary, the filters and, if mass_column is given, q.
+        """
+        filters = list(filters)
+        primary_indices = np.asarray(primary_indices)
+        if (q_min is not None or q_max is not None) and mass_column is None:
+            raise ValueError("mass_column is needed to select on the mass ratio.")
+
+        # Fluxes are computed once for all the stars
+        primary_flux = 10 ** (-df.loc[primary_indices, filters].to_numpy(dtype=float) / 2.5)
+        secondary_flux = 10 ** (-df[filters].to_numpy(dtype=float) / 2.5)
+        secondary_index = df.index.to_numpy()
+        n_secondaries = len(df)
+        if mass_column is not None:
+            primary_mass = df.loc[primary_indices, mass_column].to_numpy(dtype=float)
+            secondary_mass = df[mass_column].to_numpy(dtype=float)
+
+        # Secondaries of every primary: with a mass ratio range, the ones with mass between q_min * M1 and
+        # q_max * M1 (slightly widened, the exact test on q is done on the pairs), found in the sorted masses
+        low = np.zeros(len(primary_indices), dtype=np.int64)
+        high = np.full(len(primary_indices), n_secondaries, dtype=np.int64)
+        order = None
+        if q_min is not None or q_max is not None:
+            order = np.argsort(secondary_mass, kind='stable')
+            sorted_mass = secondary_mass[order]
+            if q_min is not None:
+                low = np.searchsorted(sorted_mass, q_min * primary_mass * (1 - 1e-9), side='left')
+            if q_max is not None:
+                high = np.searchsorted(sorted_mass, q_max * primary_mass * (1 + 1e-9), side='right')
+
+        def make_block(pieces):
+            """Binary systems of a list of (primary, secondaries) pieces."""
+            i = np.concatenate([np.full(len(j), k) for k, j in pieces])
+            j = np.concatenate([j for _, j in pieces])
+            if mass_column is not None:
+                q = secondary_mass[j] / primary_mass[i]
+                keep = np.ones(len(q), dtype=bool)
+                if q_min is not None:
+                    keep &= q >= q_min
+                if q_max is not None:
+                    keep &= q <= q_max
+                i, j, q = i[keep], j[keep], q[keep]
+
+            magnitudes = -2.5 * np.log10(primary_flux[i] + secondary_flux[j])
+
+            if mag_limits:
+                keep = np.ones(len(i), dtype=bool)
+                for filter_name, (mag_min, mag_max) in mag_limits.items():
+                    column = magnitudes[:, filters.index(filter_name)]
+                    keep &= (column >= mag_min) & (column <= mag_max)
+                i, j, magnitudes = i[keep], j[keep], magnitudes[keep]
+                if mass_column is not None:
+                    q = q[keep]
+
+            block = {"primary": primary_indices[i], "secondary": secondary_index[j]}
+            for k, filter_name in enumerate(filters):
+                block[filter_name] = magnitudes[:, k]
+            if mass_column is not None:
+                block["q"] = q
+            return pd.DataFrame(block)
+
+        # Blocks of at most chunk_size candidate pairs, primary-major and with the secondaries in the order of df
+        chunk_size = max(1, chunk_size)
+        pieces, size = [], 0
+        for k in range(len(primary_indices)):
+            if high[k] <= low[k]:
+                continue
+            secondaries = np.arange(low[k], high[k]) if order is None else np.sort(order[low[k]:high[k]])
+            start = 0
+            while start < len(secondaries):
+                piece = secondaries[start:start + chunk_size - size]
+                pieces.append((k, piece))
+                size += len(piece)
+                start += len(piece)
+                if size == chunk_size:
+                    block = make_block(pieces)
+                    pieces, size = [], 0
+                    if len(block):
+                        yield block
+        if pieces:
+            block = make_block(pieces)
+            if len(block):
+                yield block
+
+    @staticmethod
+    def write_binary_system(output_file, df, primary_indices, filters, chunk_size=1000000, **selection):
+        """
+        Write the binary systems block by block, without keeping the whole grid in memory.
+
+        Parameters:
+            output_file (str): A .csv file is written as text, in the format of BS_HB_vis.csv
+                (space separated, 4 decimals); any other path is a columnar folder (see xym_io.ColumnarWriter).
+            df, primary_indices, filters, chunk_size: As in iter_binary_system.
+            **selection: mass_column, q_min, q_max and mag_limits, as in iter_binary_system.
+
+        Returns:
+            int: Number of binary systems written.
+        """
+        blocks = BinaryStarUtils.iter_binary_system(df, primary_indices, filters, chunk_size=chunk_size, **selection)
+        n_rows = 0
+
+        if output_file.endswith('.csv'):
+            with open(output_file, 'w') as f:
+                for block in blocks:
+                    block.to_csv(f, index=False, header=(n_rows == 0), float_format='%.4f', sep=' ')
+                    n_rows += len(block)
+            return n_rows
+
+        from xym_io import ColumnarWriter
+
+        with ColumnarWriter(output_file) as writer:
+            for block in blocks:
+                writer.write(block)
+                n_rows += len(block)
+        return n_rows
+
+    @staticmethod
+    def read_binary_system(input_dir, columns=None, filters=None):
+        """
+        Read binary systems written by write_binary_system in columnar format.
+
+        Parameters:
+            input_dir (str): Folder written by write_binary_system.
+            columns (list[str]): Columns to read (default all), the others are not touched.
+            filters (list[tuple]): Conditions on the columns, e.g. [('q', '>=', 0.5)] (see xym_io.read_columnar).
+
+        Returns:
+            pd.DataFrame: The binary systems.
+        """
+        from xym_io import read_columnar
+
+        return read_columnar(input_dir, columns=columns, filters=filters)
+
     @staticmethod
     def binary_system_HB(df, primary_indices, filter1, filter2, source_column='source', hb_label='HB_test_stars'):
         """
@@ -40,33 +255,7 @@ class BinaryStarUtils:
             if df.loc[star_index, source_column] != hb_label:
                 raise ValueError(f"Star at index {star_index} is not labeled as an HB star.")
 
-        # List to store results
-        results = []
-
-        for star_index in primary_indices:
-            # Extract primary magnitudes
-            mag1_p = df.loc[star_index, filter1]
-            mag2_p = df.loc[star_index, filter2]
-
-            # Compute binary magnitudes using vectorized operations
-            mag1_bin = -2.5 * np.log10(10 ** (-mag1_p / 2.5) + 10 ** (-df[filter1] / 2.5))
-            mag2_bin = -2.5 * np.log10(10 ** (-mag2_p / 2.5) + 10 ** (-df[filter2] / 2.5))
-
-            # Create a temporary DataFrame for this primary
-            temp_df = pd.DataFrame({
-                "primary": star_index,  # Add primary star index
-                "secondary": df.index,  # Add secondary star indices
-                filter1: mag1_bin,
-                filter2: mag2_bin
-            })
-
-            # Append to results
-            results.append(temp_df)
-
-        # Concatenate all results into a single DataFrame
-        result_df = pd.concat(results, ignore_index=True)
-
-        return result_df
+        return BinaryStarUtils.binary_system(df, primary_indices, [filter1, filter2])
 
 
     @staticmethod
@@ -79,8 +268,6 @@ class BinaryStarUtils:
             primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
             filter1 (str): The name of the first filter column.
             filter2 (str): The name of the second filter column.
-            source_column (str): Column name identifying the source of the stars. Default is 'source'.
-            hb_label (str): Label identifying horizontal branch stars in the source column. Default is 'HB_test_stars'.
 
         Returns:
             pd.DataFrame: A new DataFrame containing binary system magnitudes, primary and secondary star indices.
@@ -89,33 +276,7 @@ class BinaryStarUtils:
         if not all(0 <= idx < len(df) for idx in primary_indices):
             raise ValueError("One or more primary indices are out of bounds for the DataFrame.")
 
-        # List to store results
-        results = []
-
-        for star_index in primary_indices:
-            # Extract primary magnitudes
-            mag1_p = df.loc[star_index, filter1]
-            mag2_p = df.loc[star_index, filter2]
-
-            # Compute binary magnitudes using vectorized operations
-            mag1_bin = -2.5 * np.log10(10 ** (-mag1_p / 2.5) + 10 ** (-df[filter1] / 2.5))
-            mag2_bin = -2.5 * np.log10(10 ** (-mag2_p / 2.5) + 10 ** (-df[filter2] / 2.5))
-
-            # Create a temporary DataFrame for this primary
-            temp_df = pd.DataFrame({
-                "primary": star_index,  # Add primary star index
-                "secondary": df.index,  # Add secondary star indices
-                filter1: mag1_bin,
-                filter2: mag2_bin
-            })
-
-            # Append to results
-            results.append(temp_df)
-
-        # Concatenate all results into a single DataFrame
-        result_df = pd.concat(results, ignore_index=True)
-
-        return result_df
+        return BinaryStarUtils.binary_system(df, primary_indices, [filter1, filter2])
     
     # if working with instrumental magnitudes use this function
     @staticmethod
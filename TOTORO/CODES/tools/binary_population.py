@@ -0,0 +1,245 @@
+
+'''
+======================================================
+                SYNTHETIC BINARY POPULATIONS
+======================================================
+
+This module contains a class to simulate populations of binary stars from an isochrone, instead of pairing a fixed
+list of test stars.
+The main classes and functions are:
+    - BinaryPopulation: Draw the primaries from a mass function along the isochrone and the secondaries from a
+      mass-ratio distribution, and compute the magnitudes of the systems in all the filters.
+    - kroupa / salpeter: Mass functions (any other function of the mass can be used).
+    - synthetic_counts: Number of synthetic stars in the regions of a CMD, in the format of
+      CMDRegionSelector.analyze_regions.
+    - binary_fraction: Binary fraction from the observed counts and the counts of a population of binaries.
+
+The magnitudes of the primaries and of the secondaries are interpolated in mass along the isochrone (secondaries
+less massive than the isochrone do not add any flux), and the fluxes are added with NumPy for a whole batch of
+systems. The batches are distributed over a pool of processes, each with its own random seed derived from the seed
+of the simulation, so the result does not depend on the number of processes.
+
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from CMDAnalyzer import CMDRegionSelector
+from isochrones import mass_column
+
+
+def kroupa(mass):
+    """Kroupa (2001) mass function: slopes 0.3, 1.3 and 2.3 below 0.08, between 0.08 and 0.5 and above 0.5 Mo."""
+    mass = np.asarray(mass, dtype=float)
+    return np.where(mass < 0.08, mass ** -0.3, np.where(mass < 0.5, 0.08 * mass ** -1.3, 0.04 * mass ** -2.3))
+
+
+def salpeter(mass):
+    """Salpeter (1955) mass function, slope 2.35."""
+    return np.asarray(mass, dtype=float) ** -2.35
+
+
+def flat(q):
+    """Flat mass-ratio distribution."""
+    return np.ones_like(np.asarray(q, dtype=float))
+
+
+MASS_FUNCTIONS = {'kroupa': kroupa, 'salpeter': salpeter}
+Q_DISTRIBUTIONS = {'flat': flat}
+
+
+def quantile_table(pdf, low, high, n_grid=4096, n_table=65536, log=False):
+    """
+    Values of a distribution at n_table equally spaced quantiles, for inverse transform sampling.
+
+    Parameters:
+        pdf (callable): Probability density (not normalized).
+        low (float): Minimum value.
+        high (float): Maximum value.
+        n_grid (int): Number of points where the density is integrated.
+        n_table (int): Number of quantiles.
+        log (bool): If True, integrate on a logarithmic grid (e.g. for the masses).
+
+    Returns:
+        np.ndarray: The values at the quantiles 0, 1 / (n_table - 1), ..., 1.
+    """
+    grid = np.geomspace(low, high, n_grid) if log else np.linspace(low, high, n_grid)
+    density = pdf(grid)
+    cdf = np.concatenate(([0.0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(grid))))
+    return np.interp(np.linspace(0, 1, n_table), cdf / cdf[-1], grid)
+
+
+def _draw(rng, table, n):
+    """Draw n values from a quantile table (no search needed, the quantiles are equally spaced)."""
+    position = rng.random(n) * (len(table) - 1)
+    index = np.minimum(position.astype(np.int64), len(table) - 2)
+    return table[index] + (position - index) * (table[index + 1] - table[index])
+
+
+def _flux_at_mass(masses, mass, mags):
+    """Fluxes in all the filters at the given masses, zero outside the isochrone (one search for all the filters)."""
+    index = np.clip(np.searchsorted(mass, masses) - 1, 0, len(mass) - 2)
+    weight = ((masses - mass[index]) / (mass[index + 1] - mass[index]))[:, None]
+    flux = 10 ** (-(mags[index] + weight * (mags[index + 1] - mags[index])) / 2.5)
+    flux[(masses < mass[0]) | (masses > mass[-1])] = 0.0
+    return flux
+
+
+def _simulate(mass, mags, mass_table, q_table, binary_fraction, n, seed):
+    """
+    One batch of systems.
+
+    Returns:
+        dict: Arrays M1, M2, q, binary and the magnitudes of the systems (shape (n, n_filters)).
+    """
+    rng = np.random.default_rng(seed)
+    primary = _draw(rng, mass_table, n)
+    q = _draw(rng, q_table, n)
+    binary = rng.random(n) < binary_fraction
+    q[~binary] = 0.0
+    secondary = q * primary
+
+    # Secondaries outside the isochrone (too faint) have no flux
+    total = _flux_at_mass(primary, mass, mags) + _flux_at_mass(secondary, mass, mags)
+    return {'M1': primary, 'M2': secondary, 'q': q, 'binary': binary, 'mags': -2.5 * np.log10(total)}
+
+
+class BinaryPopulation:
+    def __init__(self, iso, filters, mass_function='kroupa', q_distribution='flat', q_range=(0.1, 1.0),
+                 mass_range=None, binary_fraction=1.0):
+        """
+        Prepare the isochrone and the distributions of the simulation.
+
+        Parameters:
+            iso (pd.DataFrame): Isochrone (BaSTI or PARSEC) with the magnitudes in the filters.
+            filters (list[str]): Filters of the synthetic stars.
+            mass_function (str or callable): 'kroupa', 'salpeter' or a function of the mass (not normalized).
+            q_distribution (str or callable): 'flat' or a function of the mass ratio (not normalized).
+            q_range (tuple): Minimum and maximum mass ratio M2 / M1 of the binaries.
+            mass_range (tuple): Minimum and maximum mass of the primaries, default the whole isochrone.
+            binary_fraction (float): Fraction of binaries, the other stars are single (q = 0).
+        """
+        self.filters = list(filters)
+        mass = iso[mass_column(iso)].to_numpy(dtype=float)
+        mags = iso[self.filters].to_numpy(dtype=float)
+        good = np.isfinite(mass) & np.isfinite(mags).all(axis=1)
+        mass, mags = mass[good], mags[good]
+        # Masses must increase along the isochrone for the interpolation: keep the first row of every new maximum
+        previous = np.concatenate(([-np.inf], np.maximum.accumulate(mass)[:-1]))
+        increasing = mass > previous
+        self.mass, self.mags = mass[increasing], mags[increasing]
+
+        low, high = (self.mass[0], self.mass[-1]) if mass_range is None else mass_range
+        low, high = max(low, self.mass[0]), min(high, self.mass[-1])
+        if low >= high:
+            raise ValueError(f"The mass range does not overlap the isochrone ({self.mass[0]} - {self.mass[-1]} Mo).")
+        mass_function = MASS_FUNCTIONS.get(mass_function, mass_function)
+        q_distribution = Q_DISTRIBUTIONS.get(q_distribution, q_distribution)
+        self.mass_table = quantile_table(mass_function, low, high, log=True)
+        self.q_table = quantile_table(q_distribution, q_range[0], q_range[1])
+        self.binary_fraction = binary_fraction
+
+    def sample(self, n, seed=None, jobs=1, batch_size=1000000):
+        """
+        Simulate a population.
+
+        Parameters:
+            n (int): Number of systems.
+            seed (int): Seed of the random numbers, the same seed gives the same population for any jobs.
+            jobs (int): Number of processes, 0 uses all the available CPUs.
+            batch_size (int): Number of systems simulated at a time by each process.
+
+        Returns:
+            pd.DataFrame: Columns M1, M2, q, binary and one column per filter with the magnitudes of the system.
+        """
+        sizes = [min(batch_size, n - start) for start in range(0, n, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = [(self.mass, self.mags, self.mass_table, self.q_table, self.binary_fraction, size, batch_seed)
+                 for size, batch_seed in zip(sizes, seeds)]
+
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        jobs = max(1, min(jobs, len(tasks)))
+        if jobs == 1:
+            batches = [_simulate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                batches = list(executor.map(_simulate, *zip(*tasks)))
+
+        if not batches:
+            return pd.DataFrame(columns=['M1', 'M2', 'q', 'binary'] + self.filters)
+        population = pd.DataFrame({name: np.concatenate([batch[name] for batch in batches])
+                                   for name in ('M1', 'M2', 'q', 'binary')})
+        mags = np.concatenate([batch['mags'] for batch in batches])
+        for i, name in enumerate(self.filters):
+            population[name] = mags[:, i]
+        return population
+
+
+def synthetic_counts(population, regions_file, color, magnitude):
+    """
+    Number of synthetic stars in the regions of a CMD.
+
+    Parameters:
+        population (pd.DataFrame): Output of BinaryPopulation.sample, shifted to the observed plane if needed
+            (e.g. with extinction.apply_extinction).
+        regions_file (str): CSV file with the regions (from CMDRegionSelector).
+        color (tuple): Filters of the color, e.g. ('F606W', 'F814W').
+        magnitude (str): Filter of the magnitude.
+
+    Returns:
+        pd.DataFrame: Columns Region_ID and Stars, as CMDRegionSelector.analyze_regions.
+    """
+    colors = population[color[0]].to_numpy() - population[color[1]].to_numpy()
+    _, region_count = CMDRegionSelector.classify_stars(colors, population[magnitude].to_numpy(), regions_file)
+    return region_count
+
+
+def binary_fraction(observed_counts, binary_counts, binary_region, total_region):
+    """
+    Binary fraction from the counts in two regions of the CMD.
+
+    The region total_region holds all the stars of the sequence (single stars and binaries) and binary_region only
+    the binaries far enough from the sequence. With the counts of a population of binaries only (binary_fraction=1),
+    the fraction of all the binaries that fall in binary_region is known, so
+    f = N_obs(binary_region) / (N_obs(total_region) * N_bin(binary_region) / N_bin(total_region)).
+
+    Parameters:
+        observed_counts (pd.DataFrame): Counts of the observed stars (Region_ID, Stars), e.g. from analyze_regions.
+        binary_counts (pd.DataFrame): Counts of a synthetic population of binaries, from synthetic_counts.
+        binary_region (int): Region_ID of the binaries.
+        total_region (int): Region_ID of the whole sequence.
+
+    Returns:
+        float: The binary fraction, NaN if total_region has no observed stars or no synthetic binary falls in
+        binary_region or total_region.
+    """
+    observed = observed_counts.set_index('Region_ID')['Stars']
+    synthetic = binary_counts.set_index('Region_ID')['Stars']
+    expected = observed.get(total_region, 0) * synthetic.get(binary_region, 0)
+    if expected == 0 or synthetic.get(total_region, 0) == 0:
+        return np.nan
+    return observed.get(binary_region, 0) / (expected / synthetic[total_region])
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+store = IsochroneStore('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc')
+iso = apply_extinction(store.get(12000, -0.398, family='P04O1D1E1'), mu=13.21, ebv=0.02, filters=['F606W', 'F814W'])
+
+# ten million binaries with flat mass ratios between 0.5 and 1 on the upper main sequence
+population = BinaryPopulation(iso, ['F606W', 'F814W'], mass_function='kroupa', q_range=(0.5, 1.0), mass_range=(0.5, 0.85))
+binaries = population.sample(10000000, seed=1, jobs=0)
+
+binary_counts = synthetic_counts(binaries, '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_RGB_F606W_F814W.csv',
+                                 ('F606W', 'F814W'), 'F814W')
+observed_counts = selector.analyze_regions('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_RGB_F606W_F814W.csv')
+print(binary_fraction(observed_counts, binary_counts, binary_region=1, total_region=0))
+
+'''
@@ -0,0 +1,215 @@
+
+'''
+======================================================
+                FIELD DECONTAMINATION
+======================================================
+
+This module contains a class to remove statistically the field stars from the CMDs of a cluster, using a reference
+field of the same image, instead of comparing the cluster and the reference field by eye.
+The main classes and functions are:
+    - FieldSubtraction: Hess diagrams (star counts in cells of color and magnitude) of the cluster and of the
+      reference field, with the field scaled by the ratio of the areas, and the membership weight of every star of
+      the cluster in every CMD.
+    - catalog_bands: Filters of a catalogue (columns like F225W), sorted by wavelength.
+    - color_combinations: All the CMDs of a list of filters (blue - red vs red).
+
+In a cell with N_cl stars of the cluster and N_f stars of the reference field, N_f * A_cl / A_f of the cluster stars
+are expected to be field stars, so every star of the cell has weight 1 - N_f * A_cl / (A_f * N_cl) (between 0 and 1).
+The cells of all the CMDs are numbered one after the other, so the Hess diagrams of all the color combinations of
+catalog.xym are built with a single np.bincount over the stars of the cluster and one over the reference field.
+
+'''
+
+import itertools
+import re
+
+import numpy as np
+import pandas as pd
+
+from spatial_index import SpatialIndex
+
+
+def catalog_bands(data):
+    """Columns of the catalogue with the magnitudes (F225W, F814W, ...), sorted by wavelength."""
+    bands = [name for name in data.columns if re.fullmatch(r'F\d+[A-Z]+', str(name))]
+    return sorted(bands, key=lambda band: int(re.search(r'\d+', band).group()))
+
+
+def color_combinations(bands):
+    """
+    All the CMDs of the filters: color blue - red and magnitude red, e.g. ('F225W', 'F336W', 'F336W').
+
+    Parameters:
+        bands (list[str]): Filters sorted by wavelength (see catalog_bands).
+
+    Returns:
+        list[tuple]: (blue, red, magnitude) of every pair of filters.
+    """
+    return [(blue, red, red) for blue, red in itertools.combinations(bands, 2)]
+
+
+def cmd_name(cmd):
+    """Name of a CMD, e.g. F225W-F336W_F336W."""
+    blue, red, magnitude = cmd
+    return f"{blue}-{red}_{magnitude}"
+
+
+class FieldSubtraction:
+    def __init__(self, data, cluster, reference, index=None, x='x', y='y', cluster_area=None, reference_area=None):
+        """
+        Select the stars of the cluster and of the reference field.
+
+        Parameters:
+            data (pd.DataFrame): Catalogue (e.g. catalog.xym) with the positions and the magnitudes.
+            cluster (tuple or np.ndarray): (center, radius) of the cluster, or a boolean mask of its stars.
+            reference (tuple or np.ndarray): (center, radius) of the reference field, or a boolean mask of its stars.
+            index (SpatialIndex): Spatial index of the catalogue, built if not given.
+            x (str): Name of the x column (default 'x', 'X' for the HUGS catalogues).
+            y (str): Name of the y column (default 'y', 'Y' for the HUGS catalogues).
+            cluster_area (float): Area of the cluster, default pi * radius**2 (needed with a mask).
+            reference_area (float): Area of the reference field, default pi * radius**2 (needed with a mask).
+        """
+        self.data = data
+        if index is None and (isinstance(cluster, tuple) or isinstance(reference, tuple)):
+            index = SpatialIndex(data, x=x, y=y)
+        self.cluster, self.cluster_area = self._select(index, cluster, cluster_area)
+        self.reference, self.reference_area = self._select(index, reference, reference_area)
+        # Expected number of field stars in the cluster for every star of the reference field
+        self.scale = self.cluster_area / self.reference_area
+        self.hess_diagrams = {}
+
+    @staticmethod
+    def _select(index, region, area):
+        """Mask and area of a (center, radius) circle or of a mask."""
+        if isinstance(region, tuple):
+            center, radius = region
+            return index.in_circle(center, radius), np.pi * radius ** 2 if area is None else area
+        if area is None:
+            raise ValueError("The area is needed when the stars are selected with a mask.")
+        return np.asarray(region, dtype=bool), area
+
+    def weights(self, cmds=None, color_bin=0.1, mag_bin=0.2):
+        """
+        Membership weight of the stars of the cluster in every CMD.
+
+        Parameters:
+            cmds (list[tuple]): (blue, red, magnitude) filters of the CMDs, default all the color combinations of
+                the filters of the catalogue (see color_combinations).
+            color_bin (float): Width of the cells in color.
+            mag_bin (float): Width of the cells in magnitude.
+
+        Returns:
+            pd.DataFrame: One row per star of the cluster (with the index of the catalogue) and one column per CMD
+                (see cmd_name), NaN if the star is not in the CMD (missing filter). The column 'weight' is the
+                smallest weight of the star in all its CMDs, as a star dominated by the field in one CMD is
+                most likely a field star.
+        """
+        cmds = color_combinations(catalog_bands(self.data)) if cmds is None else [tuple(cmd) for cmd in cmds]
+        bands = list(dict.fromkeys(band for cmd in cmds for band in cmd))
+        column = {band: i for i, band in enumerate(bands)}
+        blue = [column[cmd[0]] for cmd in cmds]
+        red = [column[cmd[1]] for cmd in cmds]
+        magnitude = [column[cmd[2]] for cmd in cmds]
+
+        # Colors and magnitudes of the stars of the cluster and of the reference field, shape (n_stars, n_cmds)
+        selected = self.cluster | self.reference
+        values = self.data.loc[selected, bands].to_numpy(dtype=float)
+        colors = values[:, blue] - values[:, red]
+        mags = values[:, magnitude]
+        valid = np.isfinite(colors) & np.isfinite(mags)
+
+        # Cells of every CMD from the smallest color and magnitude of the two samples (a single cell for the CMDs
+        # without stars, whose limits are not computed)
+        color_min, color_max, mag_min, mag_max = np.zeros((4, len(cmds)))
+        filled = valid.any(axis=0)
+        filled_colors = np.where(valid, colors, np.nan)[:, filled]
+        filled_mags = np.where(valid, mags, np.nan)[:, filled]
+        color_min[filled] = np.nanmin(filled_colors, axis=0)
+        color_max[filled] = np.nanmax(filled_colors, axis=0)
+        mag_min[filled] = np.nanmin(filled_mags, axis=0)
+        mag_max[filled] = np.nanmax(filled_mags, axis=0)
+        n_color = np.floor((color_max - color_min) / color_bin).astype(np.int64) + 1
+        n_mag = np.floor((mag_max - mag_min) / mag_bin).astype(np.int64) + 1
+        offsets = np.concatenate(([0], np.cumsum(n_color * n_mag)))
+
+        with np.errstate(invalid='ignore'):
+            i_color = np.floor((colors - color_min) / color_bin)
+            i_mag = np.floor((mags - mag_min) / mag_bin)
+        cells = np.where(valid, offsets[:-1] + np.where(valid, i_color * n_mag + i_mag, 0), -1).astype(np.int64)
+
+        # Hess diagrams of all the CMDs at once
+        in_cluster = self.cluster[selected]
+        in_reference = self.reference[selected]
+        cluster_cells = cells[in_cluster][valid[in_cluster]]
+        reference_cells = cells[in_reference][valid[in_reference]]
+        cluster_counts = np.bincount(cluster_cells, minlength=offsets[-1])
+        field_counts = np.bincount(reference_cells, minlength=offsets[-1]) * self.scale
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cell_weights = np.clip(1 - field_counts / cluster_counts, 0, 1)
+        star_weights = np.where(valid[in_cluster], cell_weights[np.maximum(cells[in_cluster], 0)], np.nan)
+
+        for k, cmd in enumerate(cmds):
+            self.hess_diagrams[cmd] = {
+                'cluster': cluster_counts[offsets[k]:offsets[k + 1]].reshape(n_color[k], n_mag[k]),
+                'field': field_counts[offsets[k]:offsets[k + 1]].reshape(n_color[k], n_mag[k]),
+                'color_edges': color_min[k] + color_bin * np.arange(n_color[k] + 1),
+                'mag_edges': mag_min[k] + mag_bin * np.arange(n_mag[k] + 1)}
+
+        result = pd.DataFrame(star_weights, columns=[cmd_name(cmd) for cmd in cmds],
+                              index=self.data.index[self.cluster])
+        # fmin ignores the CMDs where the star is missing (NaN only if it is missing in all of them)
+        result['weight'] = np.fmin.reduce(star_weights, axis=1) if cmds else np.nan
+        return result
+
+    def hess(self, cmd):
+        """
+        Hess diagrams of a CMD computed by weights.
+
+        Returns:
+            tuple: (cluster, field, color_edges, mag_edges), cluster and field (already scaled by the areas) with
+                shape (n_color_cells, n_mag_cells).
+        """
+        diagram = self.hess_diagrams[tuple(cmd)]
+        return diagram['cluster'], diagram['field'], diagram['color_edges'], diagram['mag_edges']
+
+    def members(self, weights, seed=None):
+        """
+        Random decontaminated sample: every star of the cluster is kept with probability equal to its weight.
+
+        Parameters:
+            weights (pd.Series): Weights of the stars (a column of the output of weights).
+            seed (int): Seed of the random generator.
+
+        Returns:
+            pd.DataFrame: Stars of the catalogue that are kept.
+        """
+        rng = np.random.default_rng(seed)
+        keep = rng.random(len(weights)) < weights.fillna(0).to_numpy()
+        return self.data.loc[weights.index[keep]]
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+data = pd.read_csv('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/Catalogs/catalog.xym', sep='\t')
+index = SpatialIndex(data, x='x', y='y')
+
+# NGC 346 and the reference field, all the color combinations of the catalogue
+subtraction = FieldSubtraction(data, cluster=((4850, 4920), 750), reference=((3000, 3000), 1500), index=index)
+weights = subtraction.weights(color_bin=0.1, mag_bin=0.25)
+
+# CMD of the cluster with the weights of F225W-F336W vs F336W
+members = data.loc[weights.index]
+plt.scatter(members['F225W'] - members['F336W'], members['F336W'], s=2, c=weights['F225W-F336W_F336W'], cmap='viridis')
+
+# Hess diagrams of the cluster and of the scaled field
+cluster, field, color_edges, mag_edges = subtraction.hess(('F225W', 'F336W', 'F336W'))
+plt.pcolormesh(color_edges, mag_edges, (cluster - field).T)
+
+# one decontaminated sample
+data_NGC346_cluster = subtraction.members(weights['weight'], seed=1)
+
+'''
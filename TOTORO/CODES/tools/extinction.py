@@ -0,0 +1,152 @@
+
+'''
+======================================================
+                    EXTINCTION
+======================================================
+
+This module contains the functions to move magnitudes between the absolute and the observed plane, adding the
+distance modulus and the extinction A_lambda = R_lambda * E(B-V) to all the filters at once.
+The main functions are:
+    - magnitude_shifts: Shifts mu + R_lambda * E(B-V) for any number of filters and of trial values of mu and E(B-V).
+    - apply_extinction: Apply (or remove) the distance modulus and the reddening to the filter columns of a catalogue
+      or of an isochrone, optionally in place.
+    - shifted_magnitudes: Magnitudes of a table for vectors of trial mu and E(B-V), without copying the table.
+
+R_COEFFICIENTS holds R_lambda = A_lambda / E(B-V) for the ACS and WFC3 filters used in the thesis. The values of
+F555W, F606W and F814W are the ones used in the notebooks, the others come from the Cardelli, Clayton & Mathis (1989)
+law with R_V = 3.1 at the pivot wavelength of the filter (which gives the same values within 0.03 for F555W, F606W
+and F814W).
+
+'''
+
+import numpy as np
+
+R_COEFFICIENTS = {
+    'F225W': 8.2680,
+    'F275W': 6.3007,
+    'F336W': 5.0671,
+    'F435W': 4.1857,
+    'F438W': 4.1914,
+    'F475W': 3.7240,
+    'F555W': 3.2118,
+    'F606W': 2.8782,
+    'F625W': 2.6561,
+    'F775W': 1.9935,
+    'F814W': 1.8420,
+}
+
+
+def coefficients_for(filters, coefficients=None):
+    """
+    R_lambda of a list of filters.
+
+    Parameters:
+        filters (list[str]): Filter names. Suffixes after the filter name are ignored (e.g. 'F814W_cal', 'F606Wmag').
+        coefficients (dict): Table of R_lambda, default R_COEFFICIENTS.
+
+    Returns:
+        np.ndarray: One coefficient per filter.
+    """
+    coefficients = R_COEFFICIENTS if coefficients is None else coefficients
+    values = []
+    for name in filters:
+        key = name if name in coefficients else name[:5]
+        if key not in coefficients:
+            raise ValueError(f"No extinction coefficient for filter '{name}'.")
+        values.append(coefficients[key])
+    return np.array(values, dtype=float)
+
+
+def magnitude_shifts(filters, mu=0.0, ebv=0.0, coefficients=None):
+    """
+    Shifts mu + R_lambda * E(B-V) of the magnitudes.
+
+    Parameters:
+        filters (list[str]): Filter names.
+        mu (float or array-like): Distance modulus (or trial values).
+        ebv (float or array-like): Color excess E(B-V) (or trial values), broadcast against mu.
+        coefficients (dict): Table of R_lambda, default R_COEFFICIENTS.
+
+    Returns:
+        np.ndarray: Shifts with shape broadcast(mu, ebv).shape + (len(filters),).
+    """
+    r = coefficients_for(filters, coefficients)
+    mu = np.asarray(mu, dtype=float)[..., None]
+    ebv = np.asarray(ebv, dtype=float)[..., None]
+    return mu + ebv * r
+
+
+def _filter_columns(table, filters, coefficients):
+    """Filter columns of a table, by default all the columns with a coefficient."""
+    if filters is not None:
+        return list(filters)
+    coefficients = R_COEFFICIENTS if coefficients is None else coefficients
+    return [name for name in table.columns if isinstance(name, str) and
+            (name in coefficients or name[:5] in coefficients)]
+
+
+def apply_extinction(table, mu=0.0, ebv=0.0, filters=None, inverse=False, inplace=False, coefficients=None):
+    """
+    Add the distance modulus and the reddening to the magnitudes of a table (absolute -> observed).
+
+    Parameters:
+        table (pd.DataFrame): Catalogue or isochrone.
+        mu (float): Distance modulus.
+        ebv (float): Color excess E(B-V).
+        filters (list[str]): Columns to correct, default all the columns named after a filter of R_COEFFICIENTS.
+        inverse (bool): If True, remove them instead (observed -> absolute, dereddened).
+        inplace (bool): If True, modify the table instead of returning a copy.
+        coefficients (dict): Table of R_lambda, default R_COEFFICIENTS.
+
+    Returns:
+        pd.DataFrame: The corrected table (the same object if inplace is True).
+    """
+    filters = _filter_columns(table, filters, coefficients)
+    shifts = magnitude_shifts(filters, mu, ebv, coefficients)
+    if inverse:
+        shifts = -shifts
+    if not inplace:
+        table = table.copy()
+    for name, shift in zip(filters, shifts):
+        table[name] = table[name].to_numpy(dtype=float) + shift
+    return table
+
+
+def shifted_magnitudes(table, filters, mu, ebv, coefficients=None):
+    """
+    Magnitudes of a table for vectors of trial distance moduli and color excesses.
+
+    Parameters:
+        table (pd.DataFrame): Catalogue or isochrone with absolute magnitudes.
+        filters (list[str]): Filter columns.
+        mu (array-like): Trial distance moduli.
+        ebv (array-like): Trial color excesses, broadcast against mu.
+        coefficients (dict): Table of R_lambda, default R_COEFFICIENTS.
+
+    Returns:
+        np.ndarray: Magnitudes with shape broadcast(mu, ebv).shape + (len(table), len(filters)).
+    """
+    shifts = magnitude_shifts(filters, mu, ebv, coefficients)
+    values = table[list(filters)].to_numpy(dtype=float)
+    return values + shifts[..., None, :]
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+# 47 Tuc, distance modulus and color excess from Brogaard 2017
+iso_basti = apply_extinction(iso_basti, mu=13.21, ebv=0.02, filters=['F606W', 'F814W'])
+
+# NGC346, Milone et al. 2023, all the filters of the isochrone in place
+apply_extinction(isochrone, mu=18.91, ebv=0.03, inplace=True)
+
+# dereddened catalogue
+data_abs = apply_extinction(data, mu=13.21, ebv=0.02, filters=['F275W', 'F336W', 'F435W', 'F606W', 'F814W'], inverse=True)
+
+# many trial values at once: shape (n_mu, n_ebv, len(iso), 2)
+mus, ebvs = np.meshgrid(np.arange(13.0, 13.4, 0.01), np.arange(0, 0.06, 0.005), indexing='ij')
+mags = shifted_magnitudes(iso_basti, ['F606W', 'F814W'], mus, ebvs)
+
+'''
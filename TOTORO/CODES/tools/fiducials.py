@@ -0,0 +1,282 @@
+
+'''
+======================================================
+                    FIDUCIAL LINES
+======================================================
+
+This module contains the functions to derive fiducial (ridge) lines from the CMD and to evaluate them for many stars.
+The main classes and functions are:
+    - ridge_line: Fiducial line as the median color in bins of magnitude, with iterative sigma clipping.
+    - PiecewiseLinear: Fiducial line prepared once (sorted knots, slopes and intercepts) and evaluated for millions
+      of stars with a binary search, instead of building an interp1d in every notebook.
+    - load_fiducial / save_fiducial: Read and write the X,Y CSV files of CMDFiducialSelector.
+    - fiducials_for_pairs: Fiducial lines of all the colors of a catalogue, optionally in parallel and saved to CSV.
+    - verticalize: Signed distance of every star from many fiducial lines at once (e.g. delta color in a CMD,
+      or delta (F225W-F336W) in the color-color plane of the UV-dim stars).
+    - candidate_masks: Stars beyond many offsets from the fiducial lines (e.g. UV-dim candidates), all together.
+
+The fiducial lines are DataFrames with columns X (color) and Y (magnitude), as the ones selected by hand.
+
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def _grouped_median(values, groups, n_groups):
+    """Median of values in each group (NaN for the empty groups)."""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    median = np.full(n_groups, np.nan)
+    full = counts > 0
+    low = starts[full] + (counts[full] - 1) // 2
+    high = starts[full] + counts[full] // 2
+    median[full] = (values[low] + values[high]) / 2
+    return median
+
+
+def ridge_line(colors, mags, bin_width=0.2, mag_range=None, sigma=3.0, iterations=10, min_stars=10):
+    """
+    Fiducial line of a sequence: median color in bins of magnitude, with iterative sigma clipping.
+
+    In every iteration the stars farther than sigma times the dispersion of their bin (1.4826 * MAD) from the
+    median color are removed, until no more stars are removed or iterations is reached.
+
+    Parameters:
+        colors (array-like): Color of the stars.
+        mags (array-like): Magnitude of the stars.
+        bin_width (float): Width of the magnitude bins.
+        mag_range (tuple): (bright, faint) magnitude limits, default the range of the stars.
+        sigma (float): Clipping threshold in units of the dispersion.
+        iterations (int): Maximum number of clipping iterations.
+        min_stars (int): Bins with fewer stars left are not part of the line.
+
+    Returns:
+        pd.DataFrame: Fiducial line with columns X (median color) and Y (median magnitude of the bin), sorted by Y.
+    """
+    colors = np.asarray(colors, dtype=float)
+    mags = np.asarray(mags, dtype=float)
+    finite = np.isfinite(colors) & np.isfinite(mags)
+    colors, mags = colors[finite], mags[finite]
+    if mag_range is None:
+        mag_range = (mags.min(), mags.max()) if len(mags) else (0, 0)
+    inside = (mags >= mag_range[0]) & (mags <= mag_range[1])
+    colors, mags = colors[inside], mags[inside]
+
+    n_bins = max(int(np.ceil((mag_range[1] - mag_range[0]) / bin_width)), 1)
+    bins = np.minimum(((mags - mag_range[0]) / bin_width).astype(int), n_bins - 1)
+
+    keep = np.ones(len(colors), dtype=bool)
+    for _ in range(iterations):
+        median = _grouped_median(colors[keep], bins[keep], n_bins)
+        deviation = np.abs(colors - median[bins])
+        spread = 1.4826 * _grouped_median(deviation[keep], bins[keep], n_bins)
+        new_keep = deviation <= sigma * spread[bins]
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+
+    counts = np.bincount(bins[keep], minlength=n_bins)
+    color_median = _grouped_median(colors[keep], bins[keep], n_bins)
+    mag_median = _grouped_median(mags[keep], bins[keep], n_bins)
+    good = counts >= min_stars
+    return pd.DataFrame({'X': color_median[good], 'Y': mag_median[good]})
+
+
+class PiecewiseLinear:
+    def __init__(self, knots, values, extrapolate=False):
+        """
+        Piecewise linear function through the points (knots, values).
+
+        Parameters:
+            knots (array-like): Independent variable of the points (e.g. the magnitudes of a fiducial line).
+            values (array-like): Value at the knots (e.g. the colors of the fiducial line).
+            extrapolate (bool): If True, extend the first and last segments outside the knots, otherwise return NaN.
+        """
+        knots = np.asarray(knots, dtype=float)
+        values = np.asarray(values, dtype=float)
+        good = np.isfinite(knots) & np.isfinite(values)
+        order = np.argsort(knots[good], kind='stable')
+        self.knots = knots[good][order]
+        self.values = values[good][order]
+        if len(self.knots) < 2:
+            raise ValueError("At least two points are needed to define a line.")
+        self.extrapolate = extrapolate
+
+        # Slope and intercept of every segment, computed once
+        width = np.diff(self.knots)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.slopes = np.where(width > 0, np.diff(self.values) / width, 0.0)
+        self.intercepts = self.values[:-1] - self.slopes * self.knots[:-1]
+
+    def __call__(self, points):
+        """Value of the function at the points."""
+        points = np.asarray(points, dtype=float)
+        segment = np.clip(np.searchsorted(self.knots, points, side='right') - 1, 0, len(self.slopes) - 1)
+        result = self.slopes[segment] * points + self.intercepts[segment]
+        if not self.extrapolate:
+            result = np.where((points >= self.knots[0]) & (points <= self.knots[-1]), result, np.nan)
+        return result
+
+    @classmethod
+    def color_at_magnitude(cls, fiducial, extrapolate=False):
+        """Color of a fiducial line (X, Y = color, magnitude) as a function of the magnitude."""
+        return cls(fiducial['Y'], fiducial['X'], extrapolate=extrapolate)
+
+    @classmethod
+    def y_at_x(cls, fiducial, extrapolate=False):
+        """Y of a fiducial line as a function of X (e.g. for lines in a color-color plane)."""
+        return cls(fiducial['X'], fiducial['Y'], extrapolate=extrapolate)
+
+
+def load_fiducial(file_name):
+    """Read a fiducial line CSV file (columns X,Y or the older x,y) as a DataFrame with columns X and Y."""
+    fiducial = pd.read_csv(file_name)
+    return fiducial.rename(columns={'x': 'X', 'y': 'Y'})[['X', 'Y']]
+
+
+def save_fiducial(fiducial, file_name):
+    """Save a fiducial line in the X,Y CSV format of CMDFiducialSelector."""
+    fiducial[['X', 'Y']].to_csv(file_name, index=False)
+
+
+def _pair_ridge_line(colors, mags, options):
+    return ridge_line(colors, mags, **options)
+
+
+def fiducials_for_pairs(data, pairs, magnitude='F814W', output_dir=None, jobs=1, **options):
+    """
+    Fiducial lines of many colors of a catalogue.
+
+    Parameters:
+        data (pd.DataFrame): Catalogue with the magnitudes.
+        pairs (list[tuple]): Filters of the colors, e.g. [('F606W', 'F814W'), ('F275W', 'F814W')].
+        magnitude (str): Filter of the magnitude axis.
+        output_dir (str): If given, every line is saved as fiducial_<606>_<814>.csv in this folder.
+        jobs (int): Number of processes, 0 uses all the available CPUs.
+        **options: Options of ridge_line (bin_width, mag_range, sigma, iterations, min_stars).
+
+    Returns:
+        dict: (filter1, filter2) -> fiducial line.
+    """
+    tasks = [((data[filter1] - data[filter2]).to_numpy(dtype=float), data[magnitude].to_numpy(dtype=float), options)
+             for filter1, filter2 in pairs]
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tasks)))
+    if jobs == 1:
+        lines = [_pair_ridge_line(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            lines = list(executor.map(_pair_ridge_line, *zip(*tasks)))
+
+    fiducials = dict(zip([tuple(pair) for pair in pairs], lines))
+    if output_dir is not None:
+        for (filter1, filter2), fiducial in fiducials.items():
+            save_fiducial(fiducial, os.path.join(output_dir, f"fiducial_{filter1[1:4]}_{filter2[1:4]}.csv"))
+    return fiducials
+
+
+def verticalize(x, y, fiducials, along='y', extrapolate=False):
+    """
+    Signed distance of the stars from one or more fiducial lines.
+
+    Parameters:
+        x (array-like): x coordinate of the stars (the color of a CMD, or the x color of a color-color plane).
+        y (array-like): y coordinate of the stars (the magnitude of a CMD, or the y color).
+        fiducials (list): Fiducial lines (DataFrames with columns X, Y, file names or PiecewiseLinear functions).
+        along (str): 'y' gives y - Y_fiducial(x) (vertical distance, e.g. UV-dim in F225W-F336W vs F336W-F814W),
+            'x' gives x - X_fiducial(y) (delta color at the magnitude of the star in a CMD).
+        extrapolate (bool): If True, extend the fiducial lines outside their points, otherwise the distance is NaN.
+
+    Returns:
+        np.ndarray: Distances with shape (n_fiducials, n_stars).
+    """
+    if along not in ('x', 'y'):
+        raise ValueError("along must be 'x' or 'y'.")
+    if isinstance(fiducials, (pd.DataFrame, str, PiecewiseLinear)):
+        fiducials = [fiducials]
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    distances = np.empty((len(fiducials), len(x)))
+    for i, fiducial in enumerate(fiducials):
+        if isinstance(fiducial, str):
+            fiducial = load_fiducial(fiducial)
+        if not isinstance(fiducial, PiecewiseLinear):
+            if along == 'y':
+                fiducial = PiecewiseLinear.y_at_x(fiducial, extrapolate=extrapolate)
+            else:
+                fiducial = PiecewiseLinear.color_at_magnitude(fiducial, extrapolate=extrapolate)
+        distances[i] = y - fiducial(x) if along == 'y' else x - fiducial(y)
+    return distances
+
+
+def candidate_masks(distances, offsets, above=True, valid=None):
+    """
+    Stars beyond each offset from each fiducial line.
+
+    Parameters:
+        distances (np.ndarray): Output of verticalize, shape (n_fiducials, n_stars).
+        offsets (array-like): Offsets from the fiducial lines (e.g. 0.1 for the UV-dim candidates).
+        above (bool): If True select distance > offset, otherwise distance < offset.
+        valid (array-like): Optional boolean mask of the stars that can be selected (e.g. x < 1.3).
+
+    Returns:
+        np.ndarray: Boolean masks with shape (n_fiducials, n_offsets, n_stars). Stars outside the fiducial
+        lines (NaN distance) are never selected.
+    """
+    distances = np.atleast_2d(distances)
+    offsets = np.atleast_1d(np.asarray(offsets, dtype=float))
+    with np.errstate(invalid='ignore'):
+        if above:
+            masks = distances[:, None, :] > offsets[None, :, None]
+        else:
+            masks = distances[:, None, :] < offsets[None, :, None]
+    if valid is not None:
+        masks &= np.asarray(valid, dtype=bool)
+    return masks
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+# main sequence and RGB of 47 Tuc
+fiducial = ridge_line(data['F606W'] - data['F814W'], data['F814W'], bin_width=0.2, mag_range=(12, 20.5))
+save_fiducial(fiducial, '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/fiducial_606_814.csv')
+
+# color of the fiducial at the magnitude of every star
+fiducial_color = PiecewiseLinear.color_at_magnitude(fiducial)
+delta_color = (data['F606W'] - data['F814W']) - fiducial_color(data['F814W'])
+
+# all the colors at once, in parallel
+fiducials = fiducials_for_pairs(data, [('F275W', 'F814W'), ('F336W', 'F814W'), ('F435W', 'F814W'), ('F606W', 'F814W')],
+                                magnitude='F814W', output_dir='/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc',
+                                jobs=4, mag_range=(12, 20.5))
+
+# UV-dim candidates of NGC 346 and of the reference field for many offsets
+fiducial_files = ['/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/NGC346/fiducial_uvdim.csv',
+                  '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/NGC346/fiducial_uvdim_B90.csv']
+offsets = np.arange(0.05, 0.31, 0.05)
+for name, field in [('NGC 346', data_NGC346_cluster), ('Reference', data_reference_field)]:
+    x_stars = field['F336W'] - field['F814W']
+    y_stars = field['F225W'] - field['F336W']
+    distances = verticalize(x_stars, y_stars, fiducial_files, along='y')
+    masks = candidate_masks(distances, offsets, valid=x_stars < 1.3)
+    print(name, masks.sum(axis=2))        # counts per fiducial and offset
+
+# the selection of the notebook: first fiducial, offset 0.1
+x_stars = data_NGC346_cluster['F336W'] - data_NGC346_cluster['F814W']
+y_stars = data_NGC346_cluster['F225W'] - data_NGC346_cluster['F336W']
+masks = candidate_masks(verticalize(x_stars, y_stars, fiducial_files[:1]), [0.1], valid=x_stars < 1.3)
+uv_dim_candidate = data_NGC346_cluster[masks[0, 0]]
+
+'''
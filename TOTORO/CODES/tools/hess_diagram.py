@@ -0,0 +1,266 @@
+
+'''
+======================================================
+                    HESS DIAGRAMS
+======================================================
+
+This module contains a class to keep the Hess diagrams (2D histograms of color and magnitude) of a catalogue in
+memory, so that the CMDs of many filter pairs can be drawn and the stars in the regions counted without scattering
+every star again.
+The main classes and functions are:
+    - HessDiagram: Histograms of any color / magnitude pair of a catalogue at several resolutions, computed the first
+      time they are needed and updated when stars are added or removed. The counts in boxes and polygons (e.g. the
+      regions of CMDRegionSelector) are read from cumulative-sum tables.
+
+The finest histogram of a CMD is binned once from the stars; every coarser level halves the resolution in both axes
+and is the sum of blocks of 2 x 2 cells of the previous one. The cells of a polygon are the cells with the centre
+inside it: for every column of cells the polygon is cut in intervals of magnitude, and the stars of each interval
+are a difference of the cumulative-sum table, so a query does not depend on the number of stars and takes a fraction
+of a millisecond. The counts are approximate (the stars in the cells crossed by the edges are counted or not as a
+whole), the finer the level the better: the exact counts are given by CMDRegionSelector.classify_stars.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+from CMDAnalyzer import CMDRegionSelector
+from decontamination import catalog_bands
+
+
+class HessDiagram:
+    def __init__(self, data, color_bin=0.01, mag_bin=0.02, levels=4):
+        """
+        Keep the magnitudes of the catalogue, the histograms are computed when a CMD is first used.
+
+        Parameters:
+            data (pd.DataFrame): Catalogue with one column per filter (e.g. catalog.xym or a HUGS catalogue).
+            color_bin (float): Width of the cells of the finest level in color.
+            mag_bin (float): Width of the cells of the finest level in magnitude.
+            levels (int): Number of resolutions, each one with cells twice as large as the previous one.
+        """
+        self.bands = catalog_bands(data)
+        self.data = data[self.bands].astype(float)
+        self.color_bin = color_bin
+        self.mag_bin = mag_bin
+        self.levels = levels
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def _values(self, stars, cmd):
+        """Colors and magnitudes of some stars in a CMD (blue, red, magnitude)."""
+        blue, red, magnitude = cmd
+        return stars[blue].to_numpy() - stars[red].to_numpy(), stars[magnitude].to_numpy()
+
+    def _indices(self, colors, mags):
+        """Index of the column and of the row of the finest level of every star, counted from color = mag = 0."""
+        with np.errstate(invalid='ignore'):
+            return np.floor(colors / self.color_bin), np.floor(mags / self.mag_bin)
+
+    def _cells(self, entry, i_color, i_mag):
+        """Flat index of the cells of the finest level (-1 for the stars without color or magnitude)."""
+        n_color, n_mag = entry['shape']
+        i_color = i_color - entry['color_offset']
+        i_mag = i_mag - entry['mag_offset']
+        valid = np.isfinite(i_color) & np.isfinite(i_mag)
+        cells = np.where(valid, i_color * n_mag + i_mag, -1)
+        inside = ~valid | ((i_color >= 0) & (i_color < n_color) & (i_mag >= 0) & (i_mag < n_mag))
+        return cells.astype(np.int64), inside.all()
+
+    def _build(self, cmd):
+        """Finest histogram of a CMD, with the grid aligned to the bins and a multiple of 2**(levels-1) cells."""
+        # The grid is sized from the same integer indices that place the stars in the cells, so the rounding
+        # of the divisions cannot leave a star outside it
+        i_color, i_mag = self._indices(*self._values(self.data, cmd))
+        valid = np.isfinite(i_color) & np.isfinite(i_mag)
+        block = 2 ** (self.levels - 1)
+        entry = {'color_offset': 0.0, 'mag_offset': 0.0, 'shape': (block, block)}
+        if valid.any():
+            entry['color_offset'], entry['mag_offset'] = i_color[valid].min(), i_mag[valid].min()
+            n_color = int(i_color[valid].max() - entry['color_offset']) + 1
+            n_mag = int(i_mag[valid].max() - entry['mag_offset']) + 1
+            entry['shape'] = (-(-n_color // block) * block, -(-n_mag // block) * block)
+        entry['color_min'] = entry['color_offset'] * self.color_bin
+        entry['mag_min'] = entry['mag_offset'] * self.mag_bin
+
+        cells, _ = self._cells(entry, i_color, i_mag)
+        counts = np.bincount(cells[cells >= 0], minlength=entry['shape'][0] * entry['shape'][1])
+        entry['counts'] = [counts.reshape(entry['shape'])] + [None] * (self.levels - 1)
+        entry['tables'] = [None] * self.levels
+        self.cache[cmd] = entry
+        return entry
+
+    def _entry(self, cmd):
+        cmd = tuple(cmd)
+        return self.cache[cmd] if cmd in self.cache else self._build(cmd)
+
+    def histogram(self, cmd, level=0):
+        """
+        Histogram of a CMD.
+
+        Parameters:
+            cmd (tuple): (blue, red, magnitude) filters, e.g. ('F606W', 'F814W', 'F814W').
+            level (int): Resolution, 0 is the finest one.
+
+        Returns:
+            tuple: (counts, color_edges, mag_edges), counts with shape (n_color_cells, n_mag_cells).
+        """
+        entry = self._entry(cmd)
+        counts = entry['counts']
+        for i in range(1, level + 1):
+            if counts[i] is None:
+                n_color, n_mag = counts[i - 1].shape
+                counts[i] = counts[i - 1].reshape(n_color // 2, 2, n_mag // 2, 2).sum(axis=(1, 3))
+        n_color, n_mag = counts[level].shape
+        color_edges = entry['color_min'] + self.color_bin * 2 ** level * np.arange(n_color + 1)
+        mag_edges = entry['mag_min'] + self.mag_bin * 2 ** level * np.arange(n_mag + 1)
+        return counts[level], color_edges, mag_edges
+
+    def image(self, cmd, level=0):
+        """Histogram of a CMD as (image, extent), to be drawn with ax.imshow(image, extent=extent, origin='lower')."""
+        counts, color_edges, mag_edges = self.histogram(cmd, level)
+        image = np.ma.masked_equal(np.log10(1 + counts.T), 0)
+        return image, (color_edges[0], color_edges[-1], mag_edges[0], mag_edges[-1])
+
+    def _table(self, cmd, level):
+        """Cumulative-sum table of a level: table[i, j] is the number of stars in the cells [:i, :j]."""
+        entry = self._entry(cmd)
+        if entry['tables'][level] is None:
+            counts, _, _ = self.histogram(cmd, level)
+            table = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype=np.int64)
+            np.cumsum(np.cumsum(counts, axis=0), axis=1, out=table[1:, 1:])
+            entry['tables'][level] = table
+        return entry['tables'][level], entry
+
+    def count_box(self, cmd, color_range, mag_range, level=0):
+        """Number of stars in the cells with the centre inside a box of color and magnitude."""
+        table, entry = self._table(cmd, level)
+        color_bin, mag_bin = self.color_bin * 2 ** level, self.mag_bin * 2 ** level
+        i0, i1 = np.clip([np.ceil((color_range[0] - entry['color_min']) / color_bin - 0.5),
+                          np.floor((color_range[1] - entry['color_min']) / color_bin - 0.5) + 1],
+                         0, table.shape[0] - 1).astype(np.int64)
+        j0, j1 = np.clip([np.ceil((mag_range[0] - entry['mag_min']) / mag_bin - 0.5),
+                          np.floor((mag_range[1] - entry['mag_min']) / mag_bin - 0.5) + 1],
+                         0, table.shape[1] - 1).astype(np.int64)
+        if i1 <= i0 or j1 <= j0:
+            return 0
+        return int(table[i1, j1] - table[i0, j1] - table[i1, j0] + table[i0, j0])
+
+    def count_polygon(self, cmd, vertices, level=0):
+        """
+        Number of stars in the cells with the centre inside a polygon.
+
+        Parameters:
+            cmd (tuple): (blue, red, magnitude) filters.
+            vertices (array-like): (n, 2) vertices of the polygon (color, magnitude), closed automatically.
+            level (int): Resolution, 0 is the finest (and slowest) one.
+
+        Returns:
+            int: Approximate number of stars.
+        """
+        table, entry = self._table(cmd, level)
+        color_bin, mag_bin = self.color_bin * 2 ** level, self.mag_bin * 2 ** level
+        vertices = np.asarray(vertices, dtype=float)
+        x1, y1 = vertices[:, 0], vertices[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+        # Columns of cells with the centre between the smallest and the largest color of the polygon
+        first = max(int(np.ceil((x1.min() - entry['color_min']) / color_bin - 0.5)), 0)
+        last = min(int(np.floor((x1.max() - entry['color_min']) / color_bin - 0.5)), table.shape[0] - 2)
+        if last < first:
+            return 0
+        columns = np.arange(first, last + 1)
+        centres = entry['color_min'] + (columns[:, None] + 0.5) * color_bin
+
+        # Magnitudes where the edges cross the centre of every column, sorted: pairs of crossings are the
+        # intervals inside the polygon
+        crosses = (x1 <= centres) != (x2 <= centres)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = np.where(crosses, y1 + (centres - x1) * (y2 - y1) / (x2 - x1), np.inf)
+        crossing.sort(axis=1)
+        n_pairs = crosses.sum(axis=1).max() // 2
+        low, high = crossing[:, 0:2 * n_pairs:2], crossing[:, 1:2 * n_pairs:2]
+        found = np.isfinite(high)
+
+        j0 = np.clip(np.ceil((np.where(found, low, 0) - entry['mag_min']) / mag_bin - 0.5), 0, table.shape[1] - 1)
+        j1 = np.clip(np.floor((np.where(found, high, 0) - entry['mag_min']) / mag_bin - 0.5) + 1, 0, table.shape[1] - 1)
+        j0, j1 = j0.astype(np.int64), np.maximum(j1, j0).astype(np.int64)
+        i0, i1 = columns[:, None], columns[:, None] + 1
+        counts = table[i1, j1] - table[i0, j1] - table[i1, j0] + table[i0, j0]
+        return int(counts[found].sum())
+
+    def region_counts(self, cmd, regions_file, level=0):
+        """
+        Approximate number of stars in the regions of a CSV file (from CMDRegionSelector).
+
+        Returns:
+            pd.DataFrame: Columns Region_ID and Stars, as CMDRegionSelector.analyze_regions.
+        """
+        regions = CMDRegionSelector.load_regions_cached(regions_file)
+        return pd.DataFrame({'Region_ID': list(regions),
+                             'Stars': [self.count_polygon(cmd, vertices, level) for vertices in regions.values()]})
+
+    def _update(self, stars, sign):
+        """Add (sign 1) or subtract (sign -1) the stars from the cached histograms."""
+        for cmd in list(self.cache):
+            entry = self.cache[cmd]
+            cells, inside = self._cells(entry, *self._indices(*self._values(stars, cmd)))
+            if not inside:
+                # Stars outside the grid: the histogram is computed again when needed
+                del self.cache[cmd]
+                continue
+            counts = entry['counts'][0]
+            counts += sign * np.bincount(cells[cells >= 0], minlength=counts.size).reshape(counts.shape)
+            entry['counts'][1:] = [None] * (self.levels - 1)
+            entry['tables'] = [None] * self.levels
+
+    def add(self, stars):
+        """
+        Add stars to the catalogue and to the cached histograms.
+
+        Parameters:
+            stars (pd.DataFrame): New stars, with the filters of the catalogue (missing filters are NaN).
+
+        Returns:
+            pd.Index: Labels of the new stars, to remove them later.
+        """
+        stars = stars.reindex(columns=self.bands).astype(float)
+        start = self.data.index.max() + 1 if len(self.data) else 0
+        stars.index = pd.RangeIndex(start, start + len(stars))
+        self.data = pd.concat([self.data, stars])
+        self._update(stars, 1)
+        return stars.index
+
+    def remove(self, labels):
+        """Remove stars (labels of the index of the catalogue) from the catalogue and from the cached histograms."""
+        stars = self.data.loc[labels]
+        self.data = self.data.drop(index=labels)
+        self._update(stars, -1)
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+data = pd.read_csv('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/Catalogs/catalog.xym', sep='\t')
+hess = HessDiagram(data, color_bin=0.01, mag_bin=0.02)
+
+# draw the CMDs of many filter pairs without scattering the stars
+for cmd in [('F555W', 'F814W', 'F814W'), ('F275W', 'F336W', 'F336W'), ('F225W', 'F336W', 'F336W')]:
+    image, extent = hess.image(cmd, level=1)
+    plt.imshow(image, extent=extent, origin='lower', aspect='auto', cmap='Greys')
+    plt.gca().invert_yaxis()
+    plt.show()
+
+# approximate counts while the regions are designed, exact ones at the end
+print(hess.region_counts(('F555W', 'F814W', 'F814W'), '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/NGC346/regions_RGB_F555W_F814W.csv'))
+print(hess.count_polygon(('F555W', 'F814W', 'F814W'), selector.current_region, level=2))
+
+# add and remove synthetic stars
+labels = hess.add(binaries[['F555W', 'F814W']])
+hess.remove(labels)
+
+'''
@@ -0,0 +1,180 @@
+
+'''
+======================================================
+                    ISOCHRONE FITTING
+======================================================
+
+This module contains a class to fit isochrones to a CMD with a grid search over age, metallicity, distance modulus
+and color excess E(B-V), instead of choosing the parameters by eye.
+The main classes and functions are:
+    - IsochroneFitter: Goodness of fit of a grid of isochrones to the stars of a catalogue (or to a fiducial line).
+    - isochrone_grid: Isochrones of an IsochroneStore at the requested ages and metallicities (interpolated if needed).
+
+The goodness of fit is a clipped chi-square: for every star the distance to the closest point of the isochrone, in units
+of sigma_color and sigma_mag, squared and clipped at clip**2 so that field stars and binaries do not dominate. It is
+averaged over the stars.
+Changing the distance modulus and E(B-V) only shifts the isochrone in the CMD, so the KD-tree of each isochrone is built
+once and the stars are shifted in the opposite direction for every (distance modulus, E(B-V)) pair.
+The isochrones are distributed over a pool of processes.
+
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from extinction import magnitude_shifts
+
+
+def _densify(x, y, step):
+    """Add points along the segments of a line so that consecutive points are closer than step."""
+    lengths = np.hypot(np.diff(x), np.diff(y))
+    n_points = np.maximum(np.ceil(lengths / step).astype(int), 1)
+    segment = np.repeat(np.arange(len(lengths)), n_points)
+    fraction = np.arange(n_points.sum()) - np.repeat(np.cumsum(n_points) - n_points, n_points)
+    fraction = fraction / n_points[segment]
+    x_dense = np.append(x[segment] + fraction * (x[segment + 1] - x[segment]), x[-1])
+    y_dense = np.append(y[segment] + fraction * (y[segment + 1] - y[segment]), y[-1])
+    return x_dense, y_dense
+
+
+def _evaluate(iso_colors, iso_mags, star_colors, star_mags, color_shifts, mag_shifts, sigma_color, sigma_mag, clip):
+    """
+    Clipped chi-square of one isochrone for all the (color shift, magnitude shift) pairs.
+
+    Returns:
+        np.ndarray: One value per shift.
+    """
+    finite = np.isfinite(iso_colors) & np.isfinite(iso_mags)
+    x, y = _densify(iso_colors[finite] / sigma_color, iso_mags[finite] / sigma_mag, step=0.25)
+    tree = cKDTree(np.column_stack((x, y)))
+
+    statistic = np.empty(len(color_shifts))
+    for i, (color_shift, mag_shift) in enumerate(zip(color_shifts, mag_shifts)):
+        # Shifting the stars back is the same as shifting the isochrone forward
+        stars = np.column_stack(((star_colors - color_shift) / sigma_color, (star_mags - mag_shift) / sigma_mag))
+        distance, _ = tree.query(stars, distance_upper_bound=clip)
+        statistic[i] = np.mean(np.minimum(distance, clip) ** 2)
+    return statistic
+
+
+def isochrone_grid(store, ages, mhs, family=None):
+    """
+    Isochrones of a store for all the combinations of ages and metallicities.
+
+    Parameters:
+        store (IsochroneStore): Store with the isochrones.
+        ages (list[float]): Ages in Myr.
+        mhs (list[float]): Metallicities [M/H].
+        family (str): Family of models, needed if the store has more than one.
+
+    Returns:
+        list: (parameters, isochrone) tuples, with parameters a dict with keys 'age' and 'MH'.
+    """
+    return [({'age': age, 'MH': mh}, store.interpolate(age, mh, family=family)) for age in ages for mh in mhs]
+
+
+class IsochroneFitter:
+    def __init__(self, colors, mags, color=('F606W', 'F814W'), magnitude='F814W', sigma_color=0.02, sigma_mag=0.1,
+                 clip=3.0, mag_range=None, coefficients=None):
+        """
+        Prepare the stars for the fit.
+
+        Parameters:
+            colors (array-like): Observed color of the stars (or of the points of a fiducial line).
+            mags (array-like): Observed magnitude of the stars.
+            color (tuple): Filters of the color, e.g. ('F606W', 'F814W').
+            magnitude (str): Filter of the magnitude.
+            sigma_color (float): Scale of the color distances.
+            sigma_mag (float): Scale of the magnitude distances.
+            clip (float): Maximum distance of a star from the isochrone (in sigma), farther stars count as clip.
+            mag_range (tuple): (bright, faint) magnitudes of the stars to use, e.g. to fit only MS, SGB and RGB.
+            coefficients (dict): A_lambda / E(B-V) for the filters, default extinction.R_COEFFICIENTS.
+        """
+        colors = np.asarray(colors, dtype=float)
+        mags = np.asarray(mags, dtype=float)
+        keep = np.isfinite(colors) & np.isfinite(mags)
+        if mag_range is not None:
+            keep &= (mags >= mag_range[0]) & (mags <= mag_range[1])
+        self.colors = colors[keep]
+        self.mags = mags[keep]
+        self.color = color
+        self.magnitude = magnitude
+        self.sigma_color = sigma_color
+        self.sigma_mag = sigma_mag
+        self.clip = clip
+        self.coefficients = coefficients
+
+    def shifts(self, mus, ebvs):
+        """Shifts in color and magnitude of the isochrone for all the (distance modulus, E(B-V)) pairs."""
+        mu, ebv = [values.ravel() for values in np.meshgrid(mus, ebvs, indexing='ij')]
+        shifts = magnitude_shifts([self.color[0], self.color[1], self.magnitude], mu, ebv, self.coefficients)
+        return mu, ebv, shifts[:, 0] - shifts[:, 1], shifts[:, 2]
+
+    def fit(self, isochrones, mus, ebvs, jobs=1):
+        """
+        Evaluate the goodness of fit for all the isochrones, distance moduli and color excesses.
+
+        Parameters:
+            isochrones (list): (parameters, isochrone) tuples, e.g. from isochrone_grid or IsochroneStore.sweep.
+            mus (array-like): Distance moduli to try.
+            ebvs (array-like): Color excesses E(B-V) to try.
+            jobs (int): Number of processes, 0 uses all the available CPUs.
+
+        Returns:
+            pd.DataFrame: One row per combination, with the parameters of the isochrone, 'mu', 'ebv' and
+            'statistic', sorted from the best fit.
+        """
+        parameters = []
+        tasks = []
+        mu, ebv, color_shifts, mag_shifts = self.shifts(mus, ebvs)
+        for item in isochrones:
+            if len(item) == 3:
+                # (age, mh, isochrone) from IsochroneStore.sweep
+                parameters.append({'age': item[0], 'MH': item[1]})
+            else:
+                parameters.append(dict(item[0]))
+            iso = item[-1]
+            tasks.append(((iso[self.color[0]] - iso[self.color[1]]).to_numpy(dtype=float),
+                          iso[self.magnitude].to_numpy(dtype=float),
+                          self.colors, self.mags, color_shifts, mag_shifts, self.sigma_color, self.sigma_mag,
+                          self.clip))
+
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        jobs = max(1, min(jobs, len(tasks)))
+        if jobs == 1:
+            statistics = [_evaluate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                statistics = list(executor.map(_evaluate, *zip(*tasks)))
+
+        rows = [pd.DataFrame(dict(values, mu=mu, ebv=ebv, statistic=statistic))
+                for values, statistic in zip(parameters, statistics)]
+        result = pd.concat(rows, ignore_index=True)
+        return result.sort_values('statistic', kind='stable').reset_index(drop=True)
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+store = IsochroneStore('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc')
+
+fitter = IsochroneFitter(data['F606W'] - data['F814W'], data['F814W'], color=('F606W', 'F814W'), magnitude='F814W',
+                         mag_range=(12, 20))
+result = fitter.fit(isochrone_grid(store, [10000, 11000, 12000], [-0.449, -0.398, -0.298], family='P04O1D1E1'),
+                    mus=np.arange(13.0, 13.41, 0.01), ebvs=np.arange(0, 0.061, 0.005), jobs=0)
+print(result.head())
+
+# NGC346 / B90 with the PARSEC isochrone
+store.add_file('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/NGC346/isochrone_B90.dat')
+fitter = IsochroneFitter(data_B90_cluster['F555W_cal'] - data_B90_cluster['F814W_cal'], data_B90_cluster['F814W_cal'],
+                         color=('F555W', 'F814W'), magnitude='F814W', mag_range=(18, 24))
+result = fitter.fit(store.sweep(family='PARSEC'), mus=np.arange(18.7, 19.11, 0.01), ebvs=np.arange(0, 0.1, 0.005))
+
+'''
@@ -0,0 +1,448 @@
+
+'''
+======================================================
+                    ISOCHRONE STORE
+======================================================
+
+This module contains a class to load and interpolate the theoretical isochrones used in the fits.
+The main classes and functions are:
+    - read_isochrone: Read a BaSTI (.isc_acs) or PARSEC (.dat) isochrone file, returning one table per isochrone
+      in the file with its [M/H], Z, Y and age.
+    - IsochroneStore: Index of all the isochrones under FITS/*/FEHm*/ (and of any other file added), with a cache
+      of the parsed tables and interpolation in age and metallicity between the grid nodes.
+    - MassLookup: Masses (or any other column) of the isochrone at given magnitudes, for many stars at once.
+
+The columns of the files are kept (e.g. 'M/Mo(ini)' for BaSTI and 'Mini' for PARSEC), except for the PARSEC
+magnitudes that are renamed from 'F606Wmag' to 'F606W' as for the BaSTI isochrones.
+The parsed tables are saved next to the files as hidden .npz files, which are used as long as the file
+does not change, so sweeping the grids does not parse the text again.
+
+'''
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 2
+
+# Columns with the initial mass of the star in the BaSTI and PARSEC isochrones
+MASS_COLUMNS = ('M/Mo(ini)', 'Mini')
+
+BASTI_HEADER = re.compile(r'\[M/H\]\s*=\s*(\S+)\s+Z\s*=\s*(\S+)\s+Y\s*=\s*(\S+)\s+Age \(Myr\)\s*=\s*(\S+)')
+# e.g. 12000z0054990y255P04O1D1E1.isc_acs -> P04O1D1E1 (alpha enhancement, overshooting, diffusion, ...)
+BASTI_FAMILY = re.compile(r'y\d+(\w+?)\.isc')
+
+# PARSEC labels of the evolutionary phases
+PARSEC_PHASES = {'MS': (1,), 'SGB': (2,), 'RGB': (3,), 'HB': (4, 5, 6), 'AGB': (7, 8)}
+PHASES = ('MS', 'SGB', 'RGB', 'HB', 'AGB')
+
+# Tables already read in this session, keyed by path and modification time
+_tables = {}
+
+
+def mass_column(iso):
+    """Name of the initial mass column of an isochrone table."""
+    for name in MASS_COLUMNS:
+        if name in iso.columns:
+            return name
+    raise ValueError(f"No mass column ({', '.join(MASS_COLUMNS)}) in the isochrone.")
+
+
+def _parse(file_name):
+    """Parse an isochrone file, see read_isochrone."""
+    with open(file_name) as f:
+        lines = f.readlines()
+
+    # The column names are in the first line that is not a comment, or in the last comment before
+    # the data (e.g. '#    M/Mo(ini)     M/Mo(fin) ...' in some BaSTI files)
+    header_row = next(i for i, line in enumerate(lines) if line.strip() and not line.startswith('#'))
+    if re.match(r'\s*[-+.\d]', lines[header_row]):
+        header = [line for line in lines[:header_row] if re.search('[A-Za-z]', line)][-1]
+        table = pd.read_csv(file_name, sep=r'\s+', skiprows=header_row, comment='#', header=None,
+                            names=header.lstrip('#').split())
+    else:
+        table = pd.read_csv(file_name, sep=r'\s+', skiprows=header_row, comment='#')
+    table = table.apply(pd.to_numeric, errors='coerce').dropna(how='all')
+
+    if 'MH' in table.columns:
+        # PARSEC: one isochrone for each (MH, logAge) in the file
+        table = table.rename(columns={name: name[:-3] for name in table.columns
+                                      if re.fullmatch(r'F\d+W\w?mag', name)})
+        blocks = []
+        for (mh, log_age), iso in table.groupby(['MH', 'logAge'], sort=False):
+            meta = {'model': 'PARSEC', 'family': 'PARSEC', 'MH': float(mh), 'Z': float(iso['Zini'].iloc[0]),
+                    'Y': float(iso['Y'].iloc[0]) if 'Y' in iso.columns else np.nan,
+                    'age': float(10 ** log_age / 1e6)}
+            blocks.append((meta, iso.reset_index(drop=True)))
+        return blocks
+
+    match = BASTI_HEADER.search(''.join(lines[:header_row]))
+    if match is None:
+        raise ValueError(f"Header with [M/H], Z, Y and age not found in '{file_name}'.")
+    family = BASTI_FAMILY.search(os.path.basename(file_name))
+    meta = {'model': 'BaSTI', 'family': family.group(1) if family else 'BaSTI',
+            'MH': float(match.group(1)), 'Z': float(match.group(2)), 'Y': float(match.group(3)),
+            'age': float(match.group(4))}
+    return [(meta, table.reset_index(drop=True))]
+
+
+def read_isochrone(file_name, cache=True):
+    """
+    Read a BaSTI (.isc_acs) or PARSEC (.dat) isochrone file.
+
+    Parameters:
+        file_name (str): Path to the isochrone file.
+        cache (bool): If True, use (and update) the .npz cache next to the file.
+
+    Returns:
+        list: One (meta, table) tuple per isochrone in the file, where meta is a dict with keys
+        'model', 'family', 'MH', 'Z', 'Y' and 'age' (in Myr) and table is a DataFrame.
+    """
+    stat = os.stat(file_name)
+    key = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    memory_key = (os.path.abspath(file_name), stat.st_mtime_ns)
+    if memory_key in _tables:
+        return _tables[memory_key]
+
+    directory, base_name = os.path.split(os.path.abspath(file_name))
+    cache_file = os.path.join(directory, f".{base_name}.npz")
+
+    blocks = None
+    if cache:
+        try:
+            with np.load(cache_file) as npz:
+                description = json.loads(str(npz['description']))
+                if description['key'] == key:
+                    blocks = [(meta, pd.DataFrame(npz[f'block_{i}'], columns=description['columns'][i]))
+                              for i, meta in enumerate(description['meta'])]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if blocks is None:
+        blocks = _parse(file_name)
+        if cache:
+            description = {'key': key, 'meta': [meta for meta, _ in blocks],
+                           'columns': [list(table.columns) for _, table in blocks]}
+            arrays = {f'block_{i}': table.to_numpy(dtype=float) for i, (_, table) in enumerate(blocks)}
+            try:
+                np.savez(cache_file, description=np.array(json.dumps(description)), **arrays)
+            except OSError:
+                # Read-only directory: work without the cache
+                pass
+
+    _tables[memory_key] = blocks
+    return blocks
+
+
+def _resample(iso, n_points):
+    """Resample the rows of an isochrone to n_points, linearly in the row number."""
+    position = np.linspace(0, len(iso) - 1, n_points)
+    return pd.DataFrame({name: np.interp(position, np.arange(len(iso)), iso[name].to_numpy(dtype=float))
+                         for name in iso.columns})
+
+
+def _align(isochrones):
+    """
+    Put the isochrones on the same rows, so that they can be combined row by row.
+
+    BaSTI isochrones have the same number of points at the same evolutionary phases. PARSEC isochrones
+    are resampled phase by phase, using the 'label' column.
+    """
+    if len({len(iso) for iso in isochrones}) == 1:
+        return [iso.reset_index(drop=True) for iso in isochrones]
+    if not all('label' in iso.columns for iso in isochrones):
+        raise ValueError("The isochrones have a different number of points and no 'label' column to align them.")
+
+    labels = sorted(set.intersection(*[set(iso['label']) for iso in isochrones]))
+    aligned = [[] for _ in isochrones]
+    for label in labels:
+        phases = [iso[iso['label'] == label] for iso in isochrones]
+        n_points = max(len(phase) for phase in phases)
+        for i, phase in enumerate(phases):
+            aligned[i].append(_resample(phase, n_points))
+    return [pd.concat(parts, ignore_index=True) for parts in aligned]
+
+
+class IsochroneStore:
+    def __init__(self, root=None, patterns=('*/FEHm*/*.isc_acs', 'FEHm*/*.isc_acs'), cache=True):
+        """
+        Index the isochrones of a folder.
+
+        Parameters:
+            root (str): Folder with the isochrones (e.g. TOTORO/FITS or TOTORO/FITS/47_Tuc), None for an empty store.
+            patterns (tuple): Glob patterns of the files to index, relative to root.
+            cache (bool): If True, use the .npz cache of the parsed files.
+        """
+        self.cache = cache
+        self.index = pd.DataFrame(columns=['file', 'block', 'model', 'family', 'MH', 'Z', 'Y', 'age'])
+        if root is not None:
+            for pattern in patterns:
+                for file_name in sorted(glob.glob(os.path.join(root, pattern))):
+                    self.add_file(file_name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add_file(self, file_name):
+        """Add all the isochrones of a file (BaSTI or PARSEC) to the store."""
+        rows = [dict(meta, file=file_name, block=i)
+                for i, (meta, _) in enumerate(read_isochrone(file_name, cache=self.cache))]
+        self.index = pd.concat([self.index, pd.DataFrame(rows)], ignore_index=True) if len(self.index) \
+            else pd.DataFrame(rows, columns=self.index.columns)
+        return self
+
+    def families(self):
+        """Families of models in the store (e.g. 'P04O1D1E1' for alpha-enhanced BaSTI, 'PARSEC')."""
+        return list(self.index['family'].unique())
+
+    def _nodes(self, family):
+        if family is None:
+            families = self.families()
+            if len(families) != 1:
+                raise ValueError(f"More than one family of isochrones in the store, choose one of {families}.")
+            family = families[0]
+        nodes = self.index[self.index['family'] == family]
+        if nodes.empty:
+            raise ValueError(f"No isochrones of family '{family}' in the store.")
+        return nodes
+
+    def load(self, row):
+        """Table of the isochrone in a row of the index."""
+        return read_isochrone(row['file'], cache=self.cache)[row['block']][1]
+
+    def get(self, age, mh, family=None):
+        """
+        Isochrone of a grid node.
+
+        Parameters:
+            age (float): Age in Myr.
+            mh (float): Metallicity [M/H].
+            family (str): Family of models, needed if the store has more than one.
+
+        Returns:
+            pd.DataFrame: The isochrone, None if the node is not in the grid.
+        """
+        nodes = self._nodes(family)
+        match = nodes[np.isclose(nodes['age'], age) & np.isclose(nodes['MH'], mh, atol=1e-6)]
+        if match.empty:
+            return None
+        return self.load(match.iloc[0])
+
+    def interpolate(self, age, mh, family=None):
+        """
+        Isochrone at any age and metallicity inside the grid, interpolated linearly between the nodes.
+
+        Parameters:
+            age (float): Age in Myr.
+            mh (float): Metallicity [M/H].
+            family (str): Family of models, needed if the store has more than one.
+
+        Returns:
+            pd.DataFrame: The interpolated isochrone.
+        """
+        nodes = self._nodes(family)
+        family = nodes['family'].iloc[0]
+        weights = {}
+        for name, value in (('age', age), ('MH', mh)):
+            grid = np.unique(nodes[name].to_numpy(dtype=float))
+            on_node = np.isclose(grid, value, atol=1e-6)
+            if on_node.any():
+                weights[name] = [(grid[on_node][0], 1.0)]
+            elif value < grid[0] or value > grid[-1]:
+                raise ValueError(f"{name} = {value} is outside the grid ({grid[0]} - {grid[-1]}).")
+            else:
+                upper = np.searchsorted(grid, value)
+                lower = upper - 1
+                fraction = (value - grid[lower]) / (grid[upper] - grid[lower])
+                weights[name] = [(grid[lower], 1 - fraction), (grid[upper], fraction)]
+
+        corners = []
+        for node_age, age_weight in weights['age']:
+            for node_mh, mh_weight in weights['MH']:
+                iso = self.get(node_age, node_mh, family)
+                if iso is None:
+                    raise ValueError(f"Missing grid node: age = {node_age} Myr, [M/H] = {node_mh}.")
+                corners.append((iso, age_weight * mh_weight))
+
+        isochrones = _align([iso for iso, _ in corners])
+        return sum(weight * iso for iso, (_, weight) in zip(isochrones, corners))
+
+    def sweep(self, family=None):
+        """Iterate over the nodes of the grid, yielding (age, mh, isochrone)."""
+        for _, row in self._nodes(family).sort_values(['MH', 'age']).iterrows():
+            yield row['age'], row['MH'], self.load(row)
+
+
+def monotonic_segments(values):
+    """
+    Split a sequence in pieces where it only increases or only decreases.
+
+    Returns:
+        list: (start, stop) row ranges, consecutive pieces share their boundary row.
+    """
+    step = np.sign(np.diff(values))
+    # Flat steps continue the previous piece
+    step = pd.Series(np.where(step == 0, np.nan, step)).ffill().bfill().to_numpy()
+    turns = np.flatnonzero(step[1:] != step[:-1]) + 1
+    edges = np.concatenate(([0], turns, [len(values) - 1]))
+    return [(start, stop + 1) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+class MassLookup:
+    def __init__(self, iso, magnitude='F814W', color=None):
+        """
+        Prepare an isochrone for mass-from-magnitude queries.
+
+        The isochrone is divided in evolutionary phases (MS, SGB, RGB, HB, AGB) and every phase in pieces
+        where the magnitude is monotonic, so each query is a binary search followed by a linear interpolation.
+
+        Parameters:
+            iso (pd.DataFrame): Isochrone (BaSTI or PARSEC).
+            magnitude (str): Filter of the magnitudes that will be looked up.
+            color (tuple): Two filters of a color, e.g. ('F606W', 'F814W'). Used to find the turnoff of the
+                isochrones without the PARSEC 'label' column; without it the MS, SGB and RGB are one phase 'MS'.
+        """
+        self.iso = iso.reset_index(drop=True)
+        self.magnitude = magnitude
+        self.mass = mass_column(self.iso)
+        mags = self.iso[magnitude].to_numpy(dtype=float)
+        self.phases = self._phases(mags, color)
+
+        # (phase, rows) of every monotonic piece, in isochrone order
+        self.segments = []
+        for phase, (start, stop) in self.phases.items():
+            if stop - start < 2:
+                continue
+            for seg_start, seg_stop in monotonic_segments(mags[start:stop]):
+                self.segments.append((phase, np.arange(start + seg_start, start + seg_stop)))
+
+    def _phases(self, mags, color):
+        """Row ranges (start, stop) of the evolutionary phases."""
+        if 'label' in self.iso.columns:
+            labels = self.iso['label'].to_numpy()
+            phases = {}
+            for phase in PHASES:
+                rows = np.flatnonzero(np.isin(labels, PARSEC_PHASES[phase]))
+                if len(rows):
+                    # Include the first row of the next phase, so there are no gaps between the phases
+                    phases[phase] = (rows[0], min(rows[-1] + 2, len(mags)))
+            return phases
+
+        # RGB tip: brightest point before the largest jump to fainter magnitudes (tip -> ZAHB)
+        jump = np.argmax(np.diff(mags))
+        tip = int(np.argmin(mags[:jump + 1]))
+        # ZAHB: end of the fading after the tip
+        zahb = tip + monotonic_segments(mags[tip:])[0][1] - 1
+        if color is None:
+            return {'MS': (0, tip + 1), 'HB': (zahb, len(mags))}
+
+        # Turnoff: bluest point of the main sequence
+        colors = (self.iso[color[0]] - self.iso[color[1]]).to_numpy(dtype=float)
+        turnoff = int(np.argmin(colors[:tip + 1]))
+        # Base of the RGB: after the turnoff the CMD flattens along the SGB, the RGB starts where it becomes
+        # steeper than the line from the turnoff to the tip again (slopes measured over a few rows)
+        window = max(1, (tip - turnoff) // 50)
+        d_mag = mags[turnoff + window:tip + 1] - mags[turnoff:tip + 1 - window]
+        d_color = colors[turnoff + window:tip + 1] - colors[turnoff:tip + 1 - window]
+        slope = (mags[turnoff] - mags[tip]) / (colors[tip] - colors[turnoff])
+        steep = -d_mag > slope * np.abs(d_color)
+        flat = np.flatnonzero(~steep)
+        rgb = np.flatnonzero(steep[flat[0]:]) + flat[0] if len(flat) else np.array([], dtype=int)
+        base = turnoff + (int(rgb[0]) if len(rgb) else 0)
+        return {'MS': (0, turnoff + 1), 'SGB': (turnoff, base + 1), 'RGB': (base, tip + 1), 'HB': (zahb, len(mags))}
+
+    def lookup(self, mags, column=None, phase=None):
+        """
+        Value of a column of the isochrone at given magnitudes.
+
+        Parameters:
+            mags (array-like): Magnitudes of the stars.
+            column (str): Column to interpolate, default the initial mass.
+            phase (str or list): Phase(s) to search (e.g. 'HB' for HB stars), default all of them.
+                When more than one piece of the isochrone has the magnitude, the first one along the isochrone
+                (lowest mass) is used.
+
+        Returns:
+            np.ndarray: Interpolated values, NaN for the magnitudes not covered by the selected phases.
+        """
+        column = self.mass if column is None else column
+        if isinstance(phase, str):
+            phase = [phase]
+        mags = np.asarray(mags, dtype=float)
+        values = self.iso[column].to_numpy(dtype=float)
+        iso_mags = self.iso[self.magnitude].to_numpy(dtype=float)
+
+        result = np.full(mags.shape, np.nan)
+        todo = np.isfinite(mags)
+        for segment_phase, rows in self.segments:
+            if phase is not None and segment_phase not in phase:
+                continue
+            if not todo.any():
+                break
+            seg_mags = iso_mags[rows]
+            seg_values = values[rows]
+            if seg_mags[-1] < seg_mags[0]:
+                seg_mags, seg_values = seg_mags[::-1], seg_values[::-1]
+
+            inside = todo & (mags >= seg_mags[0]) & (mags <= seg_mags[-1])
+            query = mags[inside]
+            upper = np.clip(np.searchsorted(seg_mags, query, side='right'), 1, len(seg_mags) - 1)
+            lower = upper - 1
+            width = seg_mags[upper] - seg_mags[lower]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(width > 0, (query - seg_mags[lower]) / width, 0.0)
+            result[inside] = seg_values[lower] + fraction * (seg_values[upper] - seg_values[lower])
+            todo &= ~inside
+
+        return result
+
+    def masses(self, mags, phase=None):
+        """Initial masses of stars with the given magnitudes, see lookup."""
+        return self.lookup(mags, phase=phase)
+
+    def mass_ratios(self, primary_mags, secondary_mags, primary_phase=None, secondary_phase=None):
+        """
+        Mass ratios m_secondary / m_primary of many pairs of stars.
+
+        Parameters:
+            primary_mags (array-like): Magnitudes of the primaries.
+            secondary_mags (array-like): Magnitudes of the secondaries.
+            primary_phase (str or list): Phase(s) of the primaries (e.g. 'HB').
+            secondary_phase (str or list): Phase(s) of the secondaries.
+
+        Returns:
+            tuple: (q, primary_mass, secondary_mass) arrays.
+        """
+        primary_mass = self.masses(primary_mags, phase=primary_phase)
+        secondary_mass = self.masses(secondary_mags, phase=secondary_phase)
+        return secondary_mass / primary_mass, primary_mass, secondary_mass
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+store = IsochroneStore('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc')
+print(store.index)
+
+# one node of the grid and an isochrone between the nodes
+iso_basti = store.get(12000, -0.398, family='P04O1D1E1')
+iso_basti = store.interpolate(11500, -0.40, family='P04O1D1E1')
+
+# PARSEC isochrones can be added to the same store
+store.add_file('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/isochrone_pd_47tuc_2.dat')
+iso_pd = store.get(12000, -0.45, family='PARSEC')
+
+# masses and mass ratios of all the binaries (magnitudes corrected for distance and reddening first)
+lookup = MassLookup(iso_pd, magnitude='F814W')
+primary_mags = primary_stars.loc[BS_HB_vis['primary'], 'F814W'].to_numpy()
+secondary_mags = primary_stars.loc[BS_HB_vis['secondary'], 'F814W'].to_numpy()
+BS_HB_vis['q'], BS_HB_vis['mass_primary'], BS_HB_vis['mass_secondary'] = lookup.mass_ratios(
+    primary_mags, secondary_mags, primary_phase='HB', secondary_phase=['MS', 'SGB', 'RGB'])
+
+'''
@@ -0,0 +1,191 @@
+
+'''
+======================================================
+                    PHOTOMETRIC ERRORS
+======================================================
+
+This module contains the classes to describe the photometric errors of the observed catalogues as a function of the
+magnitude and to add them to synthetic stars (test stars, binary grids, synthetic populations), so that synthetic and
+observed CMDs have the same spread.
+The main classes and functions are:
+    - ErrorModel: Error as a function of the magnitude in one filter, as a lookup table of the binned median error.
+      It can be fitted to the res_mag column of the MATCHUP files or to any table of magnitudes and errors.
+    - PhotometricErrors: One ErrorModel per filter, to perturb all the magnitudes of a table at once.
+
+The errors of the stars are interpolated in the lookup table (constant beyond its ends) and the perturbations are
+drawn from a seeded random generator, so the same seed always gives the same synthetic CMD.
+The MATCHUP files are read with xym_io, the reader of the reduction scripts, imported only by from_matchup: the
+reduction folder has to be on the path (like the tools folder) to fit the errors to a MATCHUP file.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class ErrorModel:
+    def __init__(self, mags, errors, bin_width=0.25, min_stars=10, zero_point=0.0, floor=0.0):
+        """
+        Fit the error as a function of the magnitude.
+
+        Parameters:
+            mags (array-like): Magnitudes of the stars.
+            errors (array-like): Error of each star (e.g. the res_mag column of MATCHUP.XYMEEE).
+            bin_width (float): Width of the magnitude bins.
+            min_stars (int): Bins with fewer stars are not part of the table.
+            zero_point (float): Added to the magnitudes (e.g. to move the instrumental magnitudes of MATCHUP to the
+                calibrated ones of the synthetic stars).
+            floor (float): Minimum error.
+        """
+        mags = np.asarray(mags, dtype=float) + zero_point
+        errors = np.asarray(errors, dtype=float)
+        good = np.isfinite(mags) & np.isfinite(errors) & (errors >= 0)
+        mags, errors = mags[good], errors[good]
+        if len(mags) == 0:
+            raise ValueError("No stars with a valid magnitude and error.")
+
+        # Median magnitude and error of every bin, from one sort of the stars by bin and error
+        bins = np.floor((mags - mags.min()) / bin_width).astype(np.int64)
+        order = np.lexsort((errors, bins))
+        bins, sorted_errors, sorted_mags = bins[order], errors[order], mags[order]
+        starts = np.flatnonzero(np.diff(bins, prepend=-1))
+        counts = np.diff(np.append(starts, len(bins)))
+        low, high = starts + (counts - 1) // 2, starts + counts // 2
+        keep = counts >= min_stars
+        if not keep.any():
+            raise ValueError(f"No magnitude bin with at least {min_stars} stars.")
+
+        centres = np.add.reduceat(sorted_mags, starts) / counts
+        medians = np.maximum((sorted_errors[low] + sorted_errors[high]) / 2, floor)
+        self.table = pd.DataFrame({'mag': centres[keep], 'error': medians[keep], 'n': counts[keep]})
+        self.mags = self.table['mag'].to_numpy()
+        self.errors = self.table['error'].to_numpy()
+
+    @classmethod
+    def from_table(cls, table):
+        """Error model from a lookup table with columns mag and error (e.g. saved with save)."""
+        model = cls.__new__(cls)
+        model.table = table[['mag', 'error']].sort_values('mag').reset_index(drop=True)
+        model.mags = model.table['mag'].to_numpy(dtype=float)
+        model.errors = model.table['error'].to_numpy(dtype=float)
+        return model
+
+    @classmethod
+    def from_matchup(cls, file_name, mag_range=None, **options):
+        """
+        Error model from the res_mag column of a MATCHUP.XYMEEE file.
+
+        Parameters:
+            file_name (str): Path of the MATCHUP file.
+            mag_range (tuple): (bright, faint) instrumental magnitudes to use, e.g. (-17.5, -5).
+            **options: Options of ErrorModel (bin_width, min_stars, zero_point, floor).
+        """
+        from xym_io import load_columns
+
+        # Columns as float (NaN for the star names and the ********* values), from the binary cache if it is there
+        columns, _ = load_columns(file_name)
+        mags, res_mags = columns[2], columns[5]
+        if mag_range is not None:
+            keep = (mags >= mag_range[0]) & (mags <= mag_range[1])
+            mags, res_mags = mags[keep], res_mags[keep]
+        return cls(mags, res_mags, **options)
+
+    @classmethod
+    def load(cls, file_name):
+        """Read a lookup table saved with save."""
+        return cls.from_table(pd.read_csv(file_name))
+
+    def save(self, file_name):
+        """Save the lookup table as CSV."""
+        self.table.to_csv(file_name, index=False)
+
+    def __call__(self, mags):
+        """Error at the given magnitudes (the errors of the first and last bins beyond the table, NaN for NaN)."""
+        mags = np.asarray(mags, dtype=float)
+        return np.where(np.isnan(mags), np.nan, np.interp(mags, self.mags, self.errors))
+
+    def perturb(self, mags, seed=None, rng=None):
+        """
+        Add a random Gaussian error to the magnitudes.
+
+        Parameters:
+            mags (array-like): Magnitudes (any shape).
+            seed (int): Seed of the random generator, ignored if rng is given.
+            rng (np.random.Generator): Random generator to use.
+
+        Returns:
+            np.ndarray: The perturbed magnitudes.
+        """
+        rng = np.random.default_rng(seed) if rng is None else rng
+        mags = np.asarray(mags, dtype=float)
+        return mags + rng.standard_normal(mags.shape) * self(mags)
+
+
+class PhotometricErrors:
+    def __init__(self, models):
+        """
+        Error models of many filters.
+
+        Parameters:
+            models (dict): Filter name -> ErrorModel.
+        """
+        self.models = dict(models)
+
+    @classmethod
+    def from_matchup(cls, files, zero_points=None, mag_range=None, **options):
+        """
+        Error models from the MATCHUP files of many filters.
+
+        Parameters:
+            files (dict): Filter name -> path of the MATCHUP file.
+            zero_points (dict): Filter name -> zero point added to the magnitudes.
+            mag_range (tuple): (bright, faint) instrumental magnitudes to use.
+            **options: Options of ErrorModel.
+        """
+        zero_points = zero_points or {}
+        return cls({name: ErrorModel.from_matchup(file_name, mag_range=mag_range,
+                                                  zero_point=zero_points.get(name, 0.0), **options)
+                    for name, file_name in files.items()})
+
+    def perturb(self, table, seed=None, filters=None, inplace=False):
+        """
+        Add random errors to the magnitudes of a table of synthetic stars.
+
+        Parameters:
+            table (pd.DataFrame): Synthetic stars, with one column per filter.
+            seed (int): Seed of the random generator.
+            filters (list[str]): Columns to perturb, default all the filters with a model that are in the table.
+            inplace (bool): If True, modify the table instead of returning a copy.
+
+        Returns:
+            pd.DataFrame: The perturbed table.
+        """
+        rng = np.random.default_rng(seed)
+        if filters is None:
+            filters = [name for name in self.models if name in table.columns]
+        if not inplace:
+            table = table.copy()
+        for name in filters:
+            table[name] = self.models[name].perturb(table[name].to_numpy(dtype=float), rng=rng)
+        return table
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+# the MATCHUP files are read with xym_io, from the reduction folder
+sys.path.append('/Users/giadaaggio/Desktop/Thesis/TOTORO/CODES/reduction')
+
+model = ErrorModel.from_matchup('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/F225W/MATCHUP_225.xym',
+                                mag_range=(-17.5, -5))
+print(model.table)
+model.save('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/F225W/errors_225.csv')
+
+# calibrated magnitudes: move the instrumental magnitudes of MATCHUP with the zero point of the filter
+errors = PhotometricErrors.from_matchup({'F225W': '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/F225W/MATCHUP_225.xym'},
+                                        zero_points={'F225W': zero_point_225}, mag_range=(-17.5, -5))
+binaries = errors.perturb(population.sample(1000000, seed=1), seed=2)
+
+'''
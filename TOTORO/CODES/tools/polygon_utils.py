@@ -0,0 +1,140 @@
+
+'''
+======================================================
+                    POLYGON UTILS
+======================================================
+
+This module contains the geometry shared by the tools that select stars with polygons, the regions of a CMD
+(CMDAnalyzer, region_uncertainty) and the polygons on the image (spatial_index).
+The main functions are:
+    - points_in_polygons: Vectorized ray-casting test of many points against many polygons.
+    - points_in_polygon: The same test against a single polygon.
+    - edge_distance: Distance of many points from the closest edge of the polygons.
+
+The points inside the bounding box of a polygon are tested with a ray going right from the point. The y of the
+vertices divide the polygon in horizontal slabs, and the ray of a point in a slab always crosses the same few
+edges, so every point is tested only against the edges of its slab (found with np.searchsorted) instead of all
+the edges of the polygon.
+
+'''
+
+import numpy as np
+
+
+def _slabs(polygon):
+    """
+    Edges crossed by a horizontal line in every slab of a polygon.
+
+    Returns:
+        tuple: (levels, x, y, dx, dy), levels the sorted y of the vertices and the other arrays with shape
+        (n_slabs, n_edges): first vertex and direction of the edges of the slab that starts at each level,
+        padded with edges at -inf that are never on the right of a point.
+    """
+    # Edges of the polygon (closed), without the horizontal ones that no ray can cross
+    start = polygon
+    end = np.roll(polygon, -1, axis=0)
+    edges = start[:, 1] != end[:, 1]
+    start, end = start[edges], end[edges]
+    delta = end - start
+
+    levels = np.unique(polygon[:, 1])
+    in_slab = ((np.minimum(start[:, 1], end[:, 1]) <= levels[:, None]) &
+               (levels[:, None] < np.maximum(start[:, 1], end[:, 1])))
+    order = np.argsort(~in_slab, axis=1, kind='stable')[:, :max(in_slab.sum(axis=1).max(), 1)]
+    padded = ~np.take_along_axis(in_slab, order, axis=1)
+    return (levels, np.where(padded, -np.inf, start[order, 0]), start[order, 1],
+            np.where(padded, 0.0, delta[order, 0]), np.where(padded, 1.0, delta[order, 1]))
+
+
+def points_in_polygons(x, y, polygons, chunk_size=65536):
+    """
+    Ray-casting test of many points against many polygons.
+
+    Parameters:
+        x (array-like): x coordinates of the points (the color in a CMD).
+        y (array-like): y coordinates of the points (the magnitude in a CMD).
+        polygons (iterable): (n, 2) vertices of every polygon, the polygons are closed automatically.
+        chunk_size (int): Number of points tested together, to bound the memory.
+
+    Returns:
+        np.ndarray: Boolean array with shape (n_points, n_polygons), True if the point is inside the polygon.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    polygons = [np.asarray(vertices, dtype=float) for vertices in polygons]
+    inside = np.zeros((len(x), len(polygons)), dtype=bool)
+
+    for k, polygon in enumerate(polygons):
+        # Only the points inside the bounding box of the polygon need the full test
+        (x_min, y_min), (x_max, y_max) = polygon.min(axis=0), polygon.max(axis=0)
+        candidates = np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+        levels, slab_x, slab_y, slab_dx, slab_dy = _slabs(polygon)
+
+        for i in range(0, len(candidates), chunk_size):
+            points = candidates[i:i + chunk_size]
+            px = x[points, None]
+            py = y[points, None]
+
+            # Count the edges crossed by the horizontal ray going right from each point
+            slab = np.searchsorted(levels, py[:, 0], side='right') - 1
+            hits = px < slab_x[slab] + (py - slab_y[slab]) * slab_dx[slab] / slab_dy[slab]
+            inside[points, k] = np.count_nonzero(hits, axis=1) % 2 == 1
+
+    return inside
+
+
+def points_in_polygon(x, y, vertices):
+    """
+    Ray-casting test of many points against one polygon.
+
+    Parameters:
+        x (np.ndarray): x coordinates of the points.
+        y (np.ndarray): y coordinates of the points.
+        vertices (array-like): (n, 2) vertices of the polygon, the polygon is closed automatically.
+
+    Returns:
+        np.ndarray: Boolean mask, True for the points inside the polygon.
+    """
+    return points_in_polygons(x, y, [vertices])[:, 0]
+
+
+def edge_distance(x, y, polygons):
+    """
+    Distance of every point from the closest edge of the polygons.
+
+    Parameters:
+        x (array-like): x coordinates of the points.
+        y (array-like): y coordinates of the points.
+        polygons (iterable): (n, 2) vertices of every polygon.
+
+    Returns:
+        np.ndarray: Distances in the units of the coordinates (inf without polygons).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    distance = np.full(len(x), np.inf)
+    for vertices in polygons:
+        vertices = np.asarray(vertices, dtype=float)
+        for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            dx, dy = x2 - x1, y2 - y1
+            length = dx * dx + dy * dy
+            # Closest point of the segment to each point
+            t = np.clip(((x - x1) * dx + (y - y1) * dy) / length, 0, 1) if length > 0 else 0.0
+            np.minimum(distance, np.hypot(x - x1 - t * dx, y - y1 - t * dy), out=distance)
+    return distance
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+regions = CMDRegionSelector.load_regions_cached('/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_RGB_F606W_F814W.csv')
+colors = data['F606W'] - data['F814W']
+mags = data['F814W']
+
+# Stars in every region and their distance from the closest edge
+inside = points_in_polygons(colors, mags, regions.values())
+distance = edge_distance(colors, mags, regions.values())
+
+'''
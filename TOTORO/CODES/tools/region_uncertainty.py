@@ -0,0 +1,252 @@
+
+'''
+======================================================
+                REGION COUNT UNCERTAINTIES
+======================================================
+
+This module contains a class to estimate the uncertainty of the number of stars in the regions of a CMD, instead of
+quoting sqrt(N) for every region.
+The main classes and functions are:
+    - RegionCounter: Count distributions of the regions from bootstrap resamples of the stars and from random
+      perturbations of the photometry within the errors, in parallel.
+    - poisson_interval: Exact (Garwood) Poisson confidence interval of a count.
+    - summarize: Median, standard deviation and confidence interval of every region from the count distributions.
+    - ratio_interval: Confidence interval of a ratio of counts (e.g. a binary fraction) from the count distributions.
+
+The stars are classified once. The stars farther than n_sigma errors from every edge of the regions cannot change
+region when the photometry is perturbed, so they are grouped by the set of regions they belong to, and a bootstrap
+resample of them is a single multinomial draw over the groups. Only the stars close to an edge are perturbed and
+classified again in every resample, so the cost of a resample depends on the number of stars close to an edge and
+not on the size of the catalogue. The resamples are computed in batches over a pool of processes.
+
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from CMDAnalyzer import CMDRegionSelector
+from polygon_utils import edge_distance
+
+
+def poisson_interval(counts, cl=0.68):
+    """
+    Exact (Garwood 1936) confidence interval of Poisson counts.
+
+    Parameters:
+        counts (array-like): Observed counts.
+        cl (float): Confidence level.
+
+    Returns:
+        tuple: (low, high) arrays.
+    """
+    counts = np.asarray(counts, dtype=float)
+    alpha = 1 - cl
+    low = np.where(counts > 0, stats.chi2.ppf(alpha / 2, 2 * counts) / 2, 0.0)
+    high = stats.chi2.ppf(1 - alpha / 2, 2 * counts + 2) / 2
+    return low, high
+
+
+def _resample(regions, pattern_inside, pattern_counts, colors, mags, color_errors, mag_errors, covariance, inside,
+              n_total, bootstrap, perturb, n, seed):
+    """
+    Counts of the regions in n resamples.
+
+    The first len(pattern_counts) categories of the bootstrap are the groups of stars far from the edges, the other
+    ones the single stars close to an edge (with their coordinates and errors).
+
+    Returns:
+        np.ndarray: Counts with shape (n, n_regions).
+    """
+    rng = np.random.default_rng(seed)
+    n_patterns = len(pattern_counts)
+    weights = np.concatenate((pattern_counts, np.ones(len(colors)))).astype(float)
+    probabilities = weights / weights.sum()
+    counts = np.empty((n, pattern_inside.shape[1]), dtype=np.int64)
+
+    for i in range(n):
+        draws = rng.multinomial(n_total, probabilities) if bootstrap else weights.astype(np.int64)
+        pattern_draws, star_draws = draws[:n_patterns], draws[n_patterns:]
+        counts[i] = pattern_draws @ pattern_inside
+        if len(colors) == 0:
+            continue
+        if not perturb:
+            counts[i] += star_draws @ inside
+            continue
+
+        # Perturb (and classify again) every copy of the stars drawn, each with its own errors
+        stars = np.repeat(np.arange(len(colors)), star_draws)
+        z1, z2 = rng.standard_normal((2, len(stars)))
+        sigma_mag = mag_errors[stars]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(sigma_mag > 0, covariance[stars] / sigma_mag, 0.0)
+        residual = np.sqrt(np.maximum(color_errors[stars] ** 2 - slope ** 2, 0))
+        new_mags = mags[stars] + sigma_mag * z1
+        new_colors = colors[stars] + slope * z1 + residual * z2
+        counts[i] += CMDRegionSelector.regions_membership(regions, new_colors, new_mags).sum(axis=0)
+    return counts
+
+
+class RegionCounter:
+    def __init__(self, colors, mags, regions_file, color_errors=None, mag_errors=None, covariance=None, n_sigma=5.0):
+        """
+        Classify the stars and prepare the resamples.
+
+        Parameters:
+            colors (array-like): Color of the stars.
+            mags (array-like): Magnitude of the stars.
+            regions_file (str): CSV file with the regions (from CMDRegionSelector).
+            color_errors (array-like): Error of the color of each star (or one value for all), needed to perturb.
+            mag_errors (array-like): Error of the magnitude of each star (or one value for all), needed to perturb.
+            covariance (array-like): Covariance of the color and magnitude errors, e.g. -err_814**2 for
+                F606W-F814W vs F814W (the filter of the magnitude is in the color). Default 0.
+            n_sigma (float): Stars closer than n_sigma errors to an edge are perturbed in every resample.
+        """
+        colors = np.asarray(colors, dtype=float)
+        mags = np.asarray(mags, dtype=float)
+        self.regions = CMDRegionSelector.load_regions_cached(regions_file)
+        self.region_ids = np.array(list(self.regions), dtype=int)
+        inside = CMDRegionSelector.regions_membership(self.regions, colors, mags)
+        self.observed = inside.sum(axis=0)
+        self.n_stars = len(colors)
+
+        if color_errors is None or mag_errors is None:
+            self.color_errors = self.mag_errors = None
+            near = np.zeros(len(colors), dtype=bool)
+        else:
+            self.color_errors = np.broadcast_to(np.asarray(color_errors, dtype=float), colors.shape)
+            self.mag_errors = np.broadcast_to(np.asarray(mag_errors, dtype=float), colors.shape)
+            scale = np.hypot(self.color_errors, self.mag_errors)
+            near = edge_distance(colors, mags, self.regions.values()) < n_sigma * scale
+        covariance = np.zeros(len(colors)) if covariance is None else covariance
+        covariance = np.broadcast_to(np.asarray(covariance, dtype=float), colors.shape)
+
+        # Stars far from the edges, grouped by the set of regions they belong to
+        self.pattern_inside, self.pattern_counts = np.unique(inside[~near], axis=0, return_counts=True)
+        self.pattern_inside = self.pattern_inside.astype(np.int64).reshape(-1, len(self.region_ids))
+        self.near = np.flatnonzero(near)
+        self.near_data = (colors[near], mags[near],
+                          None if self.color_errors is None else self.color_errors[near],
+                          None if self.mag_errors is None else self.mag_errors[near],
+                          covariance[near], inside[near].astype(np.int64))
+
+    def resample(self, n_resamples=1000, bootstrap=True, perturb=None, seed=None, jobs=1, batch_size=100):
+        """
+        Count distributions of the regions.
+
+        Parameters:
+            n_resamples (int): Number of resamples.
+            bootstrap (bool): If True, resample the stars with replacement.
+            perturb (bool): If True, perturb the photometry within the errors (default True if the errors were given).
+            seed (int): Seed of the random numbers, the same seed gives the same distributions for any jobs.
+            jobs (int): Number of processes, 0 uses all the available CPUs.
+            batch_size (int): Number of resamples computed at a time by each process.
+
+        Returns:
+            pd.DataFrame: One row per resample and one column per Region_ID.
+        """
+        if perturb is None:
+            perturb = self.color_errors is not None
+        if perturb and self.color_errors is None:
+            raise ValueError("The errors of the stars are needed to perturb the photometry.")
+        sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = [(self.regions, self.pattern_inside, self.pattern_counts) + self.near_data +
+                 (self.n_stars, bootstrap, perturb, size, batch_seed) for size, batch_seed in zip(sizes, seeds)]
+
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        jobs = max(1, min(jobs, len(tasks)))
+        if jobs == 1:
+            counts = [_resample(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                counts = list(executor.map(_resample, *zip(*tasks)))
+
+        counts = np.concatenate(counts) if counts else np.empty((0, len(self.region_ids)), dtype=np.int64)
+        return pd.DataFrame(counts, columns=self.region_ids)
+
+    def poisson(self, cl=0.68):
+        """
+        Observed counts with their Poisson uncertainty.
+
+        Returns:
+            pd.DataFrame: Columns Region_ID, Stars, Error (sqrt(N)), Low and High (exact interval).
+        """
+        low, high = poisson_interval(self.observed, cl)
+        return pd.DataFrame({'Region_ID': self.region_ids, 'Stars': self.observed,
+                             'Error': np.sqrt(self.observed), 'Low': low, 'High': high})
+
+    def summary(self, distributions, cl=0.68):
+        """Statistics of the count distributions (see summarize) next to the observed counts."""
+        result = summarize(distributions, cl)
+        result.insert(1, 'Stars', self.observed)
+        return result
+
+
+def summarize(distributions, cl=0.68):
+    """
+    Statistics of the count distributions.
+
+    Parameters:
+        distributions (pd.DataFrame): Output of RegionCounter.resample.
+        cl (float): Confidence level of the interval.
+
+    Returns:
+        pd.DataFrame: Columns Region_ID, Median, Std, Low and High (percentiles of the distribution).
+    """
+    values = distributions.to_numpy(dtype=float)
+    low, median, high = np.percentile(values, [50 * (1 - cl), 50, 50 * (1 + cl)], axis=0)
+    return pd.DataFrame({'Region_ID': distributions.columns.to_numpy(), 'Median': median,
+                         'Std': values.std(axis=0, ddof=1), 'Low': low, 'High': high})
+
+
+def ratio_interval(distributions, numerator, denominator, scale=1.0, cl=0.68):
+    """
+    Distribution and confidence interval of a ratio of counts, e.g. a binary fraction.
+
+    With the binary region as numerator, the region of the whole sequence as denominator and scale the fraction of
+    synthetic binaries that fall in the binary region (see binary_population.binary_fraction), the ratio is the
+    binary fraction.
+
+    Parameters:
+        distributions (pd.DataFrame): Output of RegionCounter.resample.
+        numerator (int or list[int]): Region_ID(s) summed in the numerator.
+        denominator (int or list[int]): Region_ID(s) summed in the denominator.
+        scale (float): The ratio is divided by scale.
+        cl (float): Confidence level of the interval.
+
+    Returns:
+        tuple: (ratios, (median, low, high)) with one ratio per resample.
+    """
+    numerator = distributions[np.atleast_1d(numerator)].to_numpy().sum(axis=1)
+    denominator = distributions[np.atleast_1d(denominator)].to_numpy().sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = numerator / denominator / scale
+    low, median, high = np.nanpercentile(ratios, [50 * (1 - cl), 50, 50 * (1 + cl)])
+    return ratios, (median, low, high)
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+# NGC 346: Poisson intervals instead of sqrt(N-1)
+counter = RegionCounter(data_NGC346_cluster['F555W_cal'] - data_NGC346_cluster['F814W_cal'], data_NGC346_cluster['F814W_cal'],
+                        '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/NGC346/regions_RGB_F555W_F814W.csv')
+print(counter.poisson())
+
+# 47 Tuc, bootstrap of the stars and perturbation of F606W-F814W vs F814W within the errors
+counter = RegionCounter(data['F606W'] - data['F814W'], data['F814W'],
+                        '/Users/giadaaggio/Desktop/Thesis/TOTORO/FITS/47_Tuc/regions_RGB_F606W_F814W.csv',
+                        color_errors=np.hypot(err_606, err_814), mag_errors=err_814, covariance=-err_814 ** 2)
+distributions = counter.resample(5000, seed=1, jobs=0)
+print(counter.summary(distributions))
+
+ratios, (fraction, low, high) = ratio_interval(distributions, numerator=1, denominator=0, scale=0.35)
+
+'''
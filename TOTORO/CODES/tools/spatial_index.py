@@ -0,0 +1,167 @@
+
+'''
+======================================================
+                    SPATIAL INDEX
+======================================================
+
+This module contains a class to select stars by their position on the image (x, y columns of catalog.xym,
+X, Y columns of the HUGS catalogues) without computing a distance column for every centre and radius.
+The main classes and functions are:
+    - SpatialIndex: KD-tree over the positions of a catalogue with radius, annulus, polygon and k-nearest queries,
+      also batched over many centres and radii (e.g. radial profiles).
+    - points_in_polygon: Vectorized ray-casting test of many points against a polygon (from polygon_utils).
+
+All the selections return boolean masks with one value per row of the catalogue, so they can be combined
+(e.g. cluster & ~center) and used directly as data[mask].
+
+'''
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from polygon_utils import points_in_polygon
+
+
+class SpatialIndex:
+    def __init__(self, data, x='x', y='y'):
+        """
+        Build the KD-tree over the positions of the stars.
+
+        Parameters:
+            data (pd.DataFrame): Catalogue with the positions of the stars.
+            x (str): Name of the x column (default 'x', 'X' for the HUGS catalogues).
+            y (str): Name of the y column (default 'y', 'Y' for the HUGS catalogues).
+        """
+        self.data = data
+        self.x = np.asarray(data[x], dtype=float)
+        self.y = np.asarray(data[y], dtype=float)
+        # Stars without a position are never selected
+        self.valid = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y))
+        self.tree = cKDTree(np.column_stack((self.x[self.valid], self.y[self.valid])))
+
+    def __len__(self):
+        return len(self.x)
+
+    def _candidates(self, center, radius):
+        """Positions (in the catalogue) and distances of the stars within radius of center."""
+        if np.isinf(radius):
+            positions = self.valid
+        else:
+            positions = self.valid[self.tree.query_ball_point(center, radius)]
+        distances = np.hypot(self.x[positions] - center[0], self.y[positions] - center[1])
+        return positions, distances
+
+    def _mask(self, positions):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def in_circle(self, center, radius):
+        """Mask of the stars with distance from center smaller than radius."""
+        positions, distances = self._candidates(center, radius)
+        return self._mask(positions[distances < radius])
+
+    def in_annulus(self, center, radius_min, radius_max=np.inf):
+        """
+        Mask of the stars with radius_min < distance < radius_max.
+
+        With the default radius_max this excludes the centre of the cluster, e.g.
+        data[index.in_annulus((5000, 5000), R_min)] keeps the stars outside R_min.
+        """
+        positions, distances = self._candidates(center, radius_max)
+        return self._mask(positions[(distances > radius_min) & (distances < radius_max)])
+
+    def in_polygon(self, vertices):
+        """Mask of the stars inside a polygon, testing only the stars in its bounding circle."""
+        vertices = np.asarray(vertices, dtype=float)
+        center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+        radius = np.hypot(*(vertices - center).T).max()
+        positions, _ = self._candidates(center, radius)
+        inside = points_in_polygon(self.x[positions], self.y[positions], vertices)
+        return self._mask(positions[inside])
+
+    def nearest(self, points, k=1):
+        """
+        k nearest stars of each point.
+
+        Parameters:
+            points (array-like): (n, 2) positions.
+            k (int): Number of neighbours.
+
+        Returns:
+            tuple: (distances, positions) arrays with shape (n, k), positions are row numbers of the catalogue.
+        """
+        distances, indices = self.tree.query(np.atleast_2d(points), k=k)
+        distances = distances.reshape(len(np.atleast_2d(points)), -1)
+        indices = indices.reshape(len(distances), -1)
+        # Missing neighbours (k larger than the catalogue) are returned as -1
+        positions = np.where(indices < len(self.valid), self.valid[np.minimum(indices, len(self.valid) - 1)], -1)
+        return distances, positions
+
+    def count_in_circles(self, centers, radii):
+        """
+        Number of stars within each radius of each centre, with a single tree query per centre.
+
+        Parameters:
+            centers (array-like): (n, 2) centres.
+            radii (array-like): Radii, the same for all the centres.
+
+        Returns:
+            np.ndarray: Counts with shape (n_centers, n_radii).
+        """
+        centers = np.atleast_2d(np.asarray(centers, dtype=float))
+        radii = np.atleast_1d(np.asarray(radii, dtype=float))
+        counts = np.empty((len(centers), len(radii)), dtype=np.int64)
+        for i, center in enumerate(centers):
+            _, distances = self._candidates(center, radii.max())
+            counts[i] = np.searchsorted(np.sort(distances), radii, side='left')
+        return counts
+
+    def radial_profile(self, center, radii):
+        """
+        Number of stars and surface density in the annuli between consecutive radii.
+
+        Returns:
+            tuple: (counts, density) arrays with len(radii) - 1 values.
+        """
+        radii = np.asarray(radii, dtype=float)
+        cumulative = self.count_in_circles([center], radii)[0]
+        counts = np.diff(cumulative)
+        area = np.pi * np.diff(radii ** 2)
+        return counts, counts / area
+
+    def in_circles(self, centers, radii):
+        """
+        Masks for many circles at once.
+
+        Parameters:
+            centers (array-like): (n, 2) centres.
+            radii (array-like): One radius per centre, or a single radius for all of them.
+
+        Returns:
+            np.ndarray: Boolean array with shape (n_centers, n_stars).
+        """
+        centers = np.atleast_2d(np.asarray(centers, dtype=float))
+        radii = np.broadcast_to(np.asarray(radii, dtype=float), len(centers))
+        return np.array([self.in_circle(center, radius) for center, radius in zip(centers, radii)])
+
+
+'''
+=============================
+EXAMPLE USAGE
+=============================
+
+index = SpatialIndex(data, x='x', y='y')
+
+# stars in NGC 346 and in the reference field
+data_NGC346_cluster = data[index.in_circle((4850, 4920), 750)]
+data_reference_field = data[index.in_circle((3000, 3000), 1500)]
+
+# exclude the center of 47 Tuc
+index = SpatialIndex(data, x='X', y='Y')
+data = data[index.in_annulus((5000, 5000), R_min)]
+
+# number of stars within many trial radii
+counts = index.count_in_circles([(4850, 4920), (5000, 7000)], np.arange(100, 2000, 50))
+
+'''
@@ -12,12 +12,224 @@ The main functions are:
     - color_index_noncalibrated: Generate color indices for a DataFrame based on the secondary star indices, ensuring HB stars have lighter colors.
     Suited for non-calibrated magnitudes.
     - color_index: Generate color indices for a DataFrame based on the secondary star indices. Suited for calibrated magnitudes.
+    - binary_system: Generate the magnitudes of all the primary/secondary pairs in any number of filters.
+    - binary_magnitudes: Kernel combining arrays of primary and secondary magnitudes.
+    - iter_binary_system: Generate the binary systems in blocks of pairs, optionally keeping only some mass ratios
+    or magnitudes, so that grids larger than the memory can be built.
+    - write_binary_system: Write the blocks directly to a text file (like BS_HB_vis.csv) or to a binary columnar directory.
+    - read_binary_system: Read a binary columnar directory, memory mapping the requested columns.
+
+The magnitudes are converted to fluxes once, and the fluxes of all the pairs are summed with NumPy
+broadcasting, so full isochrones can be combined (thousands of primaries x thousands of secondaries).
 
 ================================================================================
 '''
 
+import json
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+
 
 class BinaryStarUtils:
+    @staticmethod
+    def binary_magnitudes(primary_mags, secondary_mags):
+        """
+        Magnitudes of the binary systems formed by every primary with every secondary.
+
+        Parameters:
+            primary_mags (np.ndarray): Magnitudes of the primaries, shape (n_primaries, n_filters).
+            secondary_mags (np.ndarray): Magnitudes of the secondaries, shape (n_secondaries, n_filters).
+
+        Returns:
+            np.ndarray: Magnitudes of the binaries, shape (n_primaries, n_secondaries, n_filters).
+        """
+        primary_flux = 10 ** (-np.asarray(primary_mags, dtype=float) / 2.5)
+        secondary_flux = 10 ** (-np.asarray(secondary_mags, dtype=float) / 2.5)
+        return -2.5 * np.log10(primary_flux[:, None, :] + secondary_flux[None, :, :])
+
+    @staticmethod
+    def binary_system(df, primary_indices, filters):
+        """
+        Generate a DataFrame with magnitudes of binary systems for multiple primary stars and any number of filters.
+
+        Parameters:
+            df (pd.DataFrame): DataFrame containing stars with magnitudes in different filters.
+            primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
+            filters (list[str]): Names of the filter columns.
+
+        Returns:
+            pd.DataFrame: A new DataFrame containing binary system magnitudes, primary and secondary star indices,
+            with all the secondaries of the first primary, then all the secondaries of the second one, and so on.
+            For grids that do not fit in memory use iter_binary_system or write_binary_system.
+        """
+        filters = list(filters)
+        primary_indices = np.asarray(primary_indices)
+        magnitudes = BinaryStarUtils.binary_magnitudes(df.loc[primary_indices, filters].to_numpy(),
+                                                       df[filters].to_numpy())
+
+        result = {
+            "primary": np.repeat(primary_indices, len(df)),  # Primary star index
+            "secondary": np.tile(df.index.to_numpy(), len(primary_indices)),  # Secondary star indices
+        }
+        for i, filter_name in enumerate(filters):
+            result[filter_name] = magnitudes[:, :, i].ravel()
+
+        return pd.DataFrame(result)
+
+    @staticmethod
+    def iter_binary_system(df, primary_indices, filters, chunk_size=1000000, mass_column=None, q_min=None, q_max=None,
+                           mag_limits=None):
+        """
+        Generate the binary systems in blocks of at most chunk_size primary/secondary pairs.
+
+        The blocks come in the same order as the rows of binary_system. The pairs outside the mass ratio range
+        are dropped before computing their magnitudes.
+
+        Parameters:
+            df (pd.DataFrame): DataFrame containing stars with magnitudes in different filters.
+            primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
+            filters (list[str]): Names of the filter columns.
+            chunk_size (int): Maximum number of pairs in a block.
+            mass_column (str): Column with the masses, needed to select on the mass ratio.
+            q_min (float): Minimum mass ratio m_secondary / m_primary.
+            q_max (float): Maximum mass ratio m_secondary / m_primary.
+            mag_limits (dict): Filter name -> (min, max) range of the binary magnitude to keep.
+
+        Yields:
+            pd.DataFrame: Block with columns primary, secondary, the filters and, if mass_column is given, q.
+        """
+        filters = list(filters)
+        primary_indices = np.asarray(primary_indices)
+        if (q_min is not None or q_max is not None) and mass_column is None:
+            raise ValueError("mass_column is needed to select on the mass ratio.")
+
+        # Fluxes are computed once for all the stars
+        primary_flux = 10 ** (-df.loc[primary_indices, filters].to_numpy(dtype=float) / 2.5)
+        secondary_flux = 10 ** (-df[filters].to_numpy(dtype=float) / 2.5)
+        secondary_index = df.index.to_numpy()
+        if mass_column is not None:
+            primary_mass = df.loc[primary_indices, mass_column].to_numpy(dtype=float)
+            secondary_mass = df[mass_column].to_numpy(dtype=float)
+
+        # Blocks of primaries with all the secondaries, or blocks of secondaries of one primary
+        n_secondaries = len(df)
+        secondaries_per_block = max(1, min(n_secondaries, chunk_size))
+        primaries_per_block = max(1, chunk_size // max(n_secondaries, 1))
+
+        for p_start in range(0, len(primary_indices), primaries_per_block):
+            p_block = slice(p_start, p_start + primaries_per_block)
+            for s_start in range(0, n_secondaries, secondaries_per_block):
+                s_block = slice(s_start, s_start + secondaries_per_block)
+
+                # Pairs in the block, primary-major
+                n_p = len(primary_indices[p_block])
+                n_s = len(secondary_index[s_block])
+                i = np.repeat(np.arange(n_p), n_s)
+                j = np.tile(np.arange(n_s), n_p)
+
+                if mass_column is not None:
+                    q = secondary_mass[s_block][j] / primary_mass[p_block][i]
+                    keep = np.ones(len(q), dtype=bool)
+                    if q_min is not None:
+                        keep &= q >= q_min
+                    if q_max is not None:
+                        keep &= q <= q_max
+                    i, j, q = i[keep], j[keep], q[keep]
+
+                magnitudes = -2.5 * np.log10(primary_flux[p_block][i] + secondary_flux[s_block][j])
+
+                if mag_limits:
+                    keep = np.ones(len(i), dtype=bool)
+                    for filter_name, (mag_min, mag_max) in mag_limits.items():
+                        column = magnitudes[:, filters.index(filter_name)]
+                        keep &= (column >= mag_min) & (column <= mag_max)
+                    i, j, magnitudes = i[keep], j[keep], magnitudes[keep]
+                    if mass_column is not None:
+                        q = q[keep]
+
+                if len(i) == 0:
+                    continue
+
+                block = {"primary": primary_indices[p_block][i], "secondary": secondary_index[s_block][j]}
+                for k, filter_name in enumerate(filters):
+                    block[filter_name] = magnitudes[:, k]
+                if mass_column is not None:
+                    block["q"] = q
+                yield pd.DataFrame(block)
+
+    @staticmethod
+    def write_binary_system(output_file, df, primary_indices, filters, chunk_size=1000000, **selection):
+        """
+        Write the binary systems block by block, without keeping the whole grid in memory.
+
+        Parameters:
+            output_file (str): A .csv file is written as text, in the format of BS_HB_vis.csv
+                (space separated, 4 decimals); any other path is a directory with one binary file per column.
+            df, primary_indices, filters, chunk_size: As in iter_binary_system.
+            **selection: mass_column, q_min, q_max and mag_limits, as in iter_binary_system.
+
+        Returns:
+            int: Number of binary systems written.
+        """
+        blocks = BinaryStarUtils.iter_binary_system(df, primary_indices, filters, chunk_size=chunk_size, **selection)
+        n_rows = 0
+
+        if output_file.endswith('.csv'):
+            with open(output_file, 'w') as f:
+                for block in blocks:
+                    block.to_csv(f, index=False, header=(n_rows == 0), float_format='%.4f', sep=' ')
+                    n_rows += len(block)
+            return n_rows
+
+        os.makedirs(output_file, exist_ok=True)
+        files = {}
+        dtypes = {}
+        try:
+            for block in blocks:
+                for name in block.columns:
+                    if name not in files:
+                        files[name] = open(os.path.join(output_file, f"{name}.bin"), 'wb')
+                        dtypes[name] = block[name].dtype.newbyteorder('<').str
+                    block[name].to_numpy().astype(dtypes[name]).tofile(files[name])
+                n_rows += len(block)
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(output_file, 'columns.json'), 'w') as f:
+            json.dump({'n_rows': n_rows, 'columns': list(dtypes), 'dtypes': dtypes}, f)
+        return n_rows
+
+    @staticmethod
+    def read_binary_system(input_dir, columns=None):
+        """
+        Read binary systems written by write_binary_system in binary format.
+
+        Parameters:
+            input_dir (str): Directory written by write_binary_system.
+            columns (list[str]): Columns to read (default all), the others are not touched.
+
+        Returns:
+            pd.DataFrame: The binary systems.
+        """
+        with open(os.path.join(input_dir, 'columns.json')) as f:
+            description = json.load(f)
+        if columns is None:
+            columns = description['columns']
+
+        result = {}
+        for name in columns:
+            if description['n_rows'] == 0:
+                result[name] = np.empty(0, dtype=description['dtypes'][name])
+            else:
+                result[name] = np.memmap(os.path.join(input_dir, f"{name}.bin"), dtype=description['dtypes'][name],
+                                         mode='r', shape=(description['n_rows'],))
+        return pd.DataFrame(result)
+
     @staticmethod
     def binary_system_HB(df, primary_indices, filter1, filter2, source_column='source', hb_label='HB_test_stars'):
         """
@@ -40,33 +252,7 @@ class BinaryStarUtils:
             if df.loc[star_index, source_column] != hb_label:
                 raise ValueError(f"Star at index {star_index} is not labeled as an HB star.")
 
-        # List to store results
-        results = []
-
-        for star_index in primary_indices:
-            # Extract primary magnitudes
-            mag1_p = df.loc[star_index, filter1]
-            mag2_p = df.loc[star_index, filter2]
-
-            # Compute binary magnitudes using vectorized operations
-            mag1_bin = -2.5 * np.log10(10 ** (-mag1_p / 2.5) + 10 ** (-df[filter1] / 2.5))
-            mag2_bin = -2.5 * np.log10(10 ** (-mag2_p / 2.5) + 10 ** (-df[filter2] / 2.5))
-
-            # Create a temporary DataFrame for this primary
-            temp_df = pd.DataFrame({
-                "primary": star_index,  # Add primary star index
-                "secondary": df.index,  # Add secondary star indices
-                filter1: mag1_bin,
-                filter2: mag2_bin
-            })
-
-            # Append to results
-            results.append(temp_df)
-
-        # Concatenate all results into a single DataFrame
-        result_df = pd.concat(results, ignore_index=True)
-
-        return result_df
+        return BinaryStarUtils.binary_system(df, primary_indices, [filter1, filter2])
 
 
     @staticmethod
@@ -79,8 +265,6 @@ class BinaryStarUtils:
             primary_indices (list[int]): List of indices for the chosen primary stars in the DataFrame.
             filter1 (str): The name of the first filter column.
             filter2 (str): The name of the second filter column.
-            source_column (str): Column name identifying the source of the stars. Default is 'source'.
-            hb_label (str): Label identifying horizontal branch stars in the source column. Default is 'HB_test_stars'.
 
         Returns:
             pd.DataFrame: A new DataFrame containing binary system magnitudes, primary and secondary star indices.
@@ -89,33 +273,7 @@ class BinaryStarUtils:
         if not all(0 <= idx < len(df) for idx in primary_indices):
             raise ValueError("One or more primary indices are out of bounds for the DataFrame.")
 
-        # List to store results
-        results = []
-
-        for star_index in primary_indices:
-            # Extract primary magnitudes
-            mag1_p = df.loc[star_index, filter1]
-            mag2_p = df.loc[star_index, filter2]
-
-            # Compute binary magnitudes using vectorized operations
-            mag1_bin = -2.5 * np.log10(10 ** (-mag1_p / 2.5) + 10 ** (-df[filter1] / 2.5))
-            mag2_bin = -2.5 * np.log10(10 ** (-mag2_p / 2.5) + 10 ** (-df[filter2] / 2.5))
-
-            # Create a temporary DataFrame for this primary
-            temp_df = pd.DataFrame({
-                "primary": star_index,  # Add primary star index
-                "secondary": df.index,  # Add secondary star indices
-                filter1: mag1_bin,
-                filter2: mag2_bin
-            })
-
-            # Append to results
-            results.append(temp_df)
-
-        # Concatenate all results into a single DataFrame
-        result_df = pd.concat(results, ignore_index=True)
-
-        return result_df
+        return BinaryStarUtils.binary_system(df, primary_indices, [filter1, filter2])
     
     # if working with instrumental magnitudes use this function
     @staticmethod